@@ -14,3 +14,9 @@ from django.core.asgi import get_asgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'accounts.settings')
 
 application = get_asgi_application()
+
+# URLやシリアライザーを読み込んでおき、最初のリクエストを遅くしない
+# gunicornの preload_app ではforkする前に実行され、ワーカー間でメモリが共有される
+from .warmup import preload  # noqa: E402
+
+preload()
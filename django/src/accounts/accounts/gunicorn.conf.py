@@ -0,0 +1,68 @@
+"""
+本番用のgunicornの設定
+
+WSGI:  gunicorn -c accounts/gunicorn.conf.py
+ASGI:  WEB_SERVER=asgi gunicorn -c accounts/gunicorn.conf.py  (uvicorn-workerのワーカーを使う)
+
+環境変数
+  WEB_BIND          待ち受けるアドレス (既定は 0.0.0.0:8000)
+  WEB_SERVER        wsgi か asgi
+  WEB_CONCURRENCY   ワーカープロセスの数 (既定は CPU数*2+1)
+  WEB_THREADS       WSGIのワーカー毎のスレッド数 (2以上でgthreadワーカーになる)
+  WEB_PRELOAD       1ならマスターでアプリを読み込んでからforkする (既定は1)
+  WEB_TIMEOUT       ワーカーのタイムアウト(秒)
+  LOGINS_METRICS_DIR ワーカーのメトリクスを集計するディレクトリ (既定は /tmp/logins-metrics)
+  LOGINS_REDIS_URL  ワーカー間で共有するキャッシュのRedis (複数のワーカーでは必須)
+  LOGINS_API_ONLY   1ならAPIだけを提供し、管理サイト、セッション、メッセージを読み込まない
+  LOGINS_NUM_PROXIES 前に置いたリバースプロキシの数 (既定は0で、X-Forwarded-For を信用しない)
+  LOGINS_METRICS_TOKEN /metrics をループバック以外から読むスクレイパーが送るBearerトークン
+"""
+import glob
+import multiprocessing
+import os
+
+# manage.py と同じディレクトリから accounts パッケージを読み込む
+chdir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+raw_env = ["DJANGO_SETTINGS_MODULE=" + os.environ.get("DJANGO_SETTINGS_MODULE", "accounts.settings")]
+
+bind = os.environ.get("WEB_BIND", "0.0.0.0:8000")
+workers = int(os.environ.get("WEB_CONCURRENCY", multiprocessing.cpu_count() * 2 + 1))
+threads = int(os.environ.get("WEB_THREADS", "1"))
+timeout = int(os.environ.get("WEB_TIMEOUT", "30"))
+preload_app = os.environ.get("WEB_PRELOAD", "1") == "1"
+
+if os.environ.get("WEB_SERVER", "wsgi") == "asgi":
+    wsgi_app = "accounts.asgi:application"
+    # uvicornのワーカーはイベントループの1スレッドで動き、ORMは別のスレッドで実行される
+    # そのためウォームアップでのデータベースへの接続は最初のリクエストでは使われない
+    worker_class = "uvicorn_worker.UvicornWorker"
+else:
+    wsgi_app = "accounts.wsgi:application"
+    worker_class = "gthread" if threads > 1 else "sync"
+
+# リクエストの処理時間が延びる前にワーカーを入れ替えて、メモリの断片化を防ぐ
+max_requests = int(os.environ.get("WEB_MAX_REQUESTS", "10000"))
+max_requests_jitter = max_requests // 10
+
+accesslog = "-"
+
+# /metrics がどのワーカーに届いても全ワーカーの合計を返せるように、スナップショットを共有する
+metrics_dir = os.environ.setdefault("LOGINS_METRICS_DIR", "/tmp/logins-metrics")
+
+
+def on_starting(server):
+    """
+    前回の起動のメトリクスを消す
+    """
+    for path in glob.glob(os.path.join(metrics_dir, "*.json")):
+        os.remove(path)
+
+
+def post_worker_init(worker):
+    """
+    forkした後、ワーカーがリクエストを受け付ける前にウォームアップする
+    """
+    from accounts.warmup import warmup_worker
+    timings = warmup_worker()
+    worker.log.info("warmup done in %.1fms: %s", sum(timings.values()) * 1000,
+                    ", ".join("%s=%.1fms" % (name, seconds * 1000) for name, seconds in timings.items()))
@@ -10,6 +10,8 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/4.2/ref/settings/
 """
 
+import importlib.util
+import os
 from pathlib import Path
 import datetime
 
@@ -31,6 +33,18 @@ ALLOWED_HOSTS = []
 
 # Application definition
 
+# LOGINS_API_ONLY=1 のプロセスはAPIだけを提供し、管理サイトとそのためのアプリ、ミドルウェア、
+# テンプレートを読み込まない (起動とリクエストが軽くなる)。管理サイトは別のプロセスで動かす
+API_ONLY = os.environ.get('LOGINS_API_ONLY') == '1'
+
+# 管理サイト(ブラウザ)のためのアプリ
+BROWSER_APPS = [
+    'django.contrib.admin',
+    'django.contrib.sessions',
+    'django.contrib.messages',
+    'django.contrib.staticfiles',
+]
+
 INSTALLED_APPS = [
     'django.contrib.admin',
     'django.contrib.auth',
@@ -43,18 +57,37 @@ INSTALLED_APPS = [
     'logins.apps.LoginsConfig', # ユーザー認証
 ]
 
+if API_ONLY:
+    INSTALLED_APPS = [app for app in INSTALLED_APPS if app not in BROWSER_APPS]
+
 AUTH_USER_MODEL = "logins.User" # カスタムユーザーを認証用ユーザーとして登録
 
+# 管理サイトのためのミドルウェア。LOGINS['API_PATH_PREFIXES'] のパスでは何もしない (logins/browser.py)
+BROWSER_MIDDLEWARE = [
+    'logins.browser.SessionMiddleware',
+    'logins.browser.CsrfViewMiddleware',
+    'logins.browser.AuthenticationMiddleware',
+    'logins.browser.MessageMiddleware',
+    'logins.browser.XFrameOptionsMiddleware',
+]
+
 MIDDLEWARE = [
+    'logins.middleware.MetricsMiddleware', # URL名毎のレイテンシとクエリを /metrics で公開する
     'django.middleware.security.SecurityMiddleware',
-    'django.contrib.sessions.middleware.SessionMiddleware',
+    'logins.browser.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
-    'django.middleware.csrf.CsrfViewMiddleware',
-    'django.contrib.auth.middleware.AuthenticationMiddleware',
-    'django.contrib.messages.middleware.MessageMiddleware',
-    'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    'logins.browser.CsrfViewMiddleware',
+    'logins.browser.AuthenticationMiddleware',
+    'logins.browser.MessageMiddleware',
+    'logins.browser.XFrameOptionsMiddleware',
+    'logins.middleware.SilentRefreshMiddleware', # 切れそうなアクセストークンのクッキーを同じレスポンスで更新する
+    'logins.middleware.HashTimingMiddleware', # パスワードのハッシュ時間をServer-Timingで返す
+    'logins.middleware.ReplicaStickinessMiddleware', # 書き込んだクライアントはしばらくプライマリから読み込む
 ]
 
+if API_ONLY:
+    MIDDLEWARE = [middleware for middleware in MIDDLEWARE if middleware not in BROWSER_MIDDLEWARE]
+
 ROOT_URLCONF = 'accounts.urls'
 
 TEMPLATES = [
@@ -73,6 +106,10 @@ TEMPLATES = [
     },
 ]
 
+if API_ONLY:
+    # テンプレートを使うのは管理サイトとDRFのBrowsableAPIRendererだけ
+    TEMPLATES = []
+
 WSGI_APPLICATION = 'accounts.wsgi.application'
 
 
@@ -89,9 +126,51 @@ DATABASES = {
         'PASSWORD': 'password',
         'HOST': 'db',
         'PORT': '3306',
-    }
+        # 接続をリクエスト毎に作り直さず、TLSと認証のハンドシェイクを省く
+        # 再利用する前に接続が生きているかを確認する
+        'CONN_MAX_AGE': 600,
+        'CONN_HEALTH_CHECKS': True,
+    },
+    # 読み込み用のレプリカを使う時は追加して LOGINS['READ_REPLICAS'] に名前を入れる
+    # 'replica': {
+    #     'ENGINE': 'django.db.backends.mysql',
+    #     'NAME': 'mysql',
+    #     'USER': 'root',
+    #     'PASSWORD': 'password',
+    #     'HOST': 'db-replica',
+    #     'PORT': '3306',
+    #     'CONN_MAX_AGE': 600,
+    #     'CONN_HEALTH_CHECKS': True,
+    #     'TEST': {'MIRROR': 'default'},
+    # },
 }
 
+# 読み込みをレプリカ、書き込みをプライマリに振り分ける
+DATABASE_ROUTERS = ['logins.routers.PrimaryReplicaRouter']
+
+
+# Cache
+# https://docs.djangoproject.com/en/4.2/topics/cache/
+# ユーザー一覧のキャッシュ、失効リスト、スロットル、サイレントリフレッシュのロックは
+# 全てのワーカーで共有する必要があるので、LOGINS_REDIS_URL があればRedisを使う (docker-compose.yml)
+# 無ければプロセス毎のLocMemCacheで、1プロセスの開発環境でだけ使える (システムチェック logins.E001, W001)
+
+REDIS_URL = os.environ.get('LOGINS_REDIS_URL')
+
+if REDIS_URL:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': REDIS_URL,
+        }
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        }
+    }
+
 
 # Password validation
 # https://docs.djangoproject.com/en/4.2/ref/settings/#auth-password-validators
@@ -116,12 +195,36 @@ REST_FRAMEWORK = {
         'rest_framework.permissions.AllowAny',
     ],  
     'DEFAULT_AUTHENTICATION_CLASSES': [
-        'rest_framework_simplejwt.authentication.JWTAuthentication',
+        'logins.authentication.JWTAuthentication', # 検証結果をリクエスト単位でメモ化する
+    ],
+    # orjsonでエンコード、デコードする (DRFと同じJSONを返す)。Accept、Content-Typeが
+    # application/msgpack ならMessagePackで返す、受け取る (logins/renderers.py, logins/parsers.py)
+    'DEFAULT_RENDERER_CLASSES': [
+        'logins.renderers.JSONRenderer',
+        'logins.renderers.MessagePackRenderer',
+        'rest_framework.renderers.BrowsableAPIRenderer',
+    ],
+    'DEFAULT_PARSER_CLASSES': [
+        'logins.parsers.JSONParser',
+        'logins.parsers.MessagePackParser',
+        'rest_framework.parsers.FormParser',
+        'rest_framework.parsers.MultiPartParser',
     ],
     'NON_FIELD_ERRORS_KEY': 'detail',
-    'TEST_REQUEST_DEFAULT_FORMAT': 'json'
+    'TEST_REQUEST_DEFAULT_FORMAT': 'json',
+    # スロットルと監査ログがクライアントのIPに使う X-Forwarded-For の段数 (前に置くプロキシの数)
+    # 既定の0は REMOTE_ADDR を使う。無いとクライアントが X-Forwarded-For を変えてIP毎の制限を逃れられる
+    'NUM_PROXIES': int(os.environ.get('LOGINS_NUM_PROXIES', '0')),
 }
 
+if API_ONLY:
+    REST_FRAMEWORK['DEFAULT_RENDERER_CLASSES'].remove('rest_framework.renderers.BrowsableAPIRenderer')
+
+# MessagePackは msgpack がインストールされている時だけ受け付ける
+if importlib.util.find_spec('msgpack') is None:
+    REST_FRAMEWORK['DEFAULT_RENDERER_CLASSES'].remove('logins.renderers.MessagePackRenderer')
+    REST_FRAMEWORK['DEFAULT_PARSER_CLASSES'].remove('logins.parsers.MessagePackParser')
+
 SIMPLE_JWT = {
     'SIGNING_KEY': SECRET_KEY,
     'ALGORITHM': 'HS256',
@@ -129,8 +232,113 @@ SIMPLE_JWT = {
     'ROTATE_REFRESH_TOKENS': True,
     'ACCESS_TOKEN_LIFETIME': datetime.timedelta(minutes=30),
     'REFRESH_TOKEN_LIFETIME': datetime.timedelta(days=14),
+    'TOKEN_OBTAIN_SERIALIZER': 'logins.serializer.TokenObtainPairSerializer', # ユーザーのクレームを埋め込む
+    # 失効リストを確認するトークン (logins/revocation.py)
+    'AUTH_TOKEN_CLASSES': ('logins.tokens.AccessToken',),
+    'TOKEN_REFRESH_SERIALIZER': 'logins.serializer.TokenRefreshSerializer',
+    'TOKEN_VERIFY_SERIALIZER': 'logins.serializer.TokenVerifySerializer',
+    'BLACKLIST_AFTER_ROTATION': True, # ローテーション前のリフレッシュトークンを失効させる
+}
+
+# logins アプリの設定 (デフォルト値は logins/conf.py)
+LOGINS = {
+    # JWT認証でリクエストユーザーを作る方法 "db" | "cache" | "claims"
+    'AUTH_USER_MODE': 'db',
+    'USER_CACHE_SIZE': 10000,
+    'USER_CACHE_TTL': 60,
+    # ユーザー一覧のページネーションとストリーミング
+    'INDEX_PAGE_SIZE': 100,
+    'INDEX_MAX_PAGE_SIZE': 1000,
+    'INDEX_STREAM_CHUNK_SIZE': 2000,
+    # ユーザー一覧のキャッシュ
+    'USER_LIST_CACHE': 'default',
+    'USER_LIST_CACHE_TTL': 300,
+    # パスワードハッシュのポリシー。デプロイ毎に manage.py benchmark password_hashers で測って決める
+    # 保存済みのハッシュがポリシーと違う場合はログイン時に再ハッシュされる
+    'PASSWORD_ALGORITHM': 'pbkdf2_sha256', # pbkdf2_sha256 | argon2 | bcrypt_sha256 | scrypt
+    'PBKDF2_ITERATIONS': 600000,
+    'ARGON2_TIME_COST': 2,
+    'ARGON2_MEMORY_COST': 102400,
+    'ARGON2_PARALLELISM': 8,
+    'BCRYPT_ROUNDS': 12,
+    'SCRYPT_WORK_FACTOR': 2 ** 14,
+    # パスワードのハッシュと検証を専用のワーカープールで行う
+    'HASH_POOL': False,
+    'HASH_POOL_KIND': 'thread', # thread | process
+    'HASH_POOL_WORKERS': 4,
+    'HASH_POOL_MAX_QUEUE': 16,
+    'HASH_POOL_TIMEOUT': 10,
+    'HASH_POOL_RETRY_AFTER': 1,
+    # 一括登録・一括更新のユーザーの最大数
+    'BATCH_MAX_SIZE': 1000,
+    # ログアウトしたトークンの失効リスト。共有ストアはCACHESの名前で、本番では永続化されるものを使う
+    # (プロセス毎のLocMemCacheはシステムチェックのエラー logins.E001 になる)
+    'REVOCATION': True,
+    'REVOCATION_CACHE': 'default',
+    'REVOCATION_SYNC_INTERVAL': 1.0,
+    'REVOCATION_BLOOM_CAPACITY': 100000,
+    'REVOCATION_BLOOM_ERROR_RATE': 0.001,
+    # RS256/EdDSAで署名する時は鍵を設定する (cryptographyが必要)。公開鍵は /.well-known/jwks.json で配布される
+    'SIGNING_KEYS': [],
+    'SIGNING_ACCEPT_LEGACY': True, # リフレッシュトークンの有効期限が過ぎたらFalseにする
+    'JWKS_MAX_AGE': 3600,
+    'READ_REPLICAS': [],
+    'REPLICA_STICKY_SECONDS': 5,
+    'METRICS': True,
+    # gunicornのワーカー間で集計するディレクトリ (起動時に空にする)
+    'METRICS_DIR': os.environ.get('LOGINS_METRICS_DIR'),
+    'METRICS_FLUSH_INTERVAL': 5.0,
+    # /metrics はループバックか、"Authorization: Bearer $LOGINS_METRICS_TOKEN" を送ったスクレイパーにだけ返す
+    'METRICS_ALLOWED_IPS': ('127.0.0.1', '::1'),
+    'METRICS_TOKEN': os.environ.get('LOGINS_METRICS_TOKEN'),
+    # パスワードのハッシュが必要なエンドポイントの制限。CACHESを共有のもの(Redisなど)にして全ワーカーで数える
+    'THROTTLE_RATES': {'ip': '30/min', 'account': '10/min'},
+    'THROTTLE_CACHE': 'default',
+    'SHED_MAX_PENDING_HASHES': 16,
+    'SHED_MAX_HASH_LATENCY': 2.0,
+    'SHED_WINDOW': 5.0,
+    'SHED_MAX_LOAD': None,
+    'SHED_RETRY_AFTER': 1,
+    # ブラウザのクライアントはクッキーで認証し、アクセストークンは期限の5分前からリクエストの中で更新する
+    'AUTH_COOKIE': True,
+    'AUTH_COOKIE_ENFORCE_CSRF': True,
+    'SILENT_REFRESH_THRESHOLD': 300,
+    'SILENT_REFRESH_CACHE': 'default',
+    'SILENT_REFRESH_GRACE': 30,
+    'SILENT_REFRESH_WAIT': 2.0,
+    # last_login、last_seen、login_countはワーカー毎にまとめて10秒毎に書き込む
+    'ACTIVITY_TRACKING': True,
+    'ACTIVITY_FLUSH_INTERVAL': 10.0,
+    'ACTIVITY_BUFFER_SIZE': 1000,
+    'ACTIVITY_BATCH_SIZE': 500,
+    # 認証の監査ログ。溢れたイベントはディレクトリに書き出し、load_auth_events で読み込む
+    'AUDIT': True,
+    'AUDIT_BUFFER_SIZE': 10000,
+    'AUDIT_BATCH_SIZE': 500,
+    'AUDIT_FLUSH_INTERVAL': 1.0,
+    'AUDIT_SPILL_DIR': os.environ.get('LOGINS_AUDIT_SPILL_DIR'),
+    'AUDIT_RETENTION_DAYS': 90,
+    # セッションなどのミドルウェアを通さないパス
+    'API_PATH_PREFIXES': ['/api/', '/metrics', '/.well-known/'],
+}
+
+# 先頭のハッシャーで新しいパスワードをハッシュする。argon2 と bcrypt_sha256 は別途ライブラリが必要
+# https://docs.djangoproject.com/en/4.2/topics/auth/passwords/
+
+POLICY_PASSWORD_HASHERS = {
+    'pbkdf2_sha256': 'logins.hashers.PBKDF2PasswordHasher',
+    'argon2': 'logins.hashers.Argon2PasswordHasher',
+    'bcrypt_sha256': 'logins.hashers.BCryptSHA256PasswordHasher',
+    'scrypt': 'logins.hashers.ScryptPasswordHasher',
 }
 
+PASSWORD_HASHERS = [
+    POLICY_PASSWORD_HASHERS[LOGINS['PASSWORD_ALGORITHM']],
+    *[hasher for algorithm, hasher in POLICY_PASSWORD_HASHERS.items()
+      if algorithm != LOGINS['PASSWORD_ALGORITHM']],
+    'django.contrib.auth.hashers.PBKDF2SHA1PasswordHasher',
+]
+
 # Internationalization
 # https://docs.djangoproject.com/en/4.2/topics/i18n/
 
@@ -0,0 +1,30 @@
+"""
+MySQLを使わずにSQLiteで動かすローカル用の設定
+
+python manage.py runserver --settings=accounts.settings_local
+
+replica は同じファイルへの別の接続で、レプリカへの振り分けとプライマリへの固定を手元で確認できる
+"""
+from .settings import *  # noqa: F401,F403
+from .settings import BASE_DIR, LOGINS
+
+DATABASES = {
+    'default': {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': BASE_DIR / 'db.sqlite3',
+        'CONN_MAX_AGE': 600,
+        'CONN_HEALTH_CHECKS': True,
+    },
+    'replica': {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': BASE_DIR / 'db.sqlite3',
+        'CONN_MAX_AGE': 600,
+        'CONN_HEALTH_CHECKS': True,
+        'TEST': {'MIRROR': 'default'},
+    },
+}
+
+LOGINS = {**LOGINS, 'READ_REPLICAS': ['replica']}
+
+# 1プロセスで動かすので、キャッシュがLocMemCacheでもよい
+SILENCED_SYSTEM_CHECKS = ['logins.E001', 'logins.W001']
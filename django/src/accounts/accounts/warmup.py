@@ -0,0 +1,116 @@
+"""
+ワーカーが最初のリクエストを受ける前に行うウォームアップ
+
+preload() は fork する前のマスタープロセスで実行してよい処理で、
+URLの解決、シリアライザーなどのimport、設定とハッシャーの読み込みを行う
+fork した後にメモリが共有されるので、ワーカー毎に繰り返さない
+warmup_worker() は fork した後の各ワーカーで実行する処理で、
+データベースへの接続とjwtの署名・検証を行う (ソケットやスレッドは fork をまたげない)
+どちらも手順毎の時間(秒)の辞書を返す
+"""
+import logging
+import time
+from importlib import import_module
+
+logger = logging.getLogger(__name__)
+
+# 最初のリクエストでimportされるモジュール
+PRELOAD_MODULES = (
+    "rest_framework.authentication",
+    "rest_framework.negotiation",
+    "rest_framework.parsers",
+    "rest_framework.renderers",
+    "logins.serializer",
+    "logins.views",
+    "logins.async_views",
+)
+
+
+def _step(timings, name, func):
+    started = time.perf_counter()
+    try:
+        func()
+    except Exception:
+        # ウォームアップの失敗でワーカーを落とさない。最初のリクエストで同じ処理が行われる
+        logger.exception("warmup step %s failed", name)
+    timings[name] = time.perf_counter() - started
+
+
+def _resolve_urls():
+    from django.urls import get_resolver
+    resolver = get_resolver()
+    # reverse_dict を参照するとURLパターンがすべて読み込まれ、逆引きの表が作られる
+    resolver.reverse_dict
+    for _, namespace_resolver in resolver.namespace_dict.values():
+        namespace_resolver.reverse_dict
+    resolver.resolve("/api/")
+
+
+def _import_modules():
+    for module in PRELOAD_MODULES:
+        import_module(module)
+
+
+def _load_settings():
+    from django.contrib.auth.hashers import get_hashers
+    from rest_framework.settings import api_settings
+    from rest_framework_simplejwt.settings import api_settings as jwt_settings
+    # DRFとsimplejwtの設定は最初に参照された時にクラスをimportする
+    for name in ("DEFAULT_AUTHENTICATION_CLASSES", "DEFAULT_PERMISSION_CLASSES",
+                 "DEFAULT_RENDERER_CLASSES", "DEFAULT_PARSER_CLASSES", "DEFAULT_CONTENT_NEGOTIATION_CLASS"):
+        getattr(api_settings, name)
+    for name in ("AUTH_TOKEN_CLASSES", "TOKEN_OBTAIN_SERIALIZER", "TOKEN_REFRESH_SERIALIZER",
+                 "TOKEN_VERIFY_SERIALIZER", "USER_ID_CLAIM"):
+        getattr(jwt_settings, name)
+    # ハッシャーのインスタンス化 (argon2やbcryptのimportを含む)
+    get_hashers()
+
+
+def _prime_databases():
+    from django.db import connections
+    for connection in connections.all():
+        connection.ensure_connection()
+
+
+def _prime_tokens():
+    from logins.models import User
+    from logins.tokens import AccessToken, RefreshToken
+    # 保存しないダミーのユーザーで署名と検証を1回行い、鍵の読み込みと準備を済ませる
+    user = User(id=0, user_name="warmup", email="warmup@example.com", is_active=True, is_staff=False)
+    AccessToken(str(RefreshToken.for_user(user).access_token))
+
+
+def _prime_hash_pool():
+    from logins.conf import logins_settings
+    from logins.hashpool import hash_pool
+    if logins_settings.HASH_POOL:
+        hash_pool.run(len, "")
+
+
+def preload():
+    """
+    forkする前に実行するウォームアップ
+    """
+    timings = {}
+    _step(timings, "urls", _resolve_urls)
+    _step(timings, "imports", _import_modules)
+    _step(timings, "settings", _load_settings)
+    return timings
+
+
+def warmup_worker():
+    """
+    forkした後のワーカーで、リクエストを受ける前に実行するウォームアップ
+    """
+    timings = {}
+    _step(timings, "databases", _prime_databases)
+    _step(timings, "tokens", _prime_tokens)
+    _step(timings, "hash_pool", _prime_hash_pool)
+    return timings
+
+
+def warmup():
+    """
+    forkしない時(runserverや1プロセスのサーバー)にまとめて実行する
+    """
+    return {**preload(), **warmup_worker()}
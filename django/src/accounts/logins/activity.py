@@ -0,0 +1,147 @@
+"""
+ログインとアクセスの記録 (last_login, last_seen, login_count) の書き込みをまとめる
+
+ログインや認証の度にUPDATEするとホットパスに書き込みが増えるので、ワーカーのメモリに
+ユーザー毎にまとめておき、ACTIVITY_FLUSH_INTERVAL 秒毎に複数行を1回のUPDATEで書き込む
+同じユーザーの記録は1つにまとまり、保持するユーザーは ACTIVITY_BUFFER_SIZE までで、
+超える時はすぐに書き込む。残っている記録はプロセスの終了時に書き込む
+
+書き込みはリクエストのついでに行う (metrics.py と同じく専用のスレッドは持たない)
+リクエストのトランザクションの中では書き込まない (ロールバックで記録が消え、行ロックを長く持つため)
+"""
+import atexit
+import threading
+import time
+from asgiref.sync import sync_to_async
+from django.db import DEFAULT_DB_ALIAS, DatabaseError, connections
+from django.db.models import Case, F, IntegerField, Value, When
+from django.utils import timezone
+from .conf import logins_settings
+
+
+class ActivityBuffer:
+    """
+    主キー -> [last_seen, last_login, ログイン回数の増分] を保持する書き込みバッファ
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._pending = {}
+        # 記録を溜め始めた時のデータベースの名前。テストのデータベースが消えた後に書き込まないために使う
+        self._database = None
+        self._flushed_at = time.monotonic()
+        # 上限を超えて捨てた記録と、書き込みに失敗して捨てた記録の数
+        self.dropped = 0
+        self.failed = 0
+
+    def __len__(self):
+        return len(self._pending)
+
+    def touch(self, pk, login=False):
+        """
+        ユーザーのアクセス(loginならログイン)を記録する。書き込む時期ならその前に書き込む
+        """
+        if not logins_settings.ACTIVITY_TRACKING or pk is None:
+            return
+        if self.due():
+            self.maybe_flush()
+        self.record(pk, login)
+
+    async def atouch(self, pk, login=False):
+        """
+        touchの非同期版。書き込みだけ同期のスレッドで行う
+        """
+        if not logins_settings.ACTIVITY_TRACKING or pk is None:
+            return
+        if self.due():
+            await sync_to_async(self.maybe_flush)()
+        self.record(pk, login)
+
+    def due(self):
+        if not self._pending:
+            return False
+        return (len(self._pending) >= logins_settings.ACTIVITY_BUFFER_SIZE
+                or time.monotonic() - self._flushed_at >= logins_settings.ACTIVITY_FLUSH_INTERVAL)
+
+    def record(self, pk, login=False):
+        now = timezone.now()
+        pk = self.model()._meta.pk.to_python(pk)
+        with self._lock:
+            entry = self._pending.get(pk)
+            if entry is None:
+                # 書き込めずに上限に達していたら新しいユーザーの記録は捨てる
+                if len(self._pending) >= logins_settings.ACTIVITY_BUFFER_SIZE:
+                    self.dropped += 1
+                    return
+                if not self._pending:
+                    self._database = self.database_name()
+                entry = self._pending[pk] = [now, None, 0]
+            entry[0] = now
+            if login:
+                entry[1] = now
+                entry[2] += 1
+
+    def maybe_flush(self):
+        """
+        トランザクションの外なら書き込む
+        """
+        if connections[self.using()].in_atomic_block:
+            return 0
+        return self.flush()
+
+    def flush(self):
+        """
+        溜めた記録を ACTIVITY_BATCH_SIZE 人毎に1回のUPDATEで書き込み、書き込んだユーザー数を返す
+        ログイン回数は他のワーカーの分と足し合わせるため、値ではなく増分で書き込む
+        """
+        with self._lock:
+            pending, self._pending = self._pending, {}
+            database, self._database = self._database, None
+            self._flushed_at = time.monotonic()
+        if not pending or database != self.database_name():
+            return 0
+        User = self.model()
+        queryset = User.objects.using(self.using())
+        items = list(pending.items())
+        size = logins_settings.ACTIVITY_BATCH_SIZE
+        try:
+            for start in range(0, len(items), size):
+                batch = items[start:start + size]
+                queryset.filter(pk__in=[pk for pk, _ in batch]).update(
+                    last_seen=Case(*[When(pk=pk, then=Value(seen)) for pk, (seen, _, _) in batch],
+                                   default=F("last_seen")),
+                    last_login=Case(*[When(pk=pk, then=Value(login)) for pk, (_, login, _) in batch if login],
+                                    default=F("last_login")),
+                    login_count=F("login_count") + Case(
+                        *[When(pk=pk, then=Value(count)) for pk, (_, _, count) in batch if count],
+                        default=Value(0), output_field=IntegerField()),
+                )
+        except DatabaseError:
+            # 記録は失ってもよいので、ログインや認証を失敗させない
+            self.failed += len(items)
+            return 0
+        return len(items)
+
+    def reset(self):
+        with self._lock:
+            self._pending = {}
+            self._database = None
+            self._flushed_at = time.monotonic()
+            self.dropped = 0
+            self.failed = 0
+
+    def model(self):
+        from .models import User
+        return User
+
+    def using(self):
+        # ルーターのdb_for_writeはリクエストを書き込みとして記録する(routers.py)ので使わない
+        # 書き込みは常にプライマリ
+        return DEFAULT_DB_ALIAS
+
+    def database_name(self):
+        return connections[self.using()].settings_dict["NAME"]
+
+
+activity_buffer = ActivityBuffer()
+atexit.register(activity_buffer.flush)
@@ -4,3 +4,6 @@ from django.apps import AppConfig
 class LoginsConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'logins'
+
+    def ready(self):
+        from . import checks, signals  # noqa: F401  システムチェックとシグナルを登録する
@@ -0,0 +1,137 @@
+"""
+ASGIで動かす非同期版のビュー達
+DRFのビューは同期のみなので、Djangoの非同期ビューとして実装している
+"""
+import json
+from asgiref.sync import sync_to_async
+from django.core.exceptions import ValidationError
+from django.http import HttpResponse, JsonResponse
+from django.views import View
+from rest_framework import status
+from rest_framework.exceptions import APIException
+from .audit import audit_log
+from .models import AuthEvent, User
+from .serializer import UserSerializer
+from .throttling import check_throttles
+from .utils import aget_jwt_and_set_cookie, arevoke_jwt, averify_jwt
+
+
+# 共有のキャッシュへのアクセスでイベントループを塞がないようにスレッドで実行する
+athrottle = sync_to_async(check_throttles, thread_sensitive=False)
+
+
+async def ais_valid(serializer, valid_fields):
+    """
+    UserSerializer.is_validの非同期版
+    バリデーターがDBに問い合わせることがあるので、同期のORMと同じスレッドで実行する
+    """
+    return await sync_to_async(serializer.is_valid)(valid_fields=valid_fields)
+
+
+class AsyncAPIView(View):
+    """
+    非同期ビューの基底クラス
+    DRFのAPIViewと同じくCSRFの検査を行わず、APIExceptionをJSONのレスポンスにする
+    """
+    http_method_names = ["post", "delete", "options"]
+
+    @classmethod
+    def as_view(cls, **initkwargs):
+        view = super().as_view(**initkwargs)
+        view.csrf_exempt = True
+        return view
+
+    async def dispatch(self, request, *args, **kwargs):
+        try:
+            return await super().dispatch(request, *args, **kwargs)
+        except APIException as exc:
+            data = exc.detail if isinstance(exc.detail, (list, dict)) else {"detail": exc.detail}
+            response = JsonResponse(data, status=exc.status_code, safe=False)
+            if getattr(exc, "wait", None):
+                response["Retry-After"] = "%d" % exc.wait
+            return response
+
+    def parse(self, request):
+        """
+        リクエストボディのJSONを辞書にする。JSONでなければNone
+        """
+        try:
+            data = json.loads(request.body or b"{}")
+        except ValueError:
+            return None
+        return data if isinstance(data, dict) else None
+
+
+class AsyncSignupView(AsyncAPIView):
+    """
+    ユーザー登録用ビュー (非同期版)
+    """
+    valid_fields = ("user_name",
+                    "email",
+                    "password",
+                    )
+
+    async def post(self, request, *args, **kwargs):
+        data = self.parse(request)
+        if data is None:
+            return JsonResponse({"detail": "Invalid JSON"}, status=status.HTTP_400_BAD_REQUEST)
+        await athrottle(request, data)
+        serializer = UserSerializer(data=data)
+        if await ais_valid(serializer, self.valid_fields):
+            try:
+                user = await User.objects.acreate_user(**serializer.validated_data)
+            except ValidationError as e:
+                return JsonResponse(e.message_dict, status=status.HTTP_400_BAD_REQUEST)
+            audit_log.record(AuthEvent.Kind.SIGNUP, user.pk, request)
+            response = JsonResponse(serializer.validated_data, status=status.HTTP_201_CREATED)
+            return await aget_jwt_and_set_cookie(user, response, request)
+        return JsonResponse(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+
+
+class AsyncLoginView(AsyncAPIView):
+    """
+    ログイン用ビュー (非同期版)
+    """
+    valid_fields = ("email",
+                    "password",
+                    )
+
+    async def post(self, request, *args, **kwargs):
+        # ログイン中のユーザーは通さない (OnlyLogoutPerm)
+        if await averify_jwt(request):
+            return JsonResponse({"detail": "You do not have permission to perform this action."},
+                                status=status.HTTP_403_FORBIDDEN)
+        data = self.parse(request)
+        if data is None:
+            return JsonResponse({"detail": "Invalid JSON"}, status=status.HTTP_400_BAD_REQUEST)
+        await athrottle(request, data)
+        serializer = UserSerializer(data=data)
+        if await ais_valid(serializer, self.valid_fields):
+            email = serializer.validated_data["email"]
+            password = serializer.validated_data["password"]
+            user = await User.objects.acheck_login(email, password)
+            if user is not None:
+                audit_log.record(AuthEvent.Kind.LOGIN, user.pk, request)
+                response = JsonResponse(serializer.validated_data, status=status.HTTP_201_CREATED)
+                return await aget_jwt_and_set_cookie(user, response, request)
+            audit_log.record(AuthEvent.Kind.LOGIN_FAILED, None, request)
+            return JsonResponse(serializer.errors, status=status.HTTP_401_UNAUTHORIZED)
+        return JsonResponse(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+
+
+class AsyncLogoutView(AsyncAPIView):
+    """
+    ログアウト用ビュー (非同期版)
+    """
+
+    async def delete(self, request, *args, **kwargs):
+        objects = await averify_jwt(request)
+        if objects:
+            await arevoke_jwt(request, objects[1])
+            audit_log.record(AuthEvent.Kind.LOGOUT, objects[0].pk, request)
+            response = HttpResponse(status=status.HTTP_200_OK)
+            response.delete_cookie("Authorization")
+            response.delete_cookie("refresh")
+            return response
+        return JsonResponse({"detail": "Authentication credentials were not provided."},
+                            status=status.HTTP_401_UNAUTHORIZED)
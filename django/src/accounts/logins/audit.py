@@ -0,0 +1,221 @@
+"""
+認証の監査ログ (ログイン、ログインの失敗、サインアップ、パスワードの変更、ログアウト)
+
+イベントはプロセス内のリングバッファに入れ、バックグラウンドのスレッドが AUDIT_FLUSH_INTERVAL 秒毎か
+AUDIT_BATCH_SIZE 件溜まった時に bulk_create する。リクエストのスレッドはDBに書き込まない
+バッファが AUDIT_BUFFER_SIZE 件で溢れたら、AUDIT_SPILL_DIR があればプロセス毎の追記専用のファイル
+(JSON Lines) に書き出し、無ければ古いイベントから捨てる。書き出したイベントは load_auth_events で読み込む
+トランザクションの中で記録したイベントは、コミットされた時だけバッファに入れる
+"""
+import atexit
+import collections
+import datetime
+import glob
+import json
+import os
+import threading
+import time
+import uuid
+from django.db import DEFAULT_DB_ALIAS, DatabaseError, close_old_connections, connections, transaction
+from django.utils import timezone
+from rest_framework.throttling import BaseThrottle
+from .conf import logins_settings
+
+SPILL_FILE = "auth-events-%d.jsonl"
+# load_auth_events が読み込み中のファイルの拡張子
+LOADING_SUFFIX = ".loading"
+
+
+def client_ip(request):
+    """
+    DRFのスロットルと同じ方法(NUM_PROXIES)でクライアントのIPを取る
+    """
+    if request is None:
+        return ""
+    return (BaseThrottle().get_ident(request) or "")[:45]
+
+
+class AuditLog:
+    """
+    (created_at, kind, user_id, ip) のタプルを保持するリングバッファと、それを書き込むスレッド
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._spill_lock = threading.Lock()
+        self._events = collections.deque()
+        self._wakeup = threading.Event()
+        self._thread = None
+        self._pid = None
+        # イベントを溜め始めた時のデータベースの名前。テストのデータベースが消えた後に書き込まないために使う
+        self._database = None
+        # 溢れて捨てたイベント、ファイルに書き出したイベント、書き込みに失敗して捨てたイベントの数
+        self.dropped = 0
+        self.spilled = 0
+        self.failed = 0
+
+    def __len__(self):
+        return len(self._events)
+
+    def record(self, kind, user_id=None, request=None):
+        """
+        イベントを記録する。DBには書き込まないので非同期のビューからもそのまま呼べる
+        """
+        if not logins_settings.AUDIT:
+            return
+        event = (timezone.now(), int(kind), user_id, client_ip(request))
+        if connections[DEFAULT_DB_ALIAS].in_atomic_block:
+            transaction.on_commit(lambda: self.append(event))
+        else:
+            self.append(event)
+
+    def append(self, event):
+        self.start()
+        spill = None
+        with self._lock:
+            if not self._events:
+                self._database = self.database_name()
+            if len(self._events) < logins_settings.AUDIT_BUFFER_SIZE:
+                self._events.append(event)
+            elif logins_settings.AUDIT_SPILL_DIR:
+                spill = [event]
+            else:
+                self._events.popleft()
+                self._events.append(event)
+                self.dropped += 1
+            full = len(self._events) >= logins_settings.AUDIT_BATCH_SIZE
+        if spill:
+            self.spill(spill)
+        if full:
+            self._wakeup.set()
+
+    def start(self):
+        """
+        書き込みのスレッドを起動する。fork した子プロセスでは親のバッファを捨てて起動し直す
+        """
+        if self._pid == os.getpid() or logins_settings.AUDIT_FLUSH_INTERVAL is None:
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            if self._pid is not None:
+                self._events.clear()
+            self._pid = os.getpid()
+            self._thread = threading.Thread(target=self._run, name="logins-audit", daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        while True:
+            interval = logins_settings.AUDIT_FLUSH_INTERVAL
+            self._wakeup.wait(interval or 1.0)
+            self._wakeup.clear()
+            if interval is None:
+                continue
+            # リクエストと同じくCONN_MAX_AGEを過ぎた接続や壊れた接続を閉じる
+            close_old_connections()
+            try:
+                self.flush()
+            finally:
+                close_old_connections()
+
+    def flush(self):
+        """
+        バッファのイベントを AUDIT_BATCH_SIZE 件毎に bulk_create し、書き込んだ件数を返す
+        書き込めなければファイルに書き出す (AUDIT_SPILL_DIR が無ければ捨てる)
+        """
+        with self._lock:
+            events = list(self._events)
+            self._events.clear()
+            database, self._database = self._database, None
+        if not events or database != self.database_name():
+            return 0
+        try:
+            self.insert(events)
+        except DatabaseError:
+            if logins_settings.AUDIT_SPILL_DIR:
+                self.spill(events)
+            else:
+                self.failed += len(events)
+            return 0
+        return len(events)
+
+    def insert(self, events):
+        from .models import AuthEvent
+        AuthEvent.objects.using(DEFAULT_DB_ALIAS).bulk_create(
+            [AuthEvent(created_at=created_at, kind=kind, user_id=user_id, ip=ip)
+             for created_at, kind, user_id, ip in events],
+            batch_size=logins_settings.AUDIT_BATCH_SIZE)
+
+    def spill(self, events):
+        """
+        イベントをこのプロセスのファイルに追記する
+        """
+        directory = logins_settings.AUDIT_SPILL_DIR
+        os.makedirs(directory, exist_ok=True)
+        lines = "".join(json.dumps([created_at.isoformat(), kind, user_id, ip]) + "\n"
+                        for created_at, kind, user_id, ip in events)
+        with self._spill_lock:
+            with open(os.path.join(directory, SPILL_FILE % os.getpid()), "a", encoding="utf-8") as f:
+                f.write(lines)
+            self.spilled += len(events)
+
+    def load_spilled(self):
+        """
+        書き出したファイルのイベントをDBに入れて、ファイルを消す。読み込んだ件数を返す
+        書き込み中のプロセスと競合しないように、ファイルは名前を変えてから読む
+        (各プロセスは追記の度に元の名前のファイルを開き直す)
+        前回の読み込みに失敗して残ったファイルを上書きしないように、変えた名前は毎回別にする
+        """
+        directory = logins_settings.AUDIT_SPILL_DIR
+        if not directory:
+            return 0
+        count = 0
+        pattern = os.path.join(directory, SPILL_FILE.replace("%d", "*"))
+        for path in glob.glob(pattern):
+            os.replace(path, "%s.%s%s" % (path, uuid.uuid4().hex, LOADING_SUFFIX))
+        for path in sorted(glob.glob(pattern + "*" + LOADING_SUFFIX)):
+            with open(path, encoding="utf-8") as f:
+                events = [self.parse(line) for line in f if line.strip()]
+            self.insert(events)
+            os.remove(path)
+            count += len(events)
+        return count
+
+    def parse(self, line):
+        created_at, kind, user_id, ip = json.loads(line)
+        return datetime.datetime.fromisoformat(created_at), kind, user_id, ip
+
+    def reset(self):
+        with self._lock:
+            self._events.clear()
+            self._database = None
+            self.dropped = 0
+            self.spilled = 0
+            self.failed = 0
+
+    def database_name(self):
+        return connections[DEFAULT_DB_ALIAS].settings_dict["NAME"]
+
+
+def prune(before, chunk_size=1000, pause=0.0):
+    """
+    beforeより古いイベントを chunk_size 件ずつ別々のDELETEで消し、消した件数を返す
+    1回のDELETEで全部消すと、その間テーブルのロックとトランザクションが長くなるため
+    """
+    from .models import AuthEvent
+    # レプリカの遅れで消したイベントを読み直さないように、読み込みもプライマリで行う
+    events = AuthEvent.objects.using(DEFAULT_DB_ALIAS)
+    count = 0
+    while True:
+        ids = list(events.filter(created_at__lt=before).order_by("created_at")
+                   .values_list("id", flat=True)[:chunk_size])
+        if not ids:
+            return count
+        # シグナルも関連も無いので、Djangoは読み込まずに1回のDELETEで消す
+        count += events.filter(id__in=ids).delete()[0]
+        if pause:
+            time.sleep(pause)
+
+
+audit_log = AuditLog()
+atexit.register(audit_log.flush)
@@ -0,0 +1,206 @@
+"""
+このアプリで使うカスタム認証クラス
+"""
+from asgiref.sync import sync_to_async
+from django.utils.functional import cached_property
+from django.utils.translation import gettext_lazy as _
+from rest_framework import HTTP_HEADER_ENCODING
+from rest_framework.authentication import CSRFCheck
+from rest_framework.exceptions import AuthenticationFailed, PermissionDenied
+from rest_framework_simplejwt import authentication
+from rest_framework_simplejwt.exceptions import InvalidToken
+from rest_framework_simplejwt.models import TokenUser
+from rest_framework_simplejwt.settings import api_settings
+from . import metrics
+from .activity import activity_buffer
+from .conf import logins_settings
+from .revocation import revocation_list
+from .tokens import USER_CLAIMS
+from .usercache import user_cache
+
+# 検証結果を保存するHttpRequestの属性名
+REQUEST_CACHE_ATTR = "_logins_jwt_auth"
+# ログインで発行したトークンを入れるhttponlyのクッキー ("JWT <アクセストークン>" とリフレッシュトークン)
+ACCESS_COOKIE = "Authorization"
+REFRESH_COOKIE = "refresh"
+
+
+def get_http_request(request):
+    """
+    DRFのRequestならラップしているHttpRequestを、HttpRequestならそのまま返す
+    """
+    return getattr(request, "_request", request)
+
+
+class ClaimsUser(TokenUser):
+    """
+    トークンのクレームだけで作るユーザー (DBにアクセスしない)
+    """
+
+    @classmethod
+    def has_claims(cls, token):
+        return all(claim in token for claim in USER_CLAIMS)
+
+    @cached_property
+    def id(self):
+        # クレームのuser_idは文字列なのでUserモデルの主キーの型に合わせる
+        from .models import User
+        return User._meta.pk.to_python(self.token[api_settings.USER_ID_CLAIM])
+
+    @cached_property
+    def user_name(self):
+        return self.token["user_name"]
+
+    @cached_property
+    def is_active(self):
+        return self.token["is_active"]
+
+    def __str__(self):
+        return self.user_name
+
+
+class JWTAuthentication(authentication.JWTAuthentication):
+    """
+    jwtの検証結果とユーザーをリクエスト単位でメモ化するJWTAuthentication
+    認証クラス、パーミッション、ビューから何度呼ばれても
+    署名の検証とユーザーの取得は1リクエストにつき1回だけ行う
+    ユーザーの取得方法は LOGINS["AUTH_USER_MODE"] で切り替える
+    """
+
+    def get_header(self, request):
+        """
+        Authorizationヘッダーが無ければ、LOGINS["AUTH_COOKIE"] が有効な時はクッキーのトークンを使う
+        """
+        header = super().get_header(request)
+        if header is None and logins_settings.AUTH_COOKIE:
+            cookie = request.COOKIES.get(ACCESS_COOKIE)
+            if cookie:
+                header = cookie.encode(HTTP_HEADER_ENCODING)
+        return header
+
+    def authenticate(self, request):
+        header, http_request, cached = self._lookup(request)
+        if cached is not None:
+            return self._unpack(cached[1], http_request)
+
+        try:
+            validated_token = self._validate(header)
+            result = None if validated_token is None else (self.get_user(validated_token), validated_token)
+        except AuthenticationFailed as e:
+            result = e
+        else:
+            if result is not None:
+                activity_buffer.touch(result[0].pk)
+        return self._remember(http_request, header, result)
+
+    async def aauthenticate(self, request):
+        """
+        authenticateの非同期版。ユーザーの取得に非同期のORMを使い、
+        失効リストの同期 (共有のキャッシュへのアクセス) はスレッドで行う
+        """
+        header, http_request, cached = self._lookup(request)
+        if cached is not None:
+            return self._unpack(cached[1], http_request)
+
+        try:
+            if header is not None and revocation_list.sync_due():
+                await sync_to_async(revocation_list.sync, thread_sensitive=False)()
+            validated_token = self._validate(header)
+            result = None if validated_token is None else (await self.aget_user(validated_token), validated_token)
+        except AuthenticationFailed as e:
+            result = e
+        else:
+            if result is not None:
+                await activity_buffer.atouch(result[0].pk)
+        return self._remember(http_request, header, result)
+
+    def _lookup(self, request):
+        """
+        (ヘッダー, HttpRequest, メモ化した (ヘッダー, 結果)) を返す
+        メモ化していないか、ヘッダーが書き換えられていたら3つ目はNone
+        """
+        header = self.get_header(request)
+        http_request = get_http_request(request)
+        cached = getattr(http_request, REQUEST_CACHE_ATTR, None)
+        if cached is not None and cached[0] != header:
+            cached = None
+        return header, http_request, cached
+
+    def _validate(self, header):
+        """
+        ヘッダーのトークンを検証する。トークンが無ければNone
+        """
+        raw_token = None if header is None else self.get_raw_token(header)
+        return None if raw_token is None else self.get_validated_token(raw_token)
+
+    def _remember(self, http_request, header, result):
+        setattr(http_request, REQUEST_CACHE_ATTR, (header, result))
+        return self._unpack(result, http_request)
+
+    def get_validated_token(self, raw_token):
+        with metrics.timer(metrics.token_verify_duration):
+            return super().get_validated_token(raw_token)
+
+    def get_user(self, validated_token):
+        mode = logins_settings.AUTH_USER_MODE
+        # 古いトークンにはクレームが無いので、その場合はDBから取得する
+        if mode == "claims" and ClaimsUser.has_claims(validated_token):
+            user = ClaimsUser(validated_token)
+            if api_settings.CHECK_USER_IS_ACTIVE and not user.is_active:
+                raise AuthenticationFailed(_("User is inactive"), code="user_inactive")
+            return user
+        if mode == "cache":
+            try:
+                user_id = validated_token[api_settings.USER_ID_CLAIM]
+            except KeyError as e:
+                raise InvalidToken(_("Token contained no recognizable user identification")) from e
+            return user_cache.get_or_load(user_id,
+                                          lambda: super(JWTAuthentication, self).get_user(validated_token))
+        return super().get_user(validated_token)
+
+    async def aget_user(self, validated_token):
+        """
+        get_userの非同期版
+        """
+        mode = logins_settings.AUTH_USER_MODE
+        if mode == "claims" and ClaimsUser.has_claims(validated_token):
+            return self.get_user(validated_token)
+        try:
+            user_id = validated_token[api_settings.USER_ID_CLAIM]
+        except KeyError as e:
+            raise InvalidToken(_("Token contained no recognizable user identification")) from e
+        if mode == "cache":
+            return await user_cache.aget_or_load(user_id, lambda: self._aget_user_from_db(user_id))
+        return await self._aget_user_from_db(user_id)
+
+    async def _aget_user_from_db(self, user_id):
+        try:
+            user = await self.user_model.objects.aget(**{api_settings.USER_ID_FIELD: user_id})
+        except self.user_model.DoesNotExist as e:
+            raise AuthenticationFailed(_("User not found"), code="user_not_found") from e
+        if api_settings.CHECK_USER_IS_ACTIVE and not user.is_active:
+            raise AuthenticationFailed(_("User is inactive"), code="user_inactive")
+        return user
+
+    def _unpack(self, result, http_request):
+        # 失敗した検証は同じ例外をもう一度送出する
+        if isinstance(result, AuthenticationFailed):
+            raise result
+        if result is not None and self.from_cookie(http_request):
+            self.enforce_csrf(http_request)
+        return result
+
+    def from_cookie(self, request):
+        return api_settings.AUTH_HEADER_NAME not in request.META
+
+    def enforce_csrf(self, request):
+        """
+        クッキーはブラウザが自動で送るので、DRFのSessionAuthenticationと同じくCSRFを検査する
+        """
+        if not logins_settings.AUTH_COOKIE_ENFORCE_CSRF:
+            return
+        check = CSRFCheck(lambda request: None)
+        check.process_request(request)
+        reason = check.process_view(request, None, (), {})
+        if reason:
+            raise PermissionDenied("CSRF Failed: %s" % reason)
@@ -0,0 +1,98 @@
+"""
+このアプリのベンチマーク達
+manage.py benchmark <名前> で実行する
+"""
+import math
+import time
+from contextlib import contextmanager
+from django.conf import settings
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext, override_settings
+from ..throttling import buckets
+
+BENCHMARKS = {}
+
+
+def register(name):
+    """
+    ベンチマーク関数を名前付きで登録するデコレーター
+    ベンチマーク関数はiterationsとコマンドのオプションを受け取り、結果の行(dict)のリストを返す
+    """
+    def decorator(func):
+        BENCHMARKS[name] = func
+        return func
+    return decorator
+
+
+def percentile(values, q):
+    """
+    ソート済みのvaluesのq分位点 (最近傍順位法)
+    """
+    if not values:
+        return 0.0
+    return values[min(len(values) - 1, max(0, math.ceil(q * len(values)) - 1))]
+
+
+def measure(case, func, iterations, setup=None):
+    """
+    funcをiterations回実行して、1回あたりの時間(平均、p50、p99)、スループット、クエリ数を返す
+    setupがあれば毎回funcの前に実行し、その戻り値をfuncに渡す (setupの時間とクエリは含めない)
+    """
+    latencies = []
+    queries = 0
+    for _ in range(iterations):
+        args = () if setup is None else (setup(),)
+        with CaptureQueriesContext(connection) as captured:
+            start = time.perf_counter()
+            func(*args)
+            latencies.append(time.perf_counter() - start)
+        queries += len(captured)
+    elapsed = sum(latencies)
+    latencies.sort()
+    return {
+        "case": case,
+        "iterations": iterations,
+        "mean_us": elapsed / iterations * 1e6,
+        "p50_us": percentile(latencies, 0.5) * 1e6,
+        "p99_us": percentile(latencies, 0.99) * 1e6,
+        "ops_per_s": iterations / elapsed if elapsed else 0.0,
+        "queries": queries / iterations,
+    }
+
+
+@contextmanager
+def rollback():
+    """
+    ベンチマーク中に作ったデータをDBに残さない
+    """
+    with transaction.atomic():
+        yield
+        transaction.set_rollback(True)
+
+
+@contextmanager
+def unthrottled():
+    """
+    スロットルと負荷制限を止める
+    ハッシュが必要なエンドポイントが429や503を返すと、エンドポイントではなく制限を測ってしまう
+    """
+    with override_settings(LOGINS={**settings.LOGINS,
+                                   "THROTTLE_RATES": {},
+                                   "SHED_MAX_PENDING_HASHES": math.inf,
+                                   "SHED_MAX_HASH_LATENCY": None,
+                                   "SHED_MAX_LOAD": None}):
+        buckets.reset()
+        try:
+            yield
+        finally:
+            buckets.reset()
+
+
+def is_error(status_code):
+    """
+    ベンチマークのリクエストが失敗した応答か (2xx以外)
+    """
+    return not 200 <= status_code < 300
+
+
+from . import auth, concurrency, endpoints, hashers, middleware, renderers, revocation, throttling, views  # noqa: E402,F401  ベンチマークを登録する
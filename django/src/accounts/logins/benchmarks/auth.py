@@ -0,0 +1,108 @@
+"""
+jwt認証のベンチマーク
+"""
+from django.conf import settings
+from django.test import override_settings
+from rest_framework.request import Request
+from rest_framework.test import APIRequestFactory
+from rest_framework_simplejwt.authentication import JWTAuthentication as SimpleJWTAuthentication
+from . import register, measure, rollback
+from ..authentication import JWTAuthentication
+from ..models import User
+from ..permissions import OnlyYouPerm
+from ..usercache import user_cache
+from ..utils import get_jwt, verify_jwt
+
+
+class _ViewMock:
+    def __init__(self, pk):
+        self.kwargs = {"pk": pk}
+
+
+@register("jwt_request_memo")
+def jwt_request_memo(iterations, **options):
+    """
+    api/update/<pk> 1リクエスト分の認証(認証クラス+OnlyYouPerm)を
+    メモ化なし(以前の実装)とメモ化ありで比較する
+    """
+    factory = APIRequestFactory()
+    with rollback():
+        user = User.objects.create_user(user_name="bench_user",
+                                        email="bench@example.com",
+                                        password="password")
+        header = "JWT " + get_jwt(user)["access"]
+        view = _ViewMock(user.pk)
+
+        def unmemoized():
+            request = Request(factory.patch("/", HTTP_AUTHORIZATION=header),
+                              authenticators=[SimpleJWTAuthentication()])
+            request.user
+            # 以前のOnlyYouPermは独自にもう一度検証していた
+            SimpleJWTAuthentication().authenticate(request)
+
+        def memoized():
+            request = Request(factory.patch("/", HTTP_AUTHORIZATION=header),
+                              authenticators=[JWTAuthentication()])
+            request.user
+            OnlyYouPerm().has_permission(request, view)
+
+        return [
+            measure("unmemoized", unmemoized, iterations),
+            measure("memoized", memoized, iterations),
+        ]
+
+
+@register("jwt_user_mode")
+def jwt_user_mode(iterations, **options):
+    """
+    LOGINS["AUTH_USER_MODE"] 毎に、認証1回あたりの時間とクエリ数を比較する
+    """
+    factory = APIRequestFactory()
+    rows = []
+    with rollback():
+        user = User.objects.create_user(user_name="bench_user",
+                                        email="bench@example.com",
+                                        password="password")
+        header = "JWT " + get_jwt(user)["access"]
+
+        def authenticate():
+            JWTAuthentication().authenticate(factory.get("/", HTTP_AUTHORIZATION=header))
+
+        for mode in ("db", "cache", "claims"):
+            user_cache.clear()
+            with override_settings(LOGINS={**settings.LOGINS, "AUTH_USER_MODE": mode}):
+                rows.append(measure(mode, authenticate, iterations))
+    return rows
+
+
+@register("jwt_helpers")
+def jwt_helpers(iterations, **options):
+    """
+    logins/utils.py の get_jwt と verify_jwt の1回あたりの時間
+    """
+    factory = APIRequestFactory()
+    with rollback():
+        user = User.objects.create_user(user_name="bench_user",
+                                        email="bench@example.com",
+                                        password="password")
+        header = "JWT " + get_jwt(user)["access"]
+        return [
+            measure("get_jwt", lambda: get_jwt(user), iterations),
+            # リクエスト毎に新しいHttpRequestなのでメモ化は効かない
+            measure("verify_jwt", lambda: verify_jwt(factory.get("/", HTTP_AUTHORIZATION=header)), iterations),
+        ]
+
+
+@register("password")
+def password(iterations, **options):
+    """
+    現在の設定(LOGINS["PASSWORD_ALGORITHM"]とコスト)での set_password と check_password の1回あたりの時間
+    """
+    with rollback():
+        user = User.objects.create_user(user_name="bench_user",
+                                        email="bench@example.com",
+                                        password="password")
+        return [
+            measure("set_password", lambda: user.set_password("password"), iterations),
+            measure("check_password", lambda: user.check_password("password"), iterations),
+        ]
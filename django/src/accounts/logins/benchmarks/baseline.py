@@ -0,0 +1,53 @@
+"""
+ベンチマーク結果のベースラインの保存と比較
+ベースラインは {"meta": {...}, "results": {ベンチマーク名: [行, ...]}} のJSON
+"""
+import json
+import platform
+import sys
+import django
+
+# 大きくなると悪化する指標と、小さくなると悪化する指標
+LOWER_IS_BETTER = ("mean_us", "p50_us", "p99_us")
+HIGHER_IS_BETTER = ("hashes_per_sec", "wsgi_rps", "asgi_rps")
+
+
+def write_baseline(path, results, **meta):
+    data = {
+        "meta": {"python": sys.version.split()[0],
+                 "django": django.get_version(),
+                 "platform": platform.platform(),
+                 **meta},
+        "results": results,
+    }
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(data, f, indent=2, sort_keys=True)
+
+
+def load_baseline(path):
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)["results"]
+
+
+def compare(baseline, results, tolerance):
+    """
+    baselineとresultsの同じベンチマーク、同じcaseの行を比べて、悪化した指標の説明のリストを返す
+    時間とスループットは tolerance (0.2なら20%) を超えて悪化したら、クエリ数は1つでも増えたら悪化とする
+    """
+    regressions = []
+    for name, rows in results.items():
+        previous = {row.get("case"): row for row in baseline.get(name, [])}
+        for row in rows:
+            before = previous.get(row.get("case"))
+            if before is None:
+                continue
+            label = "%s/%s" % (name, row.get("case"))
+            for key in LOWER_IS_BETTER:
+                if key in row and key in before and row[key] > before[key] * (1 + tolerance):
+                    regressions.append("%s %s: %.2f -> %.2f" % (label, key, before[key], row[key]))
+            for key in HIGHER_IS_BETTER:
+                if key in row and key in before and row[key] < before[key] * (1 - tolerance):
+                    regressions.append("%s %s: %.2f -> %.2f" % (label, key, before[key], row[key]))
+            if "queries" in row and "queries" in before and row["queries"] > before["queries"] + 1e-9:
+                regressions.append("%s queries: %.2f -> %.2f" % (label, before["queries"], row["queries"]))
+    return regressions
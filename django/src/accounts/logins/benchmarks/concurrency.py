@@ -0,0 +1,101 @@
+"""
+同期(WSGI)と非同期(ASGI)のビューのスループットを比較する負荷試験
+"""
+import asyncio
+import threading
+import time
+from django.conf import settings
+from django.db import connections
+from django.test import AsyncClient, Client, override_settings
+from django.urls import reverse
+from . import register, is_error
+from ..models import User
+from ..utils import get_jwt
+
+CONCURRENCY = 16
+
+
+def run_sync(url, method, requests, concurrency):
+    """
+    concurrency個のスレッドからWSGIハンドラーにrequests(クライアントへの引数のリスト)を送り、
+    (毎秒リクエスト数, ステータスコードのリスト) を返す
+    ログインのクッキーを持ち越さないように、リクエスト毎に新しいクライアントを使う
+    """
+    status_codes = []
+
+    def worker(chunk):
+        try:
+            for kwargs in chunk:
+                status_codes.append(getattr(Client(), method)(url, **kwargs).status_code)
+        finally:
+            connections.close_all()
+
+    threads = [threading.Thread(target=worker, args=(requests[n::concurrency],)) for n in range(concurrency)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return len(requests) / (time.perf_counter() - start), status_codes
+
+
+def run_async(url, method, requests, concurrency):
+    """
+    concurrency個のタスクからASGIハンドラーにrequestsを送り、(毎秒リクエスト数, ステータスコードのリスト) を返す
+    """
+    status_codes = []
+
+    async def worker(chunk):
+        for kwargs in chunk:
+            response = await getattr(AsyncClient(), method)(url, **kwargs)
+            status_codes.append(response.status_code)
+
+    async def main():
+        start = time.perf_counter()
+        await asyncio.gather(*[worker(requests[n::concurrency]) for n in range(concurrency)])
+        return len(requests) / (time.perf_counter() - start)
+
+    return asyncio.run(main()), status_codes
+
+
+@register("async_views")
+def async_views(iterations, **options):
+    """
+    ログインとログアウトを同期版と非同期版のビューで比較する
+    ハッシュのコストではなく並行性を比べるため、PBKDF2の反復回数は下げている
+    スレッドから見えるようにユーザーはコミットし、最後に削除する
+    ログアウトはトークンを失効させるので、リクエスト毎に計測の前に発行したトークンを使う
+    2xx以外の応答の数は wsgi_errors、asgi_errors として報告する
+    """
+    rows = []
+    with override_settings(LOGINS={**settings.LOGINS, "PBKDF2_ITERATIONS": 10000}):
+        user = User.objects.create_user(user_name="bench_async",
+                                        email="bench_async@example.com",
+                                        password="password")
+        try:
+            login = {"data": {"email": user.email, "password": "password"},
+                     "content_type": "application/json"}
+
+            def logout():
+                return {"headers": {"Authorization": "JWT " + get_jwt(user)["access"]}}
+
+            cases = [("login", "post", lambda: login), ("logout", "delete", logout)]
+            for name, method, make_request in cases:
+                sync_rps, sync_codes = run_sync(reverse("logins:" + name), method,
+                                                [make_request() for _ in range(iterations)], CONCURRENCY)
+                async_rps, async_codes = run_async(reverse("logins:async_" + name), method,
+                                                   [make_request() for _ in range(iterations)], CONCURRENCY)
+                sync_errors = sum(1 for code in sync_codes if is_error(code))
+                async_errors = sum(1 for code in async_codes if is_error(code))
+                rows.append({"case": name,
+                             "concurrency": CONCURRENCY,
+                             "wsgi_rps": sync_rps,
+                             "asgi_rps": async_rps,
+                             "speedup": async_rps / sync_rps,
+                             "status": ",".join(str(code) for code in sorted(set(sync_codes + async_codes))),
+                             "wsgi_errors": sync_errors,
+                             "asgi_errors": async_errors,
+                             "errors": sync_errors + async_errors})
+        finally:
+            user.delete()
+    return rows
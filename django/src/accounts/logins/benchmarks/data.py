@@ -0,0 +1,26 @@
+"""
+ベンチマーク用のユーザーの生成
+10^4〜10^6件を数秒〜数十秒で作れるように、パスワードは1回だけハッシュして全員で共有し、
+batch_size件ずつ bulk_create する
+"""
+from django.contrib.auth.hashers import make_password
+from ..models import User
+
+PASSWORD = "benchmark password"
+USER_NAME = "bench%07d"
+EMAIL = "bench%07d@example.com"
+
+
+def generate_users(count, batch_size=5000, start=0):
+    """
+    bench0000000@example.com から順にcount件のユーザーを作る
+    パスワードはすべて PASSWORD
+    """
+    encoded = make_password(PASSWORD)
+    for offset in range(start, start + count, batch_size):
+        stop = min(offset + batch_size, start + count)
+        User.objects.bulk_create_users(
+            [User(user_name=USER_NAME % n, email=EMAIL % n, password=encoded)
+             for n in range(offset, stop)],
+            batch_size=batch_size)
+    return count
@@ -0,0 +1,116 @@
+"""
+logins/urls.py のすべてのURLのベンチマーク
+テストクライアントでプロセス内から呼び出し、URL名毎にレイテンシ、スループット、クエリ数を測る
+"""
+import itertools
+import random
+from django.test import Client
+from django.urls import reverse
+from . import register, is_error, measure, rollback
+from .data import EMAIL, PASSWORD, generate_users
+from ..models import User
+from ..urls import urlpatterns
+from ..utils import get_jwt
+
+# バッチ系のURLで1リクエストに入れる件数
+BATCH = 10
+
+
+class Context:
+    """
+    リクエストを組み立てるための状態
+    actorは認証が必要なURLで使うスタッフのユーザー
+    """
+
+    def __init__(self, users):
+        self.users = users
+        self.actor = User.objects.create_user(user_name="bench_actor", email="bench_actor@example.com",
+                                              password=PASSWORD, is_staff=True)
+        self.sequence = itertools.count()
+
+    def headers(self):
+        return {"Authorization": "JWT " + get_jwt(self.actor)["access"]}
+
+    def new_user(self):
+        n = next(self.sequence)
+        return {"user_name": "bench_new%d" % n, "email": "bench_new%d@example.com" % n, "password": PASSWORD}
+
+    def existing_email(self):
+        if not self.users:
+            return self.actor.email
+        return EMAIL % random.randrange(self.users)
+
+    def existing_ids(self, count):
+        emails = [EMAIL % n for n in random.sample(range(self.users), min(count, self.users))]
+        return list(User.objects.filter(email__in=emails).values_list("id", flat=True))
+
+
+def json_body(data):
+    return {"data": data, "content_type": "application/json"}
+
+
+# URL名 -> Contextから (メソッド, kwargs, クライアントへの引数) を作る関数
+# 毎回新しいトークンやユーザーが必要なURLもあるので、リクエスト毎に呼び出す
+REQUESTS = {
+    "token_obtain_pair": lambda ctx: ("post", {}, {"data": {"email": ctx.existing_email(), "password": PASSWORD}}),
+    "token_refresh": lambda ctx: ("post", {}, {"data": {"refresh": get_jwt(ctx.actor)["refresh"]}}),
+    "token_verify": lambda ctx: ("post", {}, {"data": {"token": get_jwt(ctx.actor)["access"]}}),
+    "token_introspect": lambda ctx: ("post", {}, json_body({"tokens": [get_jwt(ctx.actor)["access"]
+                                                                       for _ in range(BATCH)]})),
+    "jwks": lambda ctx: ("get", {}, {}),
+    "metrics": lambda ctx: ("get", {}, {}),
+    "index": lambda ctx: ("get", {}, {}),
+    "signup": lambda ctx: ("post", {}, {"data": ctx.new_user()}),
+    "signup_batch": lambda ctx: ("post", {}, {**json_body([ctx.new_user() for _ in range(BATCH)]),
+                                              "headers": ctx.headers()}),
+    "update_batch": lambda ctx: ("patch", {}, {**json_body([{"id": user_id, "user_name": ctx.new_user()["user_name"]}
+                                                            for user_id in ctx.existing_ids(BATCH)]),
+                                               "headers": ctx.headers()}),
+    "update": lambda ctx: ("patch", {"pk": ctx.actor.pk}, {**json_body({"user_name": ctx.new_user()["user_name"]}),
+                                                           "headers": ctx.headers()}),
+    "update_password": lambda ctx: ("patch", {"pk": ctx.actor.pk}, {**json_body({"password": PASSWORD}),
+                                                                    "headers": ctx.headers()}),
+    "login": lambda ctx: ("post", {}, {"data": {"email": ctx.existing_email(), "password": PASSWORD}}),
+    "logout": lambda ctx: ("delete", {}, {"headers": ctx.headers()}),
+    "async_signup": lambda ctx: ("post", {}, json_body(ctx.new_user())),
+    "async_login": lambda ctx: ("post", {}, json_body({"email": ctx.existing_email(), "password": PASSWORD})),
+    "async_logout": lambda ctx: ("delete", {}, {"headers": ctx.headers()}),
+}
+
+
+def url_names():
+    return [pattern.name for pattern in urlpatterns if pattern.name]
+
+
+@register("endpoints")
+def endpoints(iterations, users=10000, urls=None, **options):
+    """
+    users件のユーザーを作ってから、URL名毎にiterations回リクエストする
+    REQUESTS に無いURL名は missing として、2xx以外の応答の数は errors として報告する
+    """
+    rows = []
+    with rollback():
+        generate_users(users)
+        ctx = Context(users)
+        for name in url_names():
+            if urls and name not in urls:
+                continue
+            if name not in REQUESTS:
+                rows.append({"case": name, "error": "missing"})
+                continue
+
+            def setup(name=name):
+                method, kwargs, request = REQUESTS[name](ctx)
+                return Client(), method, reverse("logins:" + name, kwargs=kwargs), request
+
+            status_codes = []
+
+            def send(args):
+                client, method, url, request = args
+                status_codes.append(getattr(client, method)(url, **request).status_code)
+
+            row = measure(name, send, iterations, setup=setup)
+            row["status"] = ",".join(str(code) for code in sorted(set(status_codes)))
+            row["errors"] = sum(1 for code in status_codes if is_error(code))
+            rows.append(row)
+    return rows
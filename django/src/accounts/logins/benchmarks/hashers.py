@@ -0,0 +1,72 @@
+"""
+パスワードハッシュのベンチマーク
+ポリシーの候補毎に1コアあたりの毎秒ハッシュ数を測り、ログイン用のワーカー数を見積もる
+"""
+import multiprocessing
+import time
+from django.conf import settings
+from django.contrib.auth.hashers import get_hasher
+from django.test import override_settings
+from . import register
+
+# 比較するポリシーの候補 (settings.LOGINS を上書きする値)
+CANDIDATES = [
+    {"PASSWORD_ALGORITHM": "pbkdf2_sha256", "PBKDF2_ITERATIONS": 600000},
+    {"PASSWORD_ALGORITHM": "pbkdf2_sha256", "PBKDF2_ITERATIONS": 260000},
+    {"PASSWORD_ALGORITHM": "argon2", "ARGON2_TIME_COST": 2, "ARGON2_MEMORY_COST": 102400, "ARGON2_PARALLELISM": 8},
+    {"PASSWORD_ALGORITHM": "argon2", "ARGON2_TIME_COST": 1, "ARGON2_MEMORY_COST": 19456, "ARGON2_PARALLELISM": 1},
+    {"PASSWORD_ALGORITHM": "bcrypt_sha256", "BCRYPT_ROUNDS": 12},
+    {"PASSWORD_ALGORITHM": "bcrypt_sha256", "BCRYPT_ROUNDS": 10},
+    {"PASSWORD_ALGORITHM": "scrypt", "SCRYPT_WORK_FACTOR": 2 ** 14},
+]
+
+
+def hash_for(candidate, duration):
+    """
+    候補のポリシーでduration秒ハッシュし続けて、ハッシュした回数を返す
+    """
+    with override_settings(LOGINS={**settings.LOGINS, **candidate}):
+        hasher = get_hasher(candidate["PASSWORD_ALGORITHM"])
+        count = 0
+        deadline = time.perf_counter() + duration
+        while time.perf_counter() < deadline:
+            hasher.encode("benchmark password", hasher.salt())
+            count += 1
+    return count
+
+
+def describe(candidate):
+    return ",".join("%s=%s" % (key, value) for key, value in candidate.items()
+                    if key != "PASSWORD_ALGORITHM")
+
+
+@register("password_hashers")
+def password_hashers(processes=1, duration=2.0, **options):
+    """
+    候補毎に1プロセスと、processes個のプロセスを同時に動かした時の毎秒ハッシュ数を測る
+    """
+    processes = max(processes or 1, 1)
+    # forkできない環境ではDjangoを初期化し直せないので1プロセスで測る
+    if "fork" not in multiprocessing.get_all_start_methods():
+        processes = 1
+    rows = []
+    for candidate in CANDIDATES:
+        row = {"case": candidate["PASSWORD_ALGORITHM"], "cost": describe(candidate)}
+        try:
+            single = hash_for(candidate, duration) / duration
+        except ValueError as e:
+            # argon2-cffi, bcrypt が入っていない
+            rows.append({**row, "error": str(e)})
+            continue
+        if processes > 1:
+            with multiprocessing.get_context("fork").Pool(processes) as pool:
+                total = sum(pool.starmap(hash_for, [(candidate, duration)] * processes)) / duration
+        else:
+            total = single
+        rows.append({**row,
+                     "hashes_per_sec": single,
+                     "ms_per_hash": 1000 / single if single else float("inf"),
+                     "processes": processes,
+                     "hashes_per_sec_per_core": total / processes,
+                     "hashes_per_sec_total": total})
+    return rows
@@ -0,0 +1,115 @@
+"""
+APIのパスでブラウザ向けのミドルウェアを通さない時と、APIだけのプロセス (LOGINS_API_ONLY=1) のベンチマーク
+"""
+import json
+import os
+import subprocess
+import sys
+from django.apps import apps
+from django.conf import settings
+from django.core.handlers.wsgi import WSGIHandler
+from django.test import RequestFactory, override_settings
+from django.urls import reverse
+from . import register, measure, percentile
+
+# logins/browser.py のミドルウェアと、その元のDjangoのミドルウェア
+DJANGO_MIDDLEWARE = {
+    "logins.browser.SessionMiddleware": "django.contrib.sessions.middleware.SessionMiddleware",
+    "logins.browser.CsrfViewMiddleware": "django.middleware.csrf.CsrfViewMiddleware",
+    "logins.browser.AuthenticationMiddleware": "django.contrib.auth.middleware.AuthenticationMiddleware",
+    "logins.browser.MessageMiddleware": "django.contrib.messages.middleware.MessageMiddleware",
+    "logins.browser.XFrameOptionsMiddleware": "django.middleware.clickjacking.XFrameOptionsMiddleware",
+}
+
+# 子プロセスで起動 (django.setup()、URLの読み込み、ハンドラーの作成) にかかった時間と読み込んだモジュールの数を出力する
+STARTUP_SCRIPT = """
+import sys, time
+start = time.perf_counter()
+import django
+django.setup()
+from django.core.handlers.wsgi import WSGIHandler
+from django.urls import get_resolver
+get_resolver().url_patterns
+WSGIHandler()
+print('{"seconds": %f, "modules": %d}' % (time.perf_counter() - start, len(sys.modules)))
+"""
+
+
+def handler(middleware):
+    """
+    middleware を読み込んだWSGIハンドラー
+    """
+    with override_settings(MIDDLEWARE=middleware):
+        return WSGIHandler()
+
+
+def profiles():
+    """
+    比較するミドルウェアの組み合わせ
+    full_stack: 全てのパスでDjangoのミドルウェアを通す (変更前)
+    lean: APIのパスではブラウザ向けのミドルウェアが何もしない
+    api_only: ブラウザ向けのミドルウェアが無い (LOGINS_API_ONLY=1)
+    """
+    full_stack = [DJANGO_MIDDLEWARE.get(middleware, middleware) for middleware in settings.MIDDLEWARE]
+    return {
+        "full_stack": full_stack,
+        "lean": list(settings.MIDDLEWARE),
+        "api_only": [middleware for middleware in full_stack if middleware not in DJANGO_MIDDLEWARE.values()],
+    }
+
+
+@register("middleware")
+def middleware(iterations, **options):
+    """
+    1リクエストの時間をミドルウェアの組み合わせ毎に比較する
+    jwks: ビューの処理が軽いAPIなのでミドルウェアの差が大きく出る
+    admin: 管理サイトは lean でもこれまで通り全てのミドルウェアを通る (api_only には無い)
+    """
+    factory = RequestFactory()
+    paths = {"jwks": reverse("logins:jwks")}
+    if apps.is_installed("django.contrib.admin"):
+        paths["admin"] = reverse("admin:login")
+    rows = []
+    for profile, stack in profiles().items():
+        get_response = handler(stack).get_response
+        for name, path in paths.items():
+            if name == "admin" and profile == "api_only":
+                continue
+            rows.append(measure("%s_%s" % (profile, name), lambda: get_response(factory.get(path)), iterations))
+    return rows
+
+
+def startup_times(api_only, iterations):
+    env = {**os.environ, "DJANGO_SETTINGS_MODULE": os.environ.get("DJANGO_SETTINGS_MODULE", "accounts.settings"),
+           "LOGINS_API_ONLY": "1" if api_only else "0"}
+    env["PYTHONPATH"] = os.pathsep.join(filter(None, [str(settings.BASE_DIR), env.get("PYTHONPATH")]))
+    results = []
+    for _ in range(iterations):
+        output = subprocess.run([sys.executable, "-c", STARTUP_SCRIPT], env=env, cwd=settings.BASE_DIR,
+                                check=True, capture_output=True, text=True).stdout
+        results.append(json.loads(output.splitlines()[-1]))
+    return results
+
+
+@register("startup")
+def startup(iterations, **options):
+    """
+    新しいプロセスの起動 (django.setup()、URLの読み込み、ハンドラーの作成) の時間を比較する
+    ワーカーの起動の度にかかるので、iterations は最大10回にする
+    full: 管理サイトとブラウザ向けのアプリを読み込む
+    api_only: LOGINS_API_ONLY=1
+    """
+    iterations = min(iterations, 10)
+    rows = []
+    for case, api_only in (("full", False), ("api_only", True)):
+        results = startup_times(api_only, iterations)
+        seconds = sorted(result["seconds"] for result in results)
+        rows.append({
+            "case": case,
+            "iterations": iterations,
+            "mean_us": sum(seconds) / iterations * 1e6,
+            "p50_us": percentile(seconds, 0.5) * 1e6,
+            "p99_us": percentile(seconds, 0.99) * 1e6,
+            "modules": results[-1]["modules"],
+        })
+    return rows
@@ -0,0 +1,37 @@
+"""
+レンダラーとパーサーのベンチマーク
+"""
+import io
+from rest_framework import parsers as drf_parsers
+from rest_framework import renderers as drf_renderers
+from . import register, measure, rollback
+from .data import generate_users
+from .. import parsers, renderers
+from ..models import User
+from ..serializer import UserSerializer
+
+FORMATS = (
+    ("drf_json", drf_renderers.JSONRenderer, drf_parsers.JSONParser),
+    ("orjson", renderers.JSONRenderer, parsers.JSONParser),
+    ("msgpack", renderers.MessagePackRenderer, parsers.MessagePackParser),
+)
+
+
+@register("renderers")
+def renderers_benchmark(iterations, users=10000, **options):
+    """
+    users件のユーザー一覧(UserSerializerの出力)のエンコードとデコードを形式毎に比較する
+    """
+    rows = []
+    with rollback():
+        generate_users(users)
+        data = UserSerializer(User.objects.order_by("id")[:users], many=True).data
+        for name, renderer_class, parser_class in FORMATS:
+            renderer = renderer_class()
+            parser = parser_class()
+            body = renderer.render(data)
+            row = measure("%s_render" % name, lambda: renderer.render(data), iterations)
+            row["bytes"] = len(body)
+            rows.append(row)
+            rows.append(measure("%s_parse" % name, lambda: parser.parse(io.BytesIO(body)), iterations))
+    return rows
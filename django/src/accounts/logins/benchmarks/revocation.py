@@ -0,0 +1,48 @@
+"""
+トークンの失効リストのベンチマーク
+"""
+import time
+import uuid
+from django.conf import settings
+from django.test import override_settings
+from . import register, measure, rollback
+from ..models import User
+from ..revocation import revocation_list
+from ..tokens import AccessToken
+from ..utils import get_jwt
+
+
+@register("token_revocation")
+def token_revocation(iterations, revoked=10000, **options):
+    """
+    失効リストなし、失効リストあり(失効していないトークン/失効したトークン)で
+    アクセストークンの検証1回あたりの時間を比較する
+    失効リストには revoked 個のjtiを入れておく
+    """
+    rows = []
+    with rollback():
+        user = User.objects.create_user(user_name="bench_user",
+                                        email="bench@example.com",
+                                        password="password")
+        access = get_jwt(user)["access"]
+        revoked_access = get_jwt(user)["access"]
+        revocation_list.reset()
+        exp = time.time() + 3600
+        for _ in range(revoked):
+            revocation_list._add(uuid.uuid4().hex, exp)
+        AccessToken(revoked_access).revoke()
+
+        def verify(token):
+            def run():
+                try:
+                    AccessToken(token)
+                except Exception:
+                    pass
+            return run
+
+        with override_settings(LOGINS={**settings.LOGINS, "REVOCATION": False}):
+            rows.append(measure("disabled", verify(access), iterations))
+        rows.append(measure("valid", verify(access), iterations))
+        rows.append(measure("revoked", verify(revoked_access), iterations))
+        revocation_list.reset()
+    return rows
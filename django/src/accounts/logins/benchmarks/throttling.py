@@ -0,0 +1,35 @@
+"""
+トークンバケットのスロットルと負荷制限のベンチマーク
+"""
+from django.core.cache import cache
+from . import register, measure
+from ..throttling import buckets, check_overload
+
+RATE = (10, 10 / 60)
+
+
+@register("throttling")
+def throttling(iterations, **options):
+    """
+    1回の判定の時間を比較する
+    allowed: 共有のキャッシュを読み書きして許可する
+    denied_local: プロセス内のバケットが空なので共有のキャッシュを見ずに断る
+    denied_shared: プロセス内のバケットが無く、共有のキャッシュを読んで断る
+    overload: 過負荷の判定
+    """
+    rows = []
+    cache.clear()
+    buckets.reset()
+    # 毎回違うキーなので常に満タンのバケットから1つ使う
+    keys = iter(range(10 ** 9))
+    rows.append(measure("allowed", lambda: buckets.consume("bench:allowed:%d" % next(keys), *RATE), iterations))
+
+    for _ in range(RATE[0]):
+        buckets.consume("bench:denied", *RATE)
+    rows.append(measure("denied_local", lambda: buckets.consume("bench:denied", *RATE), iterations))
+    rows.append(measure("denied_shared", lambda _: buckets.consume("bench:denied", *RATE), iterations,
+                        setup=buckets.reset))
+    rows.append(measure("overload", check_overload, iterations))
+    cache.clear()
+    buckets.reset()
+    return rows
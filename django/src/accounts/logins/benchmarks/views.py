@@ -0,0 +1,78 @@
+"""
+ビューのベンチマーク
+"""
+from django.conf import settings
+from django.test import Client, override_settings
+from django.urls import reverse
+from . import register, measure, rollback
+from .. import listcache
+from ..models import User
+from ..utils import get_jwt
+
+
+@register("user_list_cache")
+def user_list_cache(iterations, **options):
+    """
+    ユーザー一覧をキャッシュなし・キャッシュあり・304で取得した時を比較する
+    """
+    client = Client()
+    url = reverse("logins:index")
+    with rollback():
+        User.objects.bulk_create(
+            User(user_name="bench%d" % i, email="bench%d@example.com" % i, password="!")
+            for i in range(100)
+        )
+        listcache.stats.reset()
+        rows = [measure("uncached", lambda: (listcache.invalidate(), client.get(url)), iterations)]
+        etag = client.get(url)["ETag"]
+        rows += [
+            measure("cached", lambda: client.get(url), iterations),
+            measure("not_modified", lambda: client.get(url, headers={"If-None-Match": etag}), iterations),
+            {"case": "stats", **listcache.stats.as_dict()},
+        ]
+    return rows
+
+
+@register("token_introspect")
+def token_introspect(iterations, batch=100, **options):
+    """
+    batch個のトークンを api/token/verify/ に1つずつ送った時と、
+    api/token/introspect/ にまとめて送った時を比較する
+    """
+    client = Client()
+    verify_url = reverse("logins:token_verify")
+    introspect_url = reverse("logins:token_introspect")
+    with rollback():
+        users = User.objects.bulk_create_users(
+            [User(user_name="bench%d" % i, email="bench%d@example.com" % i, password="!")
+             for i in range(batch // 2)])
+        # ゲートウェイでは同じユーザーのトークンが何度も来るので半分は重複させる
+        tokens = [get_jwt(user)["access"] for user in users] * 2
+
+        def verify_each():
+            for token in tokens:
+                client.post(verify_url, {"token": token})
+
+        def introspect():
+            client.post(introspect_url, {"tokens": tokens}, content_type="application/json")
+
+        return [
+            measure("verify_x%d" % len(tokens), verify_each, iterations),
+            measure("introspect_x%d" % len(tokens), introspect, iterations),
+        ]
+
+
+@register("metrics_overhead")
+def metrics_overhead(iterations, **options):
+    """
+    LOGINS["METRICS"] の有無で、キャッシュされたユーザー一覧の1リクエストあたりの時間を比較する
+    """
+    client = Client()
+    url = reverse("logins:index")
+    with rollback():
+        client.get(url)
+        rows = []
+        for enabled in (False, True):
+            with override_settings(LOGINS={**settings.LOGINS, "METRICS": enabled}):
+                rows.append(measure("metrics_%s" % ("on" if enabled else "off"), lambda: client.get(url), iterations))
+    return rows
@@ -0,0 +1,55 @@
+"""
+管理サイトなどのブラウザ向けのパスだけに適用するDjangoのミドルウェア
+
+JWTで認証するAPI (LOGINS["API_PATH_PREFIXES"] のパス) にはセッション、メッセージ、
+CSRF(DRFのビューはcsrf_exemptで、クッキー認証のCSRFは認証クラスで検査する)、
+認証(DRFが認証クラスで行う)、クリックジャッキング対策のヘッダーは要らないので、何もせず次に渡す
+管理サイトのシステムチェックが通るように、それぞれDjangoのミドルウェアのサブクラスにする
+
+APIだけのプロセス (LOGINS_API_ONLY=1) では settings.py がこのモジュールを読み込まない
+"""
+from django.contrib.auth import middleware as auth
+from django.contrib.messages import middleware as messages
+from django.contrib.sessions import middleware as sessions
+from django.middleware import clickjacking, csrf
+from .conf import logins_settings
+
+
+def is_api_request(request):
+    return request.path_info.startswith(tuple(logins_settings.API_PATH_PREFIXES))
+
+
+class SkipAPIMixin:
+    """
+    APIのリクエストではミドルウェアの処理をせずにそのまま次に渡す
+    非同期の時は get_response がコルーチンを返すので、そのまま返せばよい
+    """
+
+    def __call__(self, request):
+        if is_api_request(request):
+            return self.get_response(request)
+        return super().__call__(request)
+
+
+class SessionMiddleware(SkipAPIMixin, sessions.SessionMiddleware):
+    pass
+
+
+class CsrfViewMiddleware(SkipAPIMixin, csrf.CsrfViewMiddleware):
+
+    def process_view(self, request, callback, callback_args, callback_kwargs):
+        if is_api_request(request):
+            return None
+        return super().process_view(request, callback, callback_args, callback_kwargs)
+
+
+class AuthenticationMiddleware(SkipAPIMixin, auth.AuthenticationMiddleware):
+    pass
+
+
+class MessageMiddleware(SkipAPIMixin, messages.MessageMiddleware):
+    pass
+
+
+class XFrameOptionsMiddleware(SkipAPIMixin, clickjacking.XFrameOptionsMiddleware):
+    pass
@@ -0,0 +1,183 @@
+"""
+ユーザーの一括インポート・エクスポート
+CSVとJSON Linesをストリームで読み書きし、バッチ毎に bulk_create する
+"""
+import csv
+import json
+import multiprocessing
+from django.contrib.auth import hashers
+from django.core.exceptions import ValidationError
+from .hashpool import _init_worker
+from .models import BulkUniqueError, User
+
+# インポート・エクスポートする列
+FIELDS = ("user_name", "email", "password", "is_active", "is_staff", "is_superuser")
+BOOLEAN_FIELDS = ("is_active", "is_staff", "is_superuser")
+
+
+def detect_format(path, format=None):
+    if format:
+        return format
+    return "csv" if str(path).endswith(".csv") else "jsonl"
+
+
+def read_users(stream, format):
+    """
+    ストリームから1行ずつユーザーの辞書を返す
+    """
+    if format == "csv":
+        yield from csv.DictReader(stream)
+    else:
+        for line in stream:
+            if line.strip():
+                yield json.loads(line)
+
+
+def write_users(stream, format, chunk_size=2000):
+    """
+    全ユーザーをidのキーセットでチャンク毎に読み込み、ストリームに書き出す
+    パスワードはDjangoのハッシュ形式のまま書き出すので、そのままインポートできる
+    """
+    writer = None
+    if format == "csv":
+        writer = csv.DictWriter(stream, fieldnames=FIELDS)
+        writer.writeheader()
+    count = 0
+    last_id = 0
+    while True:
+        rows = list(User.objects.filter(id__gt=last_id).order_by("id").values("id", *FIELDS)[:chunk_size])
+        for row in rows:
+            last_id = row.pop("id")
+            if writer:
+                writer.writerow(row)
+            else:
+                stream.write(json.dumps(row, ensure_ascii=False) + "\n")
+        count += len(rows)
+        if len(rows) < chunk_size:
+            return count
+
+
+def to_bool(value, default):
+    if value in (None, ""):
+        return default
+    if isinstance(value, bool):
+        return value
+    return str(value).strip().lower() in ("1", "true", "yes")
+
+
+def is_hashed(password):
+    """
+    Djangoのハッシュ形式(algorithm$...)か、使えないパスワード(!...)ならTrue
+    """
+    if not hashers.is_password_usable(password):
+        return True
+    try:
+        hashers.identify_hasher(password)
+    except ValueError:
+        return False
+    return True
+
+
+class UserImporter:
+    """
+    ユーザーの辞書をバッチ毎にまとめて検証・ハッシュ・重複検査し、トランザクション内で bulk_create する
+    平文のパスワードはprocesses個のプロセスで並列にハッシュする
+    """
+
+    def __init__(self, batch_size=1000, processes=1):
+        self.batch_size = batch_size
+        self.processes = processes
+        self.created = 0
+        # (行番号, 理由) のリスト
+        self.skipped = []
+        self._pool = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        if self._pool is not None:
+            self._pool.terminate()
+            self._pool.join()
+
+    def run(self, rows):
+        batch = []
+        for line, row in enumerate(rows, start=1):
+            batch.append((line, row))
+            if len(batch) >= self.batch_size:
+                self.import_batch(batch)
+                batch = []
+        if batch:
+            self.import_batch(batch)
+        return self.created
+
+    def import_batch(self, batch):
+        users = self.build_users(batch)
+        users = self.drop_conflicts(users)
+        self.hash_passwords([user for _, user in users])
+        try:
+            User.objects.bulk_create_users([user for _, user in users], batch_size=self.batch_size)
+        except BulkUniqueError as e:
+            # 重複の検査の後に他のプロセスが同じ値で登録した行だけを飛ばす
+            for position, errors in sorted(e.errors.items()):
+                line, user = users[position]
+                self.skipped.append((line, "conflict: %s" % ", ".join(
+                    "%s %s" % (field, getattr(user, field)) for field in errors)))
+            self.created += len(users) - len(e.errors)
+            return
+        self.created += len(users)
+
+    def build_users(self, batch):
+        users = []
+        for line, row in batch:
+            user = User(user_name=(row.get("user_name") or "").strip(),
+                        email=User.objects.normalize_email((row.get("email") or "").strip()),
+                        password=row.get("password") or "",
+                        is_active=to_bool(row.get("is_active"), True),
+                        is_staff=to_bool(row.get("is_staff"), False),
+                        is_superuser=to_bool(row.get("is_superuser"), False))
+            try:
+                user.clean_fields(exclude=["password", "last_login"])
+            except ValidationError as e:
+                self.skipped.append((line, "invalid: %s" % "; ".join(
+                    "%s: %s" % (field, " ".join(errors)) for field, errors in e.message_dict.items())))
+                continue
+            if not user.password:
+                self.skipped.append((line, "invalid: password: This field cannot be blank."))
+                continue
+            users.append((line, user))
+        return users
+
+    def drop_conflicts(self, users):
+        """
+        バッチ内とDBの重複を、フィールド毎に1回のクエリで調べて取り除く (大文字小文字は区別しない)
+        """
+        taken_user_names, taken_emails = User.objects.find_conflicts(
+            [user.user_name for _, user in users], [user.email for _, user in users])
+        kept = []
+        for line, user in users:
+            if user.user_name.lower() in taken_user_names:
+                self.skipped.append((line, "conflict: user_name %s" % user.user_name))
+            elif user.email.lower() in taken_emails:
+                self.skipped.append((line, "conflict: email %s" % user.email))
+            else:
+                taken_user_names[user.user_name.lower()] = None
+                taken_emails[user.email.lower()] = None
+                kept.append((line, user))
+        return kept
+
+    def hash_passwords(self, users):
+        plain = [user for user in users if not is_hashed(user.password)]
+        if not plain:
+            return
+        passwords = [user.password for user in plain]
+        # 全て登録済みのハッシュならプロセスを起動しない
+        if self._pool is None and self.processes > 1:
+            self._pool = multiprocessing.get_context("spawn").Pool(self.processes, initializer=_init_worker)
+        if self._pool is not None:
+            chunksize = max(len(passwords) // (self.processes * 4), 1)
+            encoded = self._pool.map(hashers.make_password, passwords, chunksize)
+        else:
+            encoded = [hashers.make_password(password) for password in passwords]
+        for user, password in zip(plain, encoded):
+            user.password = password
@@ -0,0 +1,52 @@
+"""
+logins アプリのシステムチェック
+"""
+from django.conf import settings
+from django.core.checks import Error, Tags, Warning, register
+from .conf import logins_settings
+
+# ワーカー間で共有しないと、ワーカー毎に結果が変わる設定
+# (古い一覧や304を返す、制限がワーカー毎になる、同じトークンを何度も更新する)
+SHARED_CACHE_SETTINGS = ("USER_LIST_CACHE", "THROTTLE_CACHE", "SILENT_REFRESH_CACHE")
+
+# プロセス毎に別々になるキャッシュのバックエンド
+LOCAL_CACHE_BACKENDS = (
+    "django.core.cache.backends.locmem.LocMemCache",
+    "django.core.cache.backends.dummy.DummyCache",
+)
+
+
+def is_local_cache(alias):
+    return settings.CACHES.get(alias, {}).get("BACKEND") in LOCAL_CACHE_BACKENDS
+
+
+@register(Tags.caches)
+def check_revocation_cache(app_configs, **kwargs):
+    """
+    失効リストはワーカー間で共有され、再起動しても消えないキャッシュでなければ働かない
+    1プロセスだけで動かす開発環境では SILENCED_SYSTEM_CHECKS で無視する
+    """
+    if not logins_settings.REVOCATION or not is_local_cache(logins_settings.REVOCATION_CACHE):
+        return []
+    return [Error(
+        "LOGINS['REVOCATION_CACHE'] (%r) is not shared between processes." % logins_settings.REVOCATION_CACHE,
+        hint="Use a shared cache such as Redis or Memcached (set LOGINS_REDIS_URL), otherwise a revoked "
+             "token stays valid on the other workers and after a restart.",
+        id="logins.E001",
+    )]
+
+
+@register(Tags.caches)
+def check_shared_caches(app_configs, **kwargs):
+    """
+    ユーザー一覧のキャッシュ、スロットル、サイレントリフレッシュのロックが、複数のワーカーで共有されないキャッシュなら警告する
+    """
+    local = [name for name in SHARED_CACHE_SETTINGS if is_local_cache(getattr(logins_settings, name))]
+    if not local:
+        return []
+    return [Warning(
+        "%s use a cache that is not shared between processes." % ", ".join("LOGINS[%r]" % name for name in local),
+        hint="Use a shared cache such as Redis or Memcached when running more than one worker "
+             "(set LOGINS_REDIS_URL).",
+        id="logins.W001",
+    )]
@@ -0,0 +1,140 @@
+"""
+logins アプリの設定
+settings.LOGINS の辞書で上書きできる
+"""
+from django.conf import settings
+
+DEFAULTS = {
+    # JWT認証でリクエストユーザーを作る方法
+    #   "db"     : リクエスト毎にDBからユーザーを取得する
+    #   "cache"  : プロセス内のLRU/TTLキャッシュからユーザーを取得する
+    #   "claims" : トークンのクレームからユーザーを作る (DBにアクセスしない)
+    "AUTH_USER_MODE": "db",
+    # "cache"モードで保持するユーザーの最大数
+    "USER_CACHE_SIZE": 10000,
+    # "cache"モードでユーザーを保持する秒数
+    "USER_CACHE_TTL": 60,
+    # ユーザー一覧の1ページあたりの件数と、page_sizeで指定できる最大件数
+    "INDEX_PAGE_SIZE": 100,
+    "INDEX_MAX_PAGE_SIZE": 1000,
+    # ユーザー一覧のストリーミングで1回のクエリで読む件数
+    "INDEX_STREAM_CHUNK_SIZE": 2000,
+    # ユーザー一覧のページを保存するキャッシュ(settings.CACHESの名前)と保持する秒数
+    "USER_LIST_CACHE": "default",
+    "USER_LIST_CACHE_TTL": 300,
+    # パスワードハッシュのアルゴリズム (settings.PASSWORD_HASHERS の並び順を決める)
+    "PASSWORD_ALGORITHM": "pbkdf2_sha256",
+    # アルゴリズム毎のコスト (logins/hashers.py)
+    "PBKDF2_ITERATIONS": 600000,
+    "ARGON2_TIME_COST": 2,
+    "ARGON2_MEMORY_COST": 102400,
+    "ARGON2_PARALLELISM": 8,
+    "BCRYPT_ROUNDS": 12,
+    "SCRYPT_WORK_FACTOR": 2 ** 14,
+    # パスワードのハッシュと検証をワーカープールで行うか (logins/hashpool.py)
+    "HASH_POOL": False,
+    # "thread" | "process"
+    "HASH_POOL_KIND": "thread",
+    "HASH_POOL_WORKERS": 4,
+    # ワーカーが全て埋まっている時に待たせる数。超えたら503を返す
+    "HASH_POOL_MAX_QUEUE": 16,
+    # プールの結果を待つ秒数と、503の時のRetry-Afterの秒数
+    "HASH_POOL_TIMEOUT": 10,
+    "HASH_POOL_RETRY_AFTER": 1,
+    # 一括登録・一括更新で1回に受け付けるユーザーの最大数
+    "BATCH_MAX_SIZE": 1000,
+    # ログアウトしたトークンをjtiで失効させるか (logins/revocation.py)
+    "REVOCATION": True,
+    # 失効したjtiを共有するキャッシュ(settings.CACHESの名前)と、他のプロセスの失効を読み込む間隔(秒)
+    "REVOCATION_CACHE": "default",
+    "REVOCATION_SYNC_INTERVAL": 1.0,
+    # プロセス内のBloomフィルターの初期の容量と偽陽性率
+    "REVOCATION_BLOOM_CAPACITY": 100000,
+    "REVOCATION_BLOOM_ERROR_RATE": 0.001,
+    # jwtの署名鍵 (logins/keyring.py)。空ならSIMPLE_JWTの設定(HS256とSECRET_KEY)で署名する
+    # [{"kid": "2024-01", "algorithm": "RS256", "private_key": "PEMかファイルのパス", "public_key": "..."}, ...]
+    # 先頭の鍵で署名し、残りの鍵は発行済みトークンの検証だけに使う
+    "SIGNING_KEYS": [],
+    # kidの無いトークン(キーリング導入前に発行されたもの)をSIMPLE_JWTの鍵で検証するか
+    "SIGNING_ACCEPT_LEGACY": True,
+    # JWKSエンドポイントのCache-Controlのmax-age(秒)
+    "JWKS_MAX_AGE": 3600,
+    # 読み込みに使うレプリカのデータベースのエイリアス (logins/routers.py)。空ならすべてdefaultを使う
+    "READ_REPLICAS": [],
+    # 書き込んだクライアントがプライマリから読み込み続ける秒数。レプリカの遅延より長くする
+    "REPLICA_STICKY_SECONDS": 5,
+    # メトリクスを記録して /metrics で公開するか (logins/metrics.py)
+    "METRICS": True,
+    # 複数のプロセスのメトリクスを足し合わせるためのスナップショットのディレクトリ。Noneならプロセス内だけ
+    "METRICS_DIR": None,
+    # スナップショットを書き出す間隔(秒)
+    "METRICS_FLUSH_INTERVAL": 5.0,
+    # /metrics を返すクライアントのアドレス (ネットワークも書ける)。プロキシの後ろでは REMOTE_ADDR はプロキシになる
+    "METRICS_ALLOWED_IPS": ("127.0.0.1", "::1"),
+    # "Authorization: Bearer <トークン>" を送れば、アドレスに関わらず /metrics を返す。Noneなら使わない
+    "METRICS_TOKEN": None,
+    # ログイン、サインアップ、トークン発行のトークンバケット (logins/throttling.py)
+    # "回数/期間" で、回数がバケットの容量、回数/期間が毎秒の補充になる。Noneなら制限しない
+    "THROTTLE_RATES": {"ip": None, "account": None},
+    # バケットを共有するキャッシュ(settings.CACHESの名前)
+    "THROTTLE_CACHE": "default",
+    # 実行中と待ち行列のハッシュがこの数以上なら、ハッシュが必要なリクエストを503で断る
+    "SHED_MAX_PENDING_HASHES": 16,
+    # 直近のハッシュ1回あたりの時間(秒、キュー待ちを含む)がこれを超えたら断る。Noneなら見ない
+    "SHED_MAX_HASH_LATENCY": None,
+    # ハッシュの時間をこの秒数より古いものは使わない
+    "SHED_WINDOW": 5.0,
+    # CPUあたりの1分間のロードアベレージがこれを超えたら断る。Noneなら見ない
+    "SHED_MAX_LOAD": None,
+    # 断った時のRetry-After(秒)
+    "SHED_RETRY_AFTER": 1,
+    # Authorizationヘッダーが無い時に、ログインでセットしたクッキーのアクセストークンで認証する
+    "AUTH_COOKIE": True,
+    # クッキーで認証したPOSTなどのリクエストにCSRFトークンを要求する
+    "AUTH_COOKIE_ENFORCE_CSRF": True,
+    # クッキーのアクセストークンの残りがこの秒数を切ったら、リフレッシュトークンのクッキーで
+    # リクエストの中でローテーションする (logins/refresh.py)。Noneならしない
+    "SILENT_REFRESH_THRESHOLD": 300,
+    # 並列のリクエストで1回だけローテーションするためのロックと結果を置くキャッシュ(settings.CACHESの名前)
+    "SILENT_REFRESH_CACHE": "default",
+    # ローテーションの結果を他のリクエストに渡すためにキャッシュに置く秒数
+    "SILENT_REFRESH_GRACE": 30,
+    # 他のリクエストのローテーションを待つ最大の秒数
+    "SILENT_REFRESH_WAIT": 2.0,
+    # ログインとアクセスの記録 (last_login, last_seen, login_count) をワーカーのメモリにまとめて書き込む
+    # (logins/activity.py)
+    "ACTIVITY_TRACKING": True,
+    # まとめた記録を書き込む間隔(秒)
+    "ACTIVITY_FLUSH_INTERVAL": 10.0,
+    # メモリに保持するユーザーの最大数。超えたらすぐに書き込む
+    "ACTIVITY_BUFFER_SIZE": 1000,
+    # 1回のUPDATEで書き込むユーザーの数
+    "ACTIVITY_BATCH_SIZE": 500,
+    # 認証の監査ログ (logins/audit.py)。イベントはプロセス内のバッファからまとめてINSERTする
+    "AUDIT": True,
+    # バッファに保持するイベントの最大数
+    "AUDIT_BUFFER_SIZE": 10000,
+    # 1回のINSERTで書き込むイベントの数。これだけ溜まったら間隔を待たずに書き込む
+    "AUDIT_BATCH_SIZE": 500,
+    # バックグラウンドのスレッドが書き込む間隔(秒)。Noneならスレッドを使わない (終了時とflush()だけ)
+    "AUDIT_FLUSH_INTERVAL": 1.0,
+    # バッファが溢れた時と書き込みに失敗した時にイベントを追記するディレクトリ。Noneなら古いイベントから捨てる
+    "AUDIT_SPILL_DIR": None,
+    # prune_auth_events で消すまでイベントを残す日数
+    "AUDIT_RETENTION_DAYS": 90,
+    # JWTで認証するAPIのパスの接頭辞。セッションなどのブラウザ向けのミドルウェアを通さない (logins/browser.py)
+    "API_PATH_PREFIXES": ("/api/",),
+}
+
+
+class LoginsSettings:
+    """
+    settings.LOGINS を毎回参照するので override_settings にも追従する
+    """
+    def __getattr__(self, name):
+        if name not in DEFAULTS:
+            raise AttributeError("Invalid logins setting: '%s'" % name)
+        return getattr(settings, "LOGINS", {}).get(name, DEFAULTS[name])
+
+
+logins_settings = LoginsSettings()
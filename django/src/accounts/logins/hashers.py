@@ -0,0 +1,39 @@
+"""
+コストを settings.LOGINS で設定できるパスワードハッシャー達
+アルゴリズム名はDjango標準のものと同じなので、保存済みのハッシュもそのまま検証できる
+保存済みのハッシュのコストが設定と違う場合は、ログイン時に再ハッシュされる (上げる場合も下げる場合も)
+"""
+from django.contrib.auth import hashers
+from .conf import logins_settings
+
+
+class PBKDF2PasswordHasher(hashers.PBKDF2PasswordHasher):
+    @property
+    def iterations(self):
+        return logins_settings.PBKDF2_ITERATIONS
+
+
+class Argon2PasswordHasher(hashers.Argon2PasswordHasher):
+    @property
+    def time_cost(self):
+        return logins_settings.ARGON2_TIME_COST
+
+    @property
+    def memory_cost(self):
+        return logins_settings.ARGON2_MEMORY_COST
+
+    @property
+    def parallelism(self):
+        return logins_settings.ARGON2_PARALLELISM
+
+
+class BCryptSHA256PasswordHasher(hashers.BCryptSHA256PasswordHasher):
+    @property
+    def rounds(self):
+        return logins_settings.BCRYPT_ROUNDS
+
+
+class ScryptPasswordHasher(hashers.ScryptPasswordHasher):
+    @property
+    def work_factor(self):
+        return logins_settings.SCRYPT_WORK_FACTOR
@@ -0,0 +1,245 @@
+"""
+パスワードのハッシュと検証を専用のワーカープールで実行する
+リクエストのスレッドをKDFの間ずっと塞がないようにし、
+プールが詰まっている時は503を返してログインの集中から他のエンドポイントを守る
+"""
+import asyncio
+import atexit
+import threading
+import time
+from concurrent import futures
+from contextvars import ContextVar
+from multiprocessing import get_context
+from django.contrib.auth import hashers
+from django.utils.translation import gettext_lazy as _
+from rest_framework import status
+from rest_framework.exceptions import APIException
+from . import metrics
+from .conf import logins_settings
+
+# リクエスト中のハッシュの (キュー待ち秒, ハッシュ秒) のリスト
+request_timings = ContextVar("logins_hash_timings", default=None)
+# ハッシュの時間の指数移動平均で、新しい値にかける重み
+LATENCY_WEIGHT = 0.2
+
+
+class HashPoolSaturated(APIException):
+    """
+    プールが詰まっている。DRFが503とRetry-Afterヘッダーを返す
+    """
+    status_code = status.HTTP_503_SERVICE_UNAVAILABLE
+    default_detail = _("Too many password operations in progress. Try again later.")
+    default_code = "hash_pool_saturated"
+
+    def __init__(self, wait):
+        super().__init__()
+        self.wait = wait
+
+
+def _init_worker():
+    # spawnしたプロセスではDjangoを初期化し直す
+    import django
+    django.setup()
+
+
+def _timed(func, *args):
+    started = time.monotonic()
+    result = func(*args)
+    return result, started, time.monotonic()
+
+
+def _verify(password, encoded):
+    """
+    django.contrib.auth.hashers.check_password と同じ判定をして
+    (パスワードが正しいか, 再ハッシュが必要か) を返す
+    setterはプロセスをまたげないので、再ハッシュは呼び出し元で行う
+    """
+    try:
+        hasher = hashers.identify_hasher(encoded)
+    except ValueError:
+        return False, False
+    preferred = hashers.get_hasher("default")
+    hasher_changed = hasher.algorithm != preferred.algorithm
+    must_update = hasher_changed or preferred.must_update(encoded)
+    is_correct = hasher.verify(password, encoded)
+    if not is_correct and not hasher_changed and must_update:
+        hasher.harden_runtime(password, encoded)
+    return is_correct, must_update
+
+
+class HashPool:
+    """
+    LOGINS["HASH_POOL"] が有効な時はスレッドかプロセスのプールで、無効な時はその場でハッシュする
+    実行中と待ち行列の合計が HASH_POOL_WORKERS + HASH_POOL_MAX_QUEUE に達したら HashPoolSaturated を送出する
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._executor = None
+        self._executor_key = None
+        self._pending = 0
+        # キュー待ちとハッシュの合計時間の指数移動平均と、最後に記録した時刻 (負荷制限に使う)
+        self._latency = 0.0
+        self._latency_at = 0.0
+
+    @property
+    def pending(self):
+        """
+        実行中と待ち行列のハッシュの数 (プールが無効な時はリクエストのスレッドで実行中の数)
+        """
+        return self._pending
+
+    def latency(self, max_age):
+        """
+        直近のハッシュ1回あたりの時間(秒)。max_age秒以上記録が無ければ0を返す
+        """
+        if time.monotonic() - self._latency_at > max_age:
+            return 0.0
+        return self._latency
+
+    def _get_executor(self):
+        key = (logins_settings.HASH_POOL_KIND, logins_settings.HASH_POOL_WORKERS)
+        if self._executor_key != key:
+            if self._executor is not None:
+                self._executor.shutdown(wait=False)
+            kind, workers = key
+            if kind == "process":
+                self._executor = futures.ProcessPoolExecutor(max_workers=workers,
+                                                             mp_context=get_context("spawn"),
+                                                             initializer=_init_worker)
+            else:
+                self._executor = futures.ThreadPoolExecutor(max_workers=workers,
+                                                            thread_name_prefix="logins-hash")
+            self._executor_key = key
+        return self._executor
+
+    def run(self, func, *args):
+        """
+        funcを実行して結果を返し、キュー待ちとハッシュの時間を記録する
+        """
+        if not logins_settings.HASH_POOL:
+            with self._lock:
+                self._pending += 1
+            try:
+                result, started, finished = _timed(func, *args)
+            finally:
+                with self._lock:
+                    self._pending -= 1
+            self._record(0.0, finished - started)
+            return result
+
+        retry_after = logins_settings.HASH_POOL_RETRY_AFTER
+        with self._lock:
+            if self._pending >= logins_settings.HASH_POOL_WORKERS + logins_settings.HASH_POOL_MAX_QUEUE:
+                raise HashPoolSaturated(retry_after)
+            self._pending += 1
+            executor = self._get_executor()
+        submitted = time.monotonic()
+        future = self._submit(executor, func, *args)
+        try:
+            result, started, finished = future.result(timeout=logins_settings.HASH_POOL_TIMEOUT)
+        except futures.TimeoutError:
+            future.cancel()
+            raise HashPoolSaturated(retry_after)
+        self._record(started - submitted, finished - started)
+        return result
+
+    async def arun(self, func, *args):
+        """
+        runの非同期版。イベントループを塞がないように、プールが無効な時もスレッドで実行する
+        """
+        loop = asyncio.get_running_loop()
+        if not logins_settings.HASH_POOL:
+            with self._lock:
+                self._pending += 1
+            try:
+                result, started, finished = await loop.run_in_executor(None, _timed, func, *args)
+            finally:
+                with self._lock:
+                    self._pending -= 1
+            self._record(0.0, finished - started)
+            return result
+
+        retry_after = logins_settings.HASH_POOL_RETRY_AFTER
+        with self._lock:
+            if self._pending >= logins_settings.HASH_POOL_WORKERS + logins_settings.HASH_POOL_MAX_QUEUE:
+                raise HashPoolSaturated(retry_after)
+            self._pending += 1
+            executor = self._get_executor()
+        submitted = time.monotonic()
+        future = asyncio.wrap_future(self._submit(executor, func, *args))
+        try:
+            result, started, finished = await asyncio.wait_for(future, logins_settings.HASH_POOL_TIMEOUT)
+        except asyncio.TimeoutError:
+            raise HashPoolSaturated(retry_after)
+        self._record(started - submitted, finished - started)
+        return result
+
+    def _submit(self, executor, func, *args):
+        """
+        funcをプールに入れる。実行中のfutureはcancelで止まらないので、
+        タイムアウトした後も終わるまで pending に数える
+        """
+        try:
+            future = executor.submit(_timed, func, *args)
+        except BaseException:
+            self._release()
+            raise
+        future.add_done_callback(self._release)
+        return future
+
+    def _release(self, future=None):
+        with self._lock:
+            self._pending -= 1
+
+    def shutdown(self):
+        with self._lock:
+            executor = self._executor
+            self._executor = None
+            self._executor_key = None
+        # 終わったハッシュは _release でロックを取るので、ロックの外で終了を待つ
+        if executor is not None:
+            executor.shutdown(wait=True, cancel_futures=True)
+
+    def make_password(self, password):
+        return self.run(hashers.make_password, password)
+
+    def check_password(self, password, encoded, setter=None):
+        """
+        django.contrib.auth.hashers.check_password と同じく、正しければsetterで再ハッシュする
+        """
+        if password is None or not hashers.is_password_usable(encoded):
+            return False
+        is_correct, must_update = self.run(_verify, password, encoded)
+        if setter and is_correct and must_update:
+            setter(password)
+        return is_correct
+
+    async def amake_password(self, password):
+        return await self.arun(hashers.make_password, password)
+
+    async def acheck_password(self, password, encoded, setter=None):
+        """
+        check_passwordの非同期版。setterはコルーチンを返す
+        """
+        if password is None or not hashers.is_password_usable(encoded):
+            return False
+        is_correct, must_update = await self.arun(_verify, password, encoded)
+        if setter and is_correct and must_update:
+            await setter(password)
+        return is_correct
+
+    def _record(self, queue_wait, hash_time):
+        weight = LATENCY_WEIGHT if self._latency_at else 1.0
+        self._latency = self._latency * (1 - weight) + (queue_wait + hash_time) * weight
+        self._latency_at = time.monotonic()
+        if metrics.enabled():
+            metrics.hash_duration.observe(hash_time)
+            metrics.hash_queue_duration.observe(queue_wait)
+        timings = request_timings.get()
+        if timings is not None:
+            timings.append((queue_wait, hash_time))
+
+
+hash_pool = HashPool()
+atexit.register(hash_pool.shutdown)
@@ -0,0 +1,54 @@
+"""
+複数のトークンをまとめて検証するイントロスペクション
+同じトークンは1回だけ検証し、ユーザーは1回の id__in クエリで取得する
+"""
+from django.core.exceptions import ValidationError
+from rest_framework_simplejwt.exceptions import TokenError
+from rest_framework_simplejwt.settings import api_settings
+from .models import User
+from .tokens import SignedToken, is_revoked
+
+
+def inactive(error, claims=None, revoked=False):
+    return {"active": False, "revoked": revoked, "claims": claims, "error": error}
+
+
+def introspect_tokens(raw_tokens):
+    """
+    raw_tokens は文字列のリスト
+    トークン毎に active, revoked, claims, error を持つ辞書を、引数と同じ順番で返す
+    activeは署名と有効期限が正しく、失効しておらず、ユーザーが存在して有効な時にTrueになる
+    """
+    results = {}
+    user_ids = {}
+    for raw in dict.fromkeys(raw_tokens):
+        try:
+            token = SignedToken(raw)
+        except TokenError as e:
+            results[raw] = inactive(str(e))
+            continue
+        claims = token.payload
+        if is_revoked(token):
+            results[raw] = inactive("Token is revoked", claims, revoked=True)
+            continue
+        try:
+            user_ids[raw] = User._meta.pk.to_python(claims[api_settings.USER_ID_CLAIM])
+        except (KeyError, ValidationError):
+            results[raw] = inactive("Token contained no recognizable user identification", claims)
+            continue
+        results[raw] = claims
+
+    users = {}
+    if user_ids:
+        users = {user.pk: user for user in User.objects.filter(id__in=set(user_ids.values()))
+                                                  .only("id", "is_active")}
+    for raw, user_id in user_ids.items():
+        claims = results[raw]
+        user = users.get(user_id)
+        if user is None:
+            results[raw] = inactive("User not found", claims)
+        elif api_settings.CHECK_USER_IS_ACTIVE and not user.is_active:
+            results[raw] = inactive("User is inactive", claims)
+        else:
+            results[raw] = {"active": True, "revoked": False, "claims": claims, "error": None}
+    return [results[raw] for raw in raw_tokens]
@@ -0,0 +1,180 @@
+"""
+jwtの署名鍵のキーリング
+LOGINS["SIGNING_KEYS"] の先頭の鍵で署名し、ヘッダーのkidで検証に使う鍵を選ぶ
+先頭に新しい鍵を追加して古い鍵を後ろに残すことで、発行済みのトークンを無効にせずに鍵をローテーションできる
+RS256/EdDSAなどの非対称鍵はcryptography(requirements.txt)で扱う
+"""
+import hashlib
+import json
+import threading
+import jwt
+from django.core.exceptions import ImproperlyConfigured
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+from django.utils.functional import cached_property
+from django.utils.translation import gettext_lazy as _
+from rest_framework_simplejwt import state
+from rest_framework_simplejwt.backends import TokenBackend
+from rest_framework_simplejwt.exceptions import TokenBackendError
+from rest_framework_simplejwt.settings import api_settings
+from .conf import logins_settings
+
+_lock = threading.Lock()
+_keyring = None
+
+
+def read_key(value):
+    """
+    非対称鍵がPEMの文字列ならそのまま、それ以外はファイルのパスとして読み込む
+    """
+    if not value or value.lstrip().startswith("-----BEGIN"):
+        return value
+    with open(value) as f:
+        return f.read()
+
+
+class SigningKey:
+    """
+    kidと署名アルゴリズムを持つ1つの鍵
+    対称鍵(HS*)は private_key に共有鍵を入れ、public_key は使わない
+    """
+
+    def __init__(self, kid, algorithm, private_key=None, public_key=None):
+        if not kid:
+            raise ImproperlyConfigured("LOGINS['SIGNING_KEYS'] の鍵には kid が必要です")
+        self.kid = kid
+        self.algorithm = algorithm
+        self.symmetric = algorithm.startswith("HS")
+        # 対称鍵はそのまま共有鍵として使う
+        self.private_key = private_key if self.symmetric else read_key(private_key)
+        self.public_key = None if self.symmetric else read_key(public_key)
+        if not self.symmetric and not self.public_key:
+            if not self.private_key:
+                raise ImproperlyConfigured("鍵 %s には private_key か public_key が必要です" % kid)
+            self.public_key = self.algorithm_obj.prepare_key(self.private_key).public_key()
+
+    @cached_property
+    def algorithm_obj(self):
+        try:
+            return jwt.get_algorithm_by_name(self.algorithm)
+        except NotImplementedError as e:
+            raise ImproperlyConfigured("%s を使うにはcryptographyをインストールしてください" % self.algorithm) from e
+
+    def to_jwk(self):
+        """
+        公開鍵をJWKの辞書にする。対称鍵は公開しないのでNoneを返す
+        """
+        if self.symmetric:
+            return None
+        jwk = self.algorithm_obj.to_jwk(self.algorithm_obj.prepare_key(self.public_key), as_dict=True)
+        jwk.update({"kid": self.kid, "alg": self.algorithm, "use": "sig"})
+        return jwk
+
+    def make_backend(self):
+        """
+        この鍵で検証するTokenBackend
+        """
+        return TokenBackend(self.algorithm,
+                            signing_key=self.private_key if self.symmetric else None,
+                            verifying_key=self.public_key if not self.symmetric else "",
+                            audience=api_settings.AUDIENCE,
+                            issuer=api_settings.ISSUER,
+                            leeway=api_settings.LEEWAY,
+                            json_encoder=api_settings.JSON_ENCODER)
+
+
+class KeyringTokenBackend(TokenBackend):
+    """
+    先頭の鍵で署名してヘッダーにkidを入れ、kidの鍵で検証するTokenBackend
+    kidの無いトークンは SIGNING_ACCEPT_LEGACY の時だけ SIMPLE_JWT の鍵で検証する
+    """
+
+    def __init__(self, keys):
+        current = keys[0]
+        if not current.private_key:
+            raise ImproperlyConfigured("先頭の鍵 %s には署名に使う private_key が必要です" % current.kid)
+        super().__init__(current.algorithm,
+                         signing_key=current.private_key,
+                         verifying_key=current.public_key if not current.symmetric else "",
+                         audience=api_settings.AUDIENCE,
+                         issuer=api_settings.ISSUER,
+                         leeway=api_settings.LEEWAY,
+                         json_encoder=api_settings.JSON_ENCODER)
+        self.kid = current.kid
+        self.keys = keys
+        self.verifiers = {key.kid: key.make_backend() for key in keys[1:]}
+
+    def encode(self, payload):
+        jwt_payload = payload.copy()
+        if self.audience is not None:
+            jwt_payload["aud"] = self.audience
+        if self.issuer is not None:
+            jwt_payload["iss"] = self.issuer
+        return jwt.encode(jwt_payload,
+                          self.prepared_signing_key,
+                          algorithm=self.algorithm,
+                          headers={"kid": self.kid},
+                          json_encoder=self.json_encoder)
+
+    def decode(self, token, verify=True):
+        try:
+            kid = jwt.get_unverified_header(token).get("kid")
+        except jwt.InvalidTokenError as e:
+            raise TokenBackendError(_("Token is invalid")) from e
+        if kid == self.kid:
+            return super().decode(token, verify)
+        if kid is None and logins_settings.SIGNING_ACCEPT_LEGACY:
+            return state.token_backend.decode(token, verify)
+        backend = self.verifiers.get(kid)
+        if backend is None:
+            raise TokenBackendError(_("Token is invalid"))
+        return backend.decode(token, verify)
+
+    @cached_property
+    def jwks(self):
+        """
+        JWKSの本文とETag
+        """
+        keys = [jwk for jwk in (key.to_jwk() for key in self.keys) if jwk is not None]
+        body = json.dumps({"keys": keys}, separators=(",", ":"), sort_keys=True).encode()
+        return body, '"%s"' % hashlib.sha1(body).hexdigest()
+
+
+def get_keyring():
+    """
+    設定からキーリングを作る。SIGNING_KEYS が空ならNoneを返す
+    """
+    global _keyring
+    keyring = _keyring
+    if keyring is None:
+        with _lock:
+            if _keyring is None:
+                keys = [SigningKey(**key) for key in logins_settings.SIGNING_KEYS]
+                _keyring = KeyringTokenBackend(keys) if keys else False
+            keyring = _keyring
+    return keyring or None
+
+
+def get_token_backend():
+    """
+    トークンの署名と検証に使うTokenBackend
+    """
+    return get_keyring() or state.token_backend
+
+
+def get_jwks():
+    """
+    JWKSの本文とETagを返す
+    """
+    keyring = get_keyring()
+    if keyring is None:
+        body = b'{"keys":[]}'
+        return body, '"%s"' % hashlib.sha1(body).hexdigest()
+    return keyring.jwks
+
+
+@receiver(setting_changed)
+def reset_keyring(setting, **kwargs):
+    global _keyring
+    if setting in ("LOGINS", "SIMPLE_JWT"):
+        _keyring = None
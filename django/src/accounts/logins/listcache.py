@@ -0,0 +1,122 @@
+"""
+ユーザー一覧のキャッシュ
+Djangoのキャッシュフレームワークにシリアライズ済みのページを保存し、
+ユーザーが作成・更新される度にバージョンを上げて古いページを無効化する
+"""
+import hashlib
+import threading
+import time
+from asgiref.sync import sync_to_async
+from django.core.cache import caches
+from django.db import transaction
+from django.utils.http import parse_etags
+from .conf import logins_settings
+
+VERSION_KEY = "logins:user_list:version"
+PAGE_KEY = "logins:user_list:%s:%s"
+
+
+class ListCacheStats:
+    """
+    プロセス内のヒット・ミスの回数
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def incr(self, name):
+        with self._lock:
+            self._counts[name] += 1
+
+    def reset(self):
+        with self._lock:
+            self._counts = {"hits": 0, "misses": 0, "not_modified": 0}
+
+    def as_dict(self):
+        with self._lock:
+            counts = dict(self._counts)
+        lookups = counts["hits"] + counts["misses"]
+        counts["hit_ratio"] = counts["hits"] / lookups if lookups else 0.0
+        return counts
+
+
+stats = ListCacheStats()
+
+
+def get_cache():
+    return caches[logins_settings.USER_LIST_CACHE]
+
+
+def get_version():
+    """
+    現在のバージョンを返す
+    キャッシュから消えていた場合は、古いページと衝突しないように現在時刻から作り直す
+    """
+    cache = get_cache()
+    version = cache.get(VERSION_KEY)
+    if version is None:
+        cache.add(VERSION_KEY, time.time_ns(), timeout=None)
+        version = cache.get(VERSION_KEY)
+    return version
+
+
+def invalidate():
+    """
+    バージョンを上げて、全てのページを無効化する
+    """
+    cache = get_cache()
+    try:
+        cache.incr(VERSION_KEY)
+    except ValueError:
+        cache.add(VERSION_KEY, time.time_ns(), timeout=None)
+
+
+def invalidate_on_commit(using=None):
+    """
+    トランザクションがコミットされた時にinvalidateする (トランザクションの外ならすぐに行う)
+    コミットの前にバージョンを上げると、その間に他のリクエストがコミット前のページを
+    新しいバージョンでキャッシュし、TTLの間返し続けてしまうため
+    """
+    transaction.on_commit(invalidate, using=using)
+
+
+async def ainvalidate_on_commit(using=None):
+    """
+    invalidate_on_commitの非同期版
+    トランザクションは同期のORMのスレッドの接続にあるので、同じスレッドで登録する
+    """
+    await sync_to_async(invalidate_on_commit)(using)
+
+
+def page_key(request):
+    """
+    ホストとクエリパラメータからページを識別する文字列を作る
+    (ページ内の next/previous のリンクはホストを含むため)
+    """
+    params = "&".join("%s=%s" % (key, value)
+                      for key, value in sorted(request.query_params.items()))
+    raw = "%s?%s" % (request.get_host(), params)
+    return hashlib.sha1(raw.encode()).hexdigest()
+
+
+def make_etag(version, key):
+    return 'W/"%s-%s"' % (version, key[:16])
+
+
+def etag_matches(etag, if_none_match):
+    """
+    If-None-Match ヘッダーにetagが含まれるか (弱い比較)
+    """
+    etags = parse_etags(if_none_match)
+    return "*" in etags or etag.removeprefix("W/") in [tag.removeprefix("W/") for tag in etags]
+
+
+def get_page(version, key):
+    data = get_cache().get(PAGE_KEY % (version, key))
+    stats.incr("misses" if data is None else "hits")
+    return data
+
+
+def set_page(version, key, data):
+    get_cache().set(PAGE_KEY % (version, key), data, timeout=logins_settings.USER_LIST_CACHE_TTL)
@@ -0,0 +1,84 @@
+import os
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+from django.test.utils import override_settings, setup_databases, teardown_databases
+from ...benchmarks import BENCHMARKS, unthrottled
+from ...benchmarks.baseline import compare, load_baseline, write_baseline
+from ...throttling import buckets
+
+
+class Command(BaseCommand):
+    help = "logins アプリのベンチマークを実行する"
+
+    def add_arguments(self, parser):
+        parser.add_argument("names", nargs="*",
+                            help="実行するベンチマーク名 (省略時は全て): %s" % ", ".join(sorted(BENCHMARKS)))
+        parser.add_argument("--iterations", type=int, default=200,
+                            help="1ケースあたりの試行回数")
+        parser.add_argument("--processes", type=int, default=os.cpu_count(),
+                            help="並列に実行するプロセス数 (password_hashers)")
+        parser.add_argument("--duration", type=float, default=2.0,
+                            help="1ケースあたりの実行秒数 (password_hashers)")
+        parser.add_argument("--users", type=int, default=10000,
+                            help="事前に作るユーザーの数 (endpoints, renderers)")
+        parser.add_argument("--url", dest="urls", action="append",
+                            help="測るURL名。複数指定できる (endpoints、省略時は全て)")
+        parser.add_argument("--output",
+                            help="結果をベースラインとしてJSONで書き出すファイル")
+        parser.add_argument("--compare",
+                            help="比較するベースラインのファイル。悪化していたら失敗する")
+        parser.add_argument("--tolerance", type=float, default=0.2,
+                            help="時間とスループットの悪化を許す割合 (--compare)")
+        parser.add_argument("--test-database", action="store_true",
+                            help="開発用のデータベースではなく、テスト用のデータベースを作って実行する")
+
+    def handle(self, *args, **options):
+        names = options["names"] or sorted(BENCHMARKS)
+        unknown = [name for name in names if name not in BENCHMARKS]
+        if unknown:
+            raise CommandError("未知のベンチマーク: %s" % ", ".join(unknown))
+
+        old_config = None
+        if options["test_database"]:
+            old_config = setup_databases(verbosity=0, interactive=False, aliases=set(connections))
+        try:
+            results = self.run_benchmarks(names, options)
+        finally:
+            if old_config is not None:
+                teardown_databases(old_config, verbosity=0)
+
+        failed = ["%s/%s" % (name, row.get("case")) for name, rows in results.items()
+                  for row in rows if row.get("errors")]
+        if failed:
+            raise CommandError("エラーの応答を返したケースがある (ベースラインにしない):\n  " + "\n  ".join(failed))
+
+        if options["output"]:
+            write_baseline(options["output"], results, iterations=options["iterations"], users=options["users"])
+            self.stdout.write(self.style.SUCCESS("wrote baseline to %s" % options["output"]))
+        if options["compare"]:
+            regressions = compare(load_baseline(options["compare"]), results, options["tolerance"])
+            if regressions:
+                raise CommandError("ベースラインより悪化した:\n  " + "\n  ".join(regressions))
+            self.stdout.write(self.style.SUCCESS("no regressions against %s" % options["compare"]))
+
+    def run_benchmarks(self, names, options):
+        results = {}
+        # ビューのベンチマークはテストクライアントから呼び出す
+        # 同じクライアントから続けて送るので、スロットルと負荷制限は止める
+        with override_settings(ALLOWED_HOSTS=[*settings.ALLOWED_HOSTS, "testserver"]), unthrottled():
+            for name in names:
+                buckets.reset()
+                self.stdout.write(self.style.MIGRATE_HEADING(name))
+                results[name] = BENCHMARKS[name](**options)
+                for row in results[name]:
+                    self.stdout.write(self.format_row(row))
+        return results
+
+    def format_row(self, row):
+        values = []
+        for key, value in row.items():
+            if isinstance(value, float):
+                value = "%.2f" % value
+            values.append("%s=%s" % (key, value))
+        return "  " + "  ".join(values)
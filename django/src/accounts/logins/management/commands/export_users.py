@@ -0,0 +1,24 @@
+from django.core.management.base import BaseCommand
+from ...bulk import detect_format, write_users
+
+
+class Command(BaseCommand):
+    help = "全ユーザーをCSVかJSON Linesで書き出す (import_users で読み込める形式)"
+
+    def add_arguments(self, parser):
+        parser.add_argument("path", nargs="?", default="-",
+                            help="書き出すファイル (- は標準出力)")
+        parser.add_argument("--format", choices=("csv", "jsonl"),
+                            help="ファイルの形式 (省略時は拡張子で判定)")
+        parser.add_argument("--chunk-size", type=int, default=2000,
+                            help="1回のクエリで読み込む件数")
+
+    def handle(self, *args, **options):
+        path = options["path"]
+        format = detect_format(path, options["format"])
+        if path == "-":
+            count = write_users(self.stdout, format, options["chunk_size"])
+        else:
+            with open(path, "w", newline="", encoding="utf-8") as stream:
+                count = write_users(stream, format, options["chunk_size"])
+            self.stdout.write(self.style.SUCCESS("exported %d users" % count))
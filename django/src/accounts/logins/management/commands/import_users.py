@@ -0,0 +1,34 @@
+import os
+import sys
+from django.core.management.base import BaseCommand
+from ...bulk import UserImporter, detect_format, read_users
+
+
+class Command(BaseCommand):
+    help = "CSVかJSON Linesのファイルからユーザーを一括で登録する"
+
+    def add_arguments(self, parser):
+        parser.add_argument("path", help="読み込むファイル (- は標準入力)")
+        parser.add_argument("--format", choices=("csv", "jsonl"),
+                            help="ファイルの形式 (省略時は拡張子で判定)")
+        parser.add_argument("--batch-size", type=int, default=1000,
+                            help="1トランザクションで登録する件数")
+        parser.add_argument("--processes", type=int, default=os.cpu_count(),
+                            help="平文のパスワードをハッシュするプロセス数")
+
+    def handle(self, *args, **options):
+        path = options["path"]
+        format = detect_format(path, options["format"])
+        stream = sys.stdin if path == "-" else open(path, newline="", encoding="utf-8")
+        try:
+            with UserImporter(batch_size=options["batch_size"],
+                              processes=options["processes"]) as importer:
+                created = importer.run(read_users(stream, format))
+        finally:
+            if stream is not sys.stdin:
+                stream.close()
+
+        for line, reason in importer.skipped:
+            self.stderr.write("line %d: %s" % (line, reason))
+        self.stdout.write(self.style.SUCCESS(
+            "created %d users, skipped %d" % (created, len(importer.skipped))))
@@ -0,0 +1,13 @@
+from django.core.management.base import BaseCommand, CommandError
+from ...audit import audit_log
+from ...conf import logins_settings
+
+
+class Command(BaseCommand):
+    help = "バッファが溢れてLOGINS['AUDIT_SPILL_DIR']に書き出された監査ログのイベントをDBに読み込む"
+
+    def handle(self, *args, **options):
+        if not logins_settings.AUDIT_SPILL_DIR:
+            raise CommandError("LOGINS['AUDIT_SPILL_DIR'] が設定されていない")
+        count = audit_log.load_spilled()
+        self.stdout.write(self.style.SUCCESS("loaded %d events" % count))
@@ -0,0 +1,25 @@
+import datetime
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+from ...audit import prune
+from ...conf import logins_settings
+
+
+class Command(BaseCommand):
+    help = "保持期間を過ぎた監査ログのイベントを少しずつ消す (cronで定期的に実行する)"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--days", type=int,
+                            help="残す日数 (省略時は LOGINS['AUDIT_RETENTION_DAYS'])")
+        parser.add_argument("--chunk-size", type=int, default=1000,
+                            help="1回のDELETEで消す件数")
+        parser.add_argument("--pause", type=float, default=0.0,
+                            help="DELETEの間に待つ秒数 (レプリケーションの遅れを抑える)")
+
+    def handle(self, *args, **options):
+        days = options["days"]
+        if days is None:
+            days = logins_settings.AUDIT_RETENTION_DAYS
+        before = timezone.now() - datetime.timedelta(days=days)
+        count = prune(before, options["chunk_size"], options["pause"])
+        self.stdout.write(self.style.SUCCESS("deleted %d events" % count))
@@ -0,0 +1,221 @@
+"""
+Prometheusのテキスト形式で公開するメトリクス
+ヒストグラムはプロセス内でロックを取って集計し、LOGINS["METRICS_DIR"] があれば
+各プロセスが METRICS_FLUSH_INTERVAL 秒毎に <pid>.json へスナップショットを書き出す
+メトリクスのエンドポイントは全プロセスのスナップショットを足し合わせて返すので、
+gunicornのどのワーカーが受けても全体の値になる
+"""
+import atexit
+import bisect
+import glob
+import json
+import os
+import threading
+import time
+from contextvars import ContextVar
+from .conf import logins_settings
+
+# 秒のヒストグラムの境界
+TIME_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+# 1リクエストあたりのクエリ数の境界
+COUNT_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100)
+
+# リクエスト中のクエリの [回数, 秒]
+request_queries = ContextVar("logins_request_queries", default=None)
+
+
+class Histogram:
+
+    def __init__(self, name, help, labels=(), buckets=TIME_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self.buckets = tuple(buckets)
+        # ラベルの値のタプル -> [境界毎の回数(累積しない)..., +Infの回数, 合計, 回数]
+        self.series = {}
+
+    def observe(self, value, *label_values):
+        index = bisect.bisect_left(self.buckets, value)
+        with registry.lock:
+            series = self.series.get(label_values)
+            if series is None:
+                series = self.series[label_values] = [0] * (len(self.buckets) + 1) + [0.0, 0]
+            series[index] += 1
+            series[-2] += value
+            series[-1] += 1
+
+    def snapshot(self):
+        return {"help": self.help, "labels": self.labels, "buckets": self.buckets,
+                "series": [[list(key), list(values)] for key, values in self.series.items()]}
+
+
+class Registry:
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.metrics = {}
+        self._flushed_at = time.monotonic()
+
+    def histogram(self, name, help, labels=(), buckets=TIME_BUCKETS):
+        metric = self.metrics[name] = Histogram(name, help, labels, buckets)
+        return metric
+
+    def snapshot(self):
+        with self.lock:
+            return {name: metric.snapshot() for name, metric in self.metrics.items()}
+
+    def reset(self):
+        with self.lock:
+            for metric in self.metrics.values():
+                metric.series = {}
+
+    def path(self):
+        return os.path.join(logins_settings.METRICS_DIR, "%d.json" % os.getpid())
+
+    def maybe_flush(self):
+        """
+        前回から METRICS_FLUSH_INTERVAL 秒経っていればスナップショットを書き出す
+        """
+        if not logins_settings.METRICS_DIR:
+            return
+        now = time.monotonic()
+        if now - self._flushed_at < logins_settings.METRICS_FLUSH_INTERVAL:
+            return
+        self._flushed_at = now
+        self.flush()
+
+    def flush(self):
+        directory = logins_settings.METRICS_DIR
+        if not directory:
+            return
+        os.makedirs(directory, exist_ok=True)
+        path = self.path()
+        # 読み込み中のプロセスが書きかけのファイルを読まないように、書いてから置き換える
+        tmp = "%s.tmp" % path
+        with open(tmp, "w") as f:
+            json.dump(self.snapshot(), f)
+        os.replace(tmp, path)
+
+    def collect(self):
+        """
+        このプロセスの現在の値と、他のプロセスのスナップショットを足し合わせる
+        終了したプロセスのファイルも残して足し合わせるので、ワーカーが入れ替わってもカウンターは減らない
+        """
+        snapshots = [self.snapshot()]
+        directory = logins_settings.METRICS_DIR
+        if directory:
+            own = self.path()
+            for path in glob.glob(os.path.join(directory, "*.json")):
+                if path == own:
+                    continue
+                try:
+                    with open(path) as f:
+                        snapshots.append(json.load(f))
+                except (OSError, ValueError):
+                    continue
+        return merge(snapshots)
+
+
+def merge(snapshots):
+    merged = {}
+    for snapshot in snapshots:
+        for name, metric in snapshot.items():
+            target = merged.setdefault(name, {**metric, "series": {}})
+            for key, values in metric["series"]:
+                key = tuple(key)
+                current = target["series"].get(key)
+                target["series"][key] = values if current is None else [a + b for a, b in zip(current, values)]
+    return merged
+
+
+def escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def render(merged):
+    """
+    Prometheusのテキスト形式にする
+    """
+    lines = []
+    for name in sorted(merged):
+        metric = merged[name]
+        lines.append("# HELP %s %s" % (name, metric["help"]))
+        lines.append("# TYPE %s histogram" % name)
+        for key in sorted(metric["series"]):
+            values = metric["series"][key]
+            labels = ['%s="%s"' % (label, escape(value)) for label, value in zip(metric["labels"], key)]
+            cumulative = 0
+            for bound, count in zip([*metric["buckets"], "+Inf"], values):
+                cumulative += count
+                le = "+Inf" if bound == "+Inf" else repr(float(bound))
+                lines.append("%s_bucket{%s} %d" % (name, ",".join([*labels, 'le="%s"' % le]), cumulative))
+            suffix = "{%s}" % ",".join(labels) if labels else ""
+            lines.append("%s_sum%s %r" % (name, suffix, float(values[-2])))
+            lines.append("%s_count%s %d" % (name, suffix, values[-1]))
+    return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+request_duration = registry.histogram(
+    "logins_http_request_duration_seconds", "Request latency by URL name.", ("view", "method", "status"))
+request_queries_count = registry.histogram(
+    "logins_http_request_queries", "Database queries per request by URL name.", ("view",), COUNT_BUCKETS)
+request_db_duration = registry.histogram(
+    "logins_http_request_db_seconds", "Time spent in database queries per request by URL name.", ("view",))
+hash_duration = registry.histogram(
+    "logins_password_hash_seconds", "Time spent hashing or verifying a password.")
+hash_queue_duration = registry.histogram(
+    "logins_password_hash_queue_seconds", "Time a password operation waited for the hash pool.")
+token_sign_duration = registry.histogram(
+    "logins_token_sign_seconds", "Time to issue and sign a token pair.")
+token_verify_duration = registry.histogram(
+    "logins_token_verify_seconds", "Time to decode and verify a token.")
+
+
+def enabled():
+    return logins_settings.METRICS
+
+
+class timer:
+    """
+    with timer(histogram): の中の時間を記録する
+    """
+
+    def __init__(self, histogram, *label_values):
+        self.histogram = histogram
+        self.label_values = label_values
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        if enabled():
+            self.histogram.observe(time.perf_counter() - self.started, *self.label_values)
+
+
+def query_wrapper(execute, sql, params, many, context):
+    """
+    すべてのデータベース接続に入れる execute_wrapper
+    リクエストの中ならクエリの回数と時間を足す
+    """
+    stats = request_queries.get()
+    if stats is None:
+        return execute(sql, params, many, context)
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        stats[0] += 1
+        stats[1] += time.perf_counter() - started
+
+
+def install_query_wrapper(sender, connection, **kwargs):
+    """
+    connection_created のレシーバー。スレッド毎の接続すべてにquery_wrapperを入れる
+    """
+    if query_wrapper not in connection.execute_wrappers:
+        connection.execute_wrappers.append(query_wrapper)
+
+
+atexit.register(registry.flush)
@@ -0,0 +1,195 @@
+"""
+このアプリで使うミドルウェア
+"""
+import time
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from . import metrics, refresh
+from .authentication import ACCESS_COOKIE, REFRESH_COOKIE
+from .conf import logins_settings
+from .hashpool import request_timings
+from .routers import RoutingState, routing_state
+from .utils import set_jwt_cookie
+
+# プライマリから読み込む期限(UNIX時間)を入れるクッキー
+STICKY_COOKIE = "logins_primary"
+UNSAFE_METHODS = ("POST", "PUT", "PATCH", "DELETE")
+
+
+class HashTimingMiddleware:
+    """
+    リクエスト中のパスワードハッシュのキュー待ち時間とハッシュ時間を
+    Server-Timing ヘッダーで返す
+    ASGIで非同期ビューをスレッドに逃がさないように、同期・非同期の両方に対応する
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        token = request_timings.set([])
+        try:
+            response = self.get_response(request)
+            return self.add_header(response, request_timings.get())
+        finally:
+            request_timings.reset(token)
+
+    async def __acall__(self, request):
+        token = request_timings.set([])
+        try:
+            response = await self.get_response(request)
+            return self.add_header(response, request_timings.get())
+        finally:
+            request_timings.reset(token)
+
+    def add_header(self, response, timings):
+        if timings:
+            queue_wait = sum(wait for wait, _ in timings) * 1000
+            hash_time = sum(hashed for _, hashed in timings) * 1000
+            response["Server-Timing"] = "hash-queue;dur=%.1f, hash;dur=%.1f" % (queue_wait, hash_time)
+        return response
+
+
+class ReplicaStickinessMiddleware:
+    """
+    書き込みのリクエストと、書き込んでから REPLICA_STICKY_SECONDS 秒の間の
+    同じクライアントのリクエストの読み込みをプライマリに向ける
+    レプリカが設定されていなければ何もしない
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        if not logins_settings.READ_REPLICAS:
+            return self.get_response(request)
+        state = self.make_state(request)
+        token = routing_state.set(state)
+        try:
+            return self.set_cookie(self.get_response(request), state)
+        finally:
+            routing_state.reset(token)
+
+    async def __acall__(self, request):
+        if not logins_settings.READ_REPLICAS:
+            return await self.get_response(request)
+        state = self.make_state(request)
+        token = routing_state.set(state)
+        try:
+            return self.set_cookie(await self.get_response(request), state)
+        finally:
+            routing_state.reset(token)
+
+    def make_state(self, request):
+        try:
+            pinned_until = float(request.COOKIES.get(STICKY_COOKIE, 0))
+        except ValueError:
+            pinned_until = 0
+        return RoutingState(pinned=request.method in UNSAFE_METHODS or pinned_until > time.time())
+
+    def set_cookie(self, response, state):
+        if state.written:
+            seconds = logins_settings.REPLICA_STICKY_SECONDS
+            response.set_cookie(STICKY_COOKIE, "%.3f" % (time.time() + seconds),
+                                max_age=seconds, httponly=True, samesite="Lax")
+        return response
+
+
+class MetricsMiddleware:
+    """
+    URL名毎のレイテンシ、クエリの回数と時間を記録する (logins/metrics.py)
+    MIDDLEWARE の先頭に置いて、他のミドルウェアの時間も含める
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        if not metrics.enabled():
+            return self.get_response(request)
+        queries = [0, 0.0]
+        token = metrics.request_queries.set(queries)
+        started = time.perf_counter()
+        try:
+            response = self.get_response(request)
+        finally:
+            metrics.request_queries.reset(token)
+        self.record(request, response, time.perf_counter() - started, queries)
+        return response
+
+    async def __acall__(self, request):
+        if not metrics.enabled():
+            return await self.get_response(request)
+        queries = [0, 0.0]
+        token = metrics.request_queries.set(queries)
+        started = time.perf_counter()
+        try:
+            response = await self.get_response(request)
+        finally:
+            metrics.request_queries.reset(token)
+        self.record(request, response, time.perf_counter() - started, queries)
+        return response
+
+    def record(self, request, response, duration, queries):
+        # URLにマッチしないリクエストはまとめて、ラベルの種類を増やさない
+        match = getattr(request, "resolver_match", None)
+        view = match.view_name if match is not None else "unmatched"
+        metrics.request_duration.observe(duration, view, request.method, str(response.status_code))
+        metrics.request_queries_count.observe(queries[0], view)
+        metrics.request_db_duration.observe(queries[1], view)
+        metrics.registry.maybe_flush()
+
+
+class SilentRefreshMiddleware:
+    """
+    クッキーのアクセストークンが切れそうならリフレッシュトークンでローテーションして、
+    同じレスポンスで新しいクッキーを返す (logins/refresh.py)
+    ビューがクッキーをセット、削除した時(ログイン、ログアウト)はビューの方を優先する
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        if not refresh.should_refresh(request):
+            return self.get_response(request)
+        tokens = refresh.apply(request, refresh.rotate(request.COOKIES[REFRESH_COOKIE]))
+        return self.set_cookie(self.get_response(request), tokens)
+
+    async def __acall__(self, request):
+        if not refresh.should_refresh(request):
+            return await self.get_response(request)
+        tokens = refresh.apply(request, await refresh.arotate(request.COOKIES[REFRESH_COOKIE]))
+        return self.set_cookie(await self.get_response(request), tokens)
+
+    def set_cookie(self, response, tokens):
+        if tokens is None or ACCESS_COOKIE in response.cookies or REFRESH_COOKIE in response.cookies:
+            return response
+        if tokens:
+            return set_jwt_cookie(tokens, response)
+        # 使えないリフレッシュトークンは削除して、次のリクエストで再びローテーションしない
+        response.delete_cookie(REFRESH_COOKIE)
+        return response
@@ -0,0 +1,27 @@
+# Generated by Django 4.2 on 2026-10-18 13:08
+
+from django.db import migrations, models
+import django.db.models.functions.text
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('logins', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='user',
+            name='user_name',
+            field=models.CharField(max_length=15, verbose_name='user_name'),
+        ),
+        migrations.AddConstraint(
+            model_name='user',
+            constraint=models.UniqueConstraint(django.db.models.functions.text.Lower('user_name'), name='logins_user_user_name_ci_unique'),
+        ),
+        migrations.AddConstraint(
+            model_name='user',
+            constraint=models.UniqueConstraint(django.db.models.functions.text.Lower('email'), name='logins_user_email_ci_unique'),
+        ),
+    ]
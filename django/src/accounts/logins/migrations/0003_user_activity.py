@@ -0,0 +1,23 @@
+# Generated by Django 4.2 on 2026-10-18 13:16
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('logins', '0002_case_insensitive_unique'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='user',
+            name='last_seen',
+            field=models.DateTimeField(blank=True, null=True, verbose_name='last_seen'),
+        ),
+        migrations.AddField(
+            model_name='user',
+            name='login_count',
+            field=models.PositiveIntegerField(default=0, verbose_name='login_count'),
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 4.2 on 2026-10-18 13:19
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('logins', '0003_user_activity'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AuthEvent',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created_at', models.DateTimeField(db_index=True, verbose_name='created_at')),
+                ('kind', models.PositiveSmallIntegerField(choices=[(1, 'login'), (2, 'login_failed'), (3, 'signup'), (4, 'password_change'), (5, 'logout')], verbose_name='kind')),
+                ('user_id', models.BigIntegerField(blank=True, db_index=True, null=True, verbose_name='user_id')),
+                ('ip', models.CharField(blank=True, max_length=45, verbose_name='ip')),
+            ],
+        ),
+    ]
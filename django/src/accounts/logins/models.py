@@ -1,19 +1,129 @@
-from django.db import models
+import contextlib
+import datetime
+from asgiref.sync import sync_to_async
+from django.contrib.auth import password_validation
+from django.core.exceptions import ValidationError
+from django.db import IntegrityError, models, router, transaction
+from django.db.models.functions import Lower
+from django.utils import timezone
+from django.utils.http import parse_etags
 from django.contrib.auth.models import (BaseUserManager,
                                         AbstractBaseUser,
                                         PermissionsMixin)
 from django.utils.translation import gettext_lazy as _
+from . import listcache
+from .activity import activity_buffer
+from .hashpool import hash_pool
+from .usercache import user_cache
+
+# 大文字小文字を区別しない一意制約の名前 (migrations/0002)
+UNIQUE_CONSTRAINTS = {
+    "user_name": "logins_user_user_name_ci_unique",
+    "email": "logins_user_email_ci_unique",
+}
+UNIQUE_MESSAGE = "user with this %s already exists."
+
+
+def unique_violations(error):
+    """
+    IntegrityErrorのメッセージから、一意制約に違反したフィールドのリストを返す
+    制約名(PostgreSQL、SQLite、MySQLの関数インデックス)で探し、無ければカラム名で探す
+    """
+    message = str(error)
+    fields = [field for field, name in UNIQUE_CONSTRAINTS.items() if name in message]
+    if not fields and ("unique" in message.lower() or "duplicate" in message.lower()):
+        fields = [field for field in UNIQUE_CONSTRAINTS if field in message]
+    return fields
+
+
+class BulkUniqueError(Exception):
+    """
+    bulk_create_users、bulk_update_usersで一意制約に違反したユーザーがあった
+    errorsはusersの添字から {フィールド: [メッセージ]} への辞書。それ以外のユーザーは保存済み
+    """
+
+    def __init__(self, errors):
+        super().__init__(errors)
+        self.errors = errors
+
+
+class StaleUpdate(Exception):
+    """
+    If-Matchで指定されたupdated_atがDBの値と違うため更新しなかった
+    """
+
+
+EPOCH = datetime.datetime(1970, 1, 1, tzinfo=datetime.timezone.utc)
+
+
+def make_etag(updated_at):
+    """
+    updated_atから強いETagを作る (UNIX時間のマイクロ秒)
+    """
+    return '"%d"' % ((updated_at - EPOCH) // datetime.timedelta(microseconds=1))
+
+
+def parse_if_match(if_match):
+    """
+    If-Matchヘッダーを更新を許すupdated_atのリストにする
+    ヘッダーが無いか"*"ならNone(条件なし)。弱いETagと読めないETagは一致しないものとして捨てる
+    """
+    if not if_match:
+        return None
+    etags = parse_etags(if_match)
+    if "*" in etags:
+        return None
+    values = []
+    for etag in etags:
+        if etag.startswith("W/"):
+            continue
+        try:
+            values.append(EPOCH + datetime.timedelta(microseconds=int(etag.strip('"'))))
+        except (ValueError, OverflowError):
+            continue
+    return values
 
 
 class UserManager(BaseUserManager):
+    # ログインとjwtの発行に必要なカラム (logins/tokens.py のクレームを含む)
+    login_fields = ("id", "password", "user_name", "is_active", "is_staff")
+
     def _create_user(self, user_name, email, password, **extra_fields):
         email = self.normalize_email(email)
         user = self.model(user_name=user_name, email=email, **extra_fields)
         user.set_password(password)
-        user.save(using=self._db)
+        self.save_unique(user)
+        listcache.invalidate_on_commit(user._state.db)
 
         return user
 
+    @contextlib.contextmanager
+    def unique_errors(self, using):
+        """
+        ブロックの中の書き込みで起きたuser_nameとemailの一意制約の違反を、フィールド毎のValidationErrorにする
+        トランザクションの中ではエラーの後もトランザクションを使えるように、その時だけセーブポイントを作る
+        """
+        try:
+            if transaction.get_connection(using).in_atomic_block:
+                with transaction.atomic(using=using):
+                    yield
+            else:
+                yield
+        except IntegrityError as e:
+            fields = unique_violations(e)
+            if not fields:
+                raise
+            raise ValidationError({field: [UNIQUE_MESSAGE % field] for field in fields}) from e
+
+    def save_unique(self, user, **kwargs):
+        """
+        事前のSELECTをせずに1回のINSERT/UPDATEで保存する。一意制約の違反はValidationErrorになる
+        """
+        using = self._db or router.db_for_write(self.model, instance=user)
+        with self.unique_errors(using):
+            user.save(using=using, **kwargs)
+        return user
+
     def create_user(self, user_name, email, password=None, **extra_fields):
         extra_fields.setdefault('is_active', True)
         extra_fields.setdefault('is_staff', False)
@@ -25,6 +135,21 @@ class UserManager(BaseUserManager):
             **extra_fields,
         )
 
+    async def acreate_user(self, user_name, email, password=None, **extra_fields):
+        """
+        create_userの非同期版。パスワードのハッシュはイベントループの外で行う
+        """
+        extra_fields.setdefault('is_active', True)
+        extra_fields.setdefault('is_staff', False)
+        extra_fields.setdefault('is_superuser', False)
+        email = self.normalize_email(email)
+        user = self.model(user_name=user_name, email=email, **extra_fields)
+        await user.aset_password(password)
+        await sync_to_async(self.save_unique)(user)
+        await listcache.ainvalidate_on_commit(user._state.db)
+
+        return user
+
     def create_superuser(self, user_name, email, password, **extra_fields):
         extra_fields['is_active'] = True
         extra_fields['is_staff'] = True
@@ -36,25 +161,191 @@ class UserManager(BaseUserManager):
             **extra_fields,
         )
     
-    def update_user(self, user, fields):
+    def get_for_login(self, email):
+        """
+        正規化したemailで、ログインに必要なカラムだけを1回のクエリで取得する
+        ユーザーがいなければNone
+        """
+        try:
+            return self.login_queryset(email).get()
+        except self.model.DoesNotExist:
+            return None
+
+    def login_queryset(self, email):
+        """
+        emailは大文字小文字を区別せずに一意なので、一意インデックスと同じ LOWER(email) で探す
+        """
+        return (self.only(*self.login_fields)
+                .alias(email_lower=Lower("email"))
+                .filter(email_lower=self.normalize_email(email).lower()))
+
+    def check_login(self, email, password):
+        """
+        emailとパスワードが正しければユーザーを、正しくなければNoneを返す
+        ユーザーがいない時もダミーのハッシュを計算して、応答時間からユーザーの有無を分からなくする
+        """
+        user = self.get_for_login(email)
+        if user is None:
+            self.model().set_password(password)
+            return None
+        if not user.check_password(password):
+            return None
+        activity_buffer.touch(user.pk, login=True)
+        return user
+
+    async def acheck_login(self, email, password):
+        """
+        check_loginの非同期版
+        """
+        try:
+            user = await self.login_queryset(email).aget()
+        except self.model.DoesNotExist:
+            await self.model().aset_password(password)
+            return None
+        if not await user.acheck_password(password):
+            return None
+        await activity_buffer.atouch(user.pk, login=True)
+        return user
+
+    def find_conflicts(self, user_names, emails):
+        """
+        既に使われているuser_nameとemailを、それぞれ1回のIN句のクエリで調べて
+        小文字にした値から使っているユーザーのidへの (user_nameの辞書, emailの辞書) を返す
+        (一意制約は大文字小文字を区別しない)
+        """
+        user_names = {user_name.lower() for user_name in user_names}
+        emails = {email.lower() for email in emails}
+        taken_user_names = {user_name.lower(): pk for pk, user_name in self.alias(key=Lower("user_name"))
+                            .filter(key__in=user_names).values_list("id", "user_name")} if user_names else {}
+        taken_emails = {email.lower(): pk for pk, email in self.alias(key=Lower("email"))
+                        .filter(key__in=emails).values_list("id", "email")} if emails else {}
+        return taken_user_names, taken_emails
+
+    def bulk_create_users(self, users, batch_size=None):
+        """
+        パスワードをハッシュ済みのユーザーを1つのトランザクションでbulk_createする
+        主キーが返らないDB(MySQL)では、emailから1回のクエリで主キーを埋める
+        事前の重複検査の後に他のリクエストが同じ値で登録していたら、1件ずつ保存し直して
+        違反しなかったユーザーは登録し、BulkUniqueError を送出する
+        """
+        using = self._db or router.db_for_write(self.model)
+        errors = {}
+        try:
+            with transaction.atomic(using=using):
+                users = self.bulk_create(users, batch_size=batch_size)
+        except IntegrityError as e:
+            if not unique_violations(e):
+                raise
+            for user in users:
+                user.pk = None
+                user._state.adding = True
+            errors = self._save_each(users, using)
+        saved = [user for index, user in enumerate(users) if index not in errors]
+        if any(user.pk is None for user in saved):
+            # 書き込んだDBから読む (ルーターに任せるとリクエストの外ではレプリカになり、まだ無いことがある)
+            ids = dict(self.db_manager(using).filter(email__in=[user.email for user in saved])
+                       .values_list("email", "id"))
+            for user in saved:
+                user.pk = ids[user.email]
+        listcache.invalidate_on_commit(using)
+        if errors:
+            raise BulkUniqueError(errors)
+        return users
+
+    def bulk_update_users(self, users, fields, batch_size=None):
+        """
+        ユーザーのfieldsとupdated_atを1つのトランザクションでbulk_updateする
+        bulk_updateはシグナルを送らないので、キャッシュはここで無効化する
+        一意制約に違反したら bulk_create_users と同じく1件ずつ保存し直す
+        """
+        using = self._db or router.db_for_write(self.model)
+        now = timezone.now()
+        for user in users:
+            user.updated_at = now
+        errors = {}
+        try:
+            with transaction.atomic(using=using):
+                self.bulk_update(users, [*fields, "updated_at"], batch_size=batch_size)
+        except IntegrityError as e:
+            if not unique_violations(e):
+                raise
+            errors = self._save_each(users, using, update_fields=[*fields, "updated_at"])
+        for user in users:
+            user_cache.invalidate(user.pk)
+        listcache.invalidate_on_commit(using)
+        if errors:
+            raise BulkUniqueError(errors)
+        return users
+
+    def _save_each(self, users, using, **kwargs):
+        """
+        usersを1つのトランザクションで1件ずつ保存し、一意制約に違反したusersの添字からエラーへの辞書を返す
+        """
+        errors = {}
+        with transaction.atomic(using=using):
+            for index, user in enumerate(users):
+                try:
+                    with self.unique_errors(using):
+                        user.save(using=using, **kwargs)
+                except ValidationError as e:
+                    errors[index] = e.message_dict
+        return errors
+
+    def update_user(self, user, fields, if_match=None):
+        """
+        値が変わったカラムとupdated_atだけをUPDATEする。何も変わらなければ書き込まない
+        if_match(parse_if_matchの戻り値)を渡すと、DBのupdated_atがそのどれかの時だけ更新し、
+        違えば StaleUpdate を送出する (行ロックを使わない楽観的排他制御)
+        """
+        changed = []
         for key, value in fields.items():
             if(key=="password"):
                 user.set_password(value)
             else:
                 if(key=="email") : 
                     value = self.normalize_email(value)
+                if getattr(user, key) == value:
+                    continue
                 setattr(user, key, value)
-        user.save(using=self._db)
+            changed.append(key)
+        if not changed:
+            if if_match is not None and user.updated_at not in if_match:
+                raise StaleUpdate(user.pk)
+            return user
+        if if_match is None:
+            self.save_unique(user, update_fields=[*changed, "updated_at"])
+        else:
+            self._update_if_match(user, changed, if_match)
+        listcache.invalidate_on_commit(user._state.db)
         return user
 
+    def _update_if_match(self, user, fields, if_match):
+        """
+        updated_atが if_match のどれかの行だけを、1回の条件付きUPDATEで更新する
+        QuerySet.updateはsaveとシグナルを通らないので、パスワードの変更の通知とキャッシュの無効化はここで行う
+        """
+        using = self._db or router.db_for_write(self.model, instance=user)
+        updated_at = timezone.now()
+        values = {field: getattr(user, field) for field in fields}
+        with self.unique_errors(using):
+            count = self.using(using).filter(pk=user.pk, updated_at__in=if_match).update(updated_at=updated_at, **values)
+        if not count:
+            raise StaleUpdate(user.pk)
+        user.updated_at = updated_at
+        if user._password is not None:
+            password_validation.password_changed(user._password, user)
+            user._password = None
+        user_cache.invalidate(user.pk)
+
 class User(AbstractBaseUser, PermissionsMixin):
 
+    # 一意性は Meta.constraints の大文字小文字を区別しない制約で保証する
     user_name = models.CharField(
         verbose_name=_("user_name"),
         max_length=15,
         blank=False,
-        unique=True
     )
+    # USERNAME_FIELD はDjangoの認証のチェックのために unique=True も残す
     email = models.EmailField(
         verbose_name=_("email"),
         blank=False,
@@ -80,11 +371,98 @@ class User(AbstractBaseUser, PermissionsMixin):
         verbose_name=_("updateded_at"),
         auto_now=True
     )
+    # last_login と同じく logins/activity.py がワーカー毎にまとめて書き込む
+    last_seen = models.DateTimeField(
+        verbose_name=_("last_seen"),
+        blank=True,
+        null=True
+    )
+    login_count = models.PositiveIntegerField(
+        verbose_name=_("login_count"),
+        default=0
+    )
 
     objects = UserManager()
 
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(Lower("user_name"), name=UNIQUE_CONSTRAINTS["user_name"]),
+            models.UniqueConstraint(Lower("email"), name=UNIQUE_CONSTRAINTS["email"]),
+        ]
+
     USERNAME_FIELD = 'email' # ログイン時、ユーザー名の代わりにemailを使用
     REQUIRED_FIELDS = ['user_name']  # スーパーユーザー作成時にuser_nameも設定する
 
     def __str__(self):
         return self.user_name
+
+    def set_password(self, raw_password):
+        """
+        パスワードのハッシュはワーカープールで行う (LOGINS["HASH_POOL"]が無効ならその場で行う)
+        """
+        self.password = hash_pool.make_password(raw_password)
+        self._password = raw_password
+
+    def check_password(self, raw_password):
+        """
+        パスワードの検証はワーカープールで行い、ハッシュがポリシーと違えば再ハッシュして保存する
+        """
+        def setter(raw_password):
+            self.set_password(raw_password)
+            # パスワードの再ハッシュはパスワードの変更ではない
+            self._password = None
+            self.save(update_fields=["password"])
+
+        return hash_pool.check_password(raw_password, self.password, setter)
+
+    async def aset_password(self, raw_password):
+        """
+        set_passwordの非同期版
+        """
+        self.password = await hash_pool.amake_password(raw_password)
+        self._password = raw_password
+
+    async def acheck_password(self, raw_password):
+        """
+        check_passwordの非同期版
+        """
+        async def setter(raw_password):
+            await self.aset_password(raw_password)
+            self._password = None
+            await self.asave(update_fields=["password"])
+
+        return await hash_pool.acheck_password(raw_password, self.password, setter)
+
+
+class AuthEvent(models.Model):
+    """
+    認証の監査ログ。追記するだけで更新しない (logins/audit.py がまとめてINSERTする)
+    ユーザーを削除してもログを残し、書き込みで外部キーを検査しないように、ユーザーは主キーの値だけを持つ
+    """
+
+    class Kind(models.IntegerChoices):
+        LOGIN = 1, _("login")
+        LOGIN_FAILED = 2, _("login_failed")
+        SIGNUP = 3, _("signup")
+        PASSWORD_CHANGE = 4, _("password_change")
+        LOGOUT = 5, _("logout")
+
+    created_at = models.DateTimeField(
+        verbose_name=_("created_at"),
+        db_index=True
+    )
+    kind = models.PositiveSmallIntegerField(
+        verbose_name=_("kind"),
+        choices=Kind.choices
+    )
+    user_id = models.BigIntegerField(
+        verbose_name=_("user_id"),
+        blank=True,
+        null=True,
+        db_index=True
+    )
+    ip = models.CharField(
+        verbose_name=_("ip"),
+        max_length=45,
+        blank=True
+    )
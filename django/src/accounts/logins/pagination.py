@@ -0,0 +1,18 @@
+"""
+Viewで使うページネーション
+"""
+from rest_framework.pagination import CursorPagination
+from .conf import logins_settings
+
+
+class UserCursorPagination(CursorPagination):
+    """
+    idによるキーセットページネーション
+    カーソルは不透明な文字列で、何ページ目でもインデックスを使った1回のクエリで取得する
+    """
+    ordering = "id"
+    page_size_query_param = "page_size"
+
+    def __init__(self):
+        self.page_size = logins_settings.INDEX_PAGE_SIZE
+        self.max_page_size = logins_settings.INDEX_MAX_PAGE_SIZE
@@ -0,0 +1,43 @@
+"""
+DRFのパーサーの高速版 (logins/renderers.py と対になる)
+
+JSONParser は UTF-8 のリクエストを orjson でデコードする。それ以外の文字コードはDRFの実装に任せる
+MessagePackParser は Content-Type: application/msgpack のリクエストをデコードする
+"""
+import codecs
+from django.conf import settings
+from rest_framework import parsers
+from rest_framework.exceptions import ParseError
+from .renderers import JSONRenderer, MessagePackRenderer, msgpack, orjson
+
+
+class JSONParser(parsers.JSONParser):
+    """
+    orjsonでデコードするJSONParser
+    orjsonはNaNやInfinityを受け付けないので、DRFの STRICT_JSON が有効な時だけ使う
+    """
+    renderer_class = JSONRenderer
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        parser_context = parser_context or {}
+        encoding = parser_context.get("encoding", settings.DEFAULT_CHARSET)
+        if orjson is None or not self.strict or codecs.lookup(encoding).name != "utf-8":
+            return super().parse(stream, media_type, parser_context)
+        try:
+            return orjson.loads(stream.read())
+        except orjson.JSONDecodeError as exc:
+            raise ParseError("JSON parse error - %s" % str(exc))
+
+
+class MessagePackParser(parsers.BaseParser):
+    """
+    MessagePackのリクエストをデコードするパーサー
+    """
+    media_type = "application/msgpack"
+    renderer_class = MessagePackRenderer
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        try:
+            return msgpack.unpackb(stream.read(), raw=False)
+        except (ValueError, TypeError, msgpack.UnpackException) as exc:
+            raise ParseError("MessagePack parse error - %s" % str(exc))
@@ -1,7 +1,10 @@
 """
 Viewで使うカスタムパーミッションを定義するファイル
 """
+import hmac
+import ipaddress
 from rest_framework.permissions import BasePermission
+from .conf import logins_settings
 from .utils import verify_jwt
 
 class OnlyYouPerm(BasePermission):
@@ -22,4 +25,23 @@ class OnlyLogoutPerm(BasePermission):
     raise_exception = True
     def has_permission(self, request, view):
         objects = verify_jwt(request)
-        return not objects
\ No newline at end of file
+        return not objects
+
+class MetricsPerm(BasePermission):
+    """
+    メトリクスを LOGINS["METRICS_ALLOWED_IPS"] のアドレスと、
+    "Authorization: Bearer <LOGINS["METRICS_TOKEN"]>" を送ったクライアントにだけ返す
+    アドレスはクライアントが偽れない REMOTE_ADDR で判定する (X-Forwarded-For は見ない)
+    """
+    def has_permission(self, request, view):
+        token = logins_settings.METRICS_TOKEN
+        if token:
+            header = request.META.get("HTTP_AUTHORIZATION", "")
+            if hmac.compare_digest(header.encode(), ("Bearer " + token).encode()):
+                return True
+        try:
+            address = ipaddress.ip_address(request.META.get("REMOTE_ADDR", ""))
+        except ValueError:
+            return False
+        return any(address in ipaddress.ip_network(network, strict=False)
+                   for network in logins_settings.METRICS_ALLOWED_IPS)
\ No newline at end of file
@@ -0,0 +1,153 @@
+"""
+クッキーのアクセストークンのサイレントリフレッシュ
+
+アクセストークンのクッキーが無いか、有効期限まで SILENT_REFRESH_THRESHOLD 秒を切っていて、
+リフレッシュトークンのクッキーがあれば、リクエストを処理する前にトークンをローテーションして
+同じレスポンスで新しいクッキーを返す。クライアントは api/token/refresh/ を呼ばなくてよい
+
+ブラウザは同じクッキーで並列にリクエストを送るので、ローテーションはリフレッシュトークン(jti)毎に
+共有のキャッシュのロックを取った1リクエストだけが行い、結果を SILENT_REFRESH_GRACE 秒キャッシュに置く
+他のリクエストはその結果を待って同じトークンを使う (ローテーション前のトークンは失効するため)
+"""
+import asyncio
+import time
+import jwt
+from asgiref.sync import sync_to_async
+from django.core.cache import caches
+from django.core.exceptions import ObjectDoesNotExist
+from rest_framework.exceptions import APIException
+from rest_framework_simplejwt.exceptions import TokenError
+from rest_framework_simplejwt.settings import api_settings
+from .authentication import ACCESS_COOKIE, REFRESH_COOKIE
+from .conf import logins_settings
+from .serializer import TokenRefreshSerializer
+from .tokens import SignedToken
+
+LOCK_KEY = "logins:refresh:lock:%s"
+RESULT_KEY = "logins:refresh:result:%s"
+# 他のリクエストのローテーションを待つ時の間隔(秒)
+POLL_INTERVAL = 0.02
+# ローテーションに失敗したことを表すキャッシュの値
+FAILED = {}
+
+
+def get_cache():
+    return caches[logins_settings.SILENT_REFRESH_CACHE]
+
+
+def unverified_exp(cookie):
+    """
+    "JWT <token>" のクッキーの有効期限。署名は検証しない (認証クラスで検証する)
+    """
+    try:
+        raw_token = cookie.split()[-1]
+        return jwt.decode(raw_token, options={"verify_signature": False})["exp"]
+    except (IndexError, KeyError, jwt.PyJWTError):
+        return None
+
+
+def should_refresh(request):
+    """
+    リクエストのクッキーのアクセストークンをリフレッシュするべきか
+    Authorizationヘッダーで認証するクライアントはクッキーを使わないのでリフレッシュしない
+    """
+    threshold = logins_settings.SILENT_REFRESH_THRESHOLD
+    if threshold is None or not logins_settings.AUTH_COOKIE:
+        return False
+    if api_settings.AUTH_HEADER_NAME in request.META or not request.COOKIES.get(REFRESH_COOKIE):
+        return False
+    cookie = request.COOKIES.get(ACCESS_COOKIE)
+    if not cookie:
+        return True
+    exp = unverified_exp(cookie)
+    return exp is None or exp - time.time() < threshold
+
+
+def get_jti(raw_refresh):
+    """
+    署名と有効期限が正しいリフレッシュトークンのjti。正しくなければNone
+    ローテーション済みのトークンでも他のリクエストの結果を使えるように、失効は確認しない
+    """
+    try:
+        token = SignedToken(raw_refresh)
+    except TokenError:
+        return None
+    if token.get(api_settings.TOKEN_TYPE_CLAIM) != "refresh":
+        return None
+    return token.get(api_settings.JTI_CLAIM)
+
+
+def _rotate(raw_refresh):
+    """
+    TokenRefreshSerializer でローテーションする。失敗したら FAILED を返す
+    """
+    serializer = TokenRefreshSerializer(data={"refresh": raw_refresh})
+    try:
+        if serializer.is_valid():
+            return dict(serializer.validated_data)
+    except (TokenError, APIException, ObjectDoesNotExist):
+        pass
+    return FAILED
+
+
+def rotate(raw_refresh):
+    """
+    リフレッシュトークンから新しいトークンの辞書 {"access", ["refresh"]} を作る
+    同じトークンでの並列のリクエストは1回のローテーションの結果を共有する
+    失敗したら FAILED を、待っても結果が得られなければNoneを返す
+    """
+    jti = get_jti(raw_refresh)
+    if jti is None:
+        return FAILED
+    cache = get_cache()
+    result = cache.get(RESULT_KEY % jti)
+    if result is not None:
+        return result
+    grace = logins_settings.SILENT_REFRESH_GRACE
+    if cache.add(LOCK_KEY % jti, 1, timeout=grace):
+        result = _rotate(raw_refresh)
+        cache.set(RESULT_KEY % jti, result, timeout=grace)
+        return result
+    deadline = time.monotonic() + logins_settings.SILENT_REFRESH_WAIT
+    while time.monotonic() < deadline:
+        time.sleep(POLL_INTERVAL)
+        result = cache.get(RESULT_KEY % jti)
+        if result is not None:
+            return result
+    return None
+
+
+async def arotate(raw_refresh):
+    """
+    rotateの非同期版。待っている間イベントループを塞がない
+    """
+    jti = get_jti(raw_refresh)
+    if jti is None:
+        return FAILED
+    cache = get_cache()
+    result = await cache.aget(RESULT_KEY % jti)
+    if result is not None:
+        return result
+    grace = logins_settings.SILENT_REFRESH_GRACE
+    if await cache.aadd(LOCK_KEY % jti, 1, timeout=grace):
+        result = await sync_to_async(_rotate)(raw_refresh)
+        await cache.aset(RESULT_KEY % jti, result, timeout=grace)
+        return result
+    deadline = time.monotonic() + logins_settings.SILENT_REFRESH_WAIT
+    while time.monotonic() < deadline:
+        await asyncio.sleep(POLL_INTERVAL)
+        result = await cache.aget(RESULT_KEY % jti)
+        if result is not None:
+            return result
+    return None
+
+
+def apply(request, tokens):
+    """
+    新しいトークンをリクエストのクッキーに入れて、このリクエストの認証とログアウトで使わせる
+    """
+    if tokens:
+        request.COOKIES[ACCESS_COOKIE] = "JWT " + tokens["access"]
+        if "refresh" in tokens:
+            request.COOKIES[REFRESH_COOKIE] = tokens["refresh"]
+    return tokens
@@ -0,0 +1,103 @@
+"""
+DRFのレンダラーの高速版
+
+JSONRenderer は orjson でエンコードし、DRFの JSONRenderer と同じバイト列を返す
+(コンパクトな区切り、ensure_asciiなし、日時はDRFのJSONEncoderの形式、U+2028/2029のエスケープ)
+orjson が扱えないデータ(64bitを超える整数など)やインデントの指定はDRFの実装に任せる
+orjson と結果が変わるfloatもDRFに任せる。NaNと無限大はorjsonではnullになるが、DRFではエラーになる
+Pythonのreprが指数表記になる値(1e16以上、1e-4未満)はorjsonでは 1e16、0.00001 のように書かれる
+
+MessagePackRenderer は Accept: application/msgpack のクライアントに MessagePack で返す
+msgpack がインストールされていない時は settings.py で登録しない
+"""
+import math
+import re
+from rest_framework import renderers
+from rest_framework.utils.encoders import JSONEncoder
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+# DRFのJSONEncoderで変換する型 (日時はDRFの形式に合わせるためorjsonに任せない)
+encoder_default = JSONEncoder().default
+
+if orjson is not None:
+    ORJSON_OPTIONS = orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_PASSTHROUGH_DATACLASS | orjson.OPT_NON_STR_KEYS
+
+
+# orjsonの出力にfloatがあるかもしれない (floatは必ず . か e を含み、NaNと無限大はnullになる)
+MAYBE_FLOAT = re.compile(rb"null|[0-9][.e]")
+
+
+def has_special_float(data):
+    """
+    dataに、orjsonとDRFで結果が変わるfloat(非有限か、Pythonのreprが指数表記になる値)があるか
+    """
+    stack = [data]
+    while stack:
+        value = stack.pop()
+        if type(value) is float:
+            if not math.isfinite(value) or (value and not 1e-4 <= abs(value) < 1e16):
+                return True
+        elif isinstance(value, dict):
+            stack.extend(value.values())
+        elif isinstance(value, (list, tuple)):
+            stack.extend(value)
+    return False
+
+
+def dumps(data):
+    """
+    DRFのJSONRendererと同じ形式のJSONのバイト列にする。orjsonが使えないか、同じにならなければNoneを返す
+    """
+    if orjson is None:
+        return None
+    try:
+        ret = orjson.dumps(data, default=encoder_default, option=ORJSON_OPTIONS)
+    except orjson.JSONEncodeError:
+        return None
+    if MAYBE_FLOAT.search(ret) and has_special_float(data):
+        return None
+    # JavaScriptのサブセットにするためのエスケープ (DRFと同じ)
+    if b"\xe2\x80\xa8" in ret or b"\xe2\x80\xa9" in ret:
+        ret = ret.replace(b"\xe2\x80\xa8", b"\\u2028").replace(b"\xe2\x80\xa9", b"\\u2029")
+    return ret
+
+
+class JSONRenderer(renderers.JSONRenderer):
+    """
+    orjsonでエンコードするJSONRenderer
+    """
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b""
+        # DRFの設定を変えている時やインデントを指定された時はDRFでエンコードする
+        if self.ensure_ascii or not self.compact or self.get_indent(accepted_media_type, renderer_context or {}):
+            return super().render(data, accepted_media_type, renderer_context)
+        ret = dumps(data)
+        if ret is None:
+            return super().render(data, accepted_media_type, renderer_context)
+        return ret
+
+
+class MessagePackRenderer(renderers.BaseRenderer):
+    """
+    MessagePackで返すレンダラー。JSONにできるデータはそのままの構造で返す
+    """
+    media_type = "application/msgpack"
+    format = "msgpack"
+    charset = None
+    render_style = "binary"
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b""
+        return msgpack.packb(data, default=encoder_default, use_bin_type=True)
@@ -0,0 +1,215 @@
+"""
+jtiによるトークンの失効リスト
+失効したjtiは共有ストア(Djangoのキャッシュ)に連番付きで書き込み、
+各プロセスは定期的に差分だけを読み込んで、Bloomフィルターと完全な集合をメモリに持つ
+新しいプロセスは、トークンの最長の有効期間より前の失効を読まない (区切り毎の最初の連番から読み始める)
+失効していないトークンの検査はBloomフィルターで弾くので、I/Oもdictの検索も発生しない
+"""
+import hashlib
+import math
+import threading
+import time
+from django.core.cache import caches
+from rest_framework_simplejwt.settings import api_settings
+from .conf import logins_settings
+
+SEQ_KEY = "logins:revocation:seq"
+ENTRY_KEY = "logins:revocation:entry:%d"
+# 1回のget_manyで読み込むエントリの数
+SYNC_BATCH = 1000
+# revoke は連番を取ってからエントリを書き込むので、その間に sync すると最新の連番のエントリが無いことがある
+# 最新の SYNC_BATCH 件の中で見つからなかった連番は、次の sync からこの秒数の間読み直す
+# (期限が切れて消えたエントリも見つからないので、いつまでも読み直さないように諦める)
+GAP_TIMEOUT = 60.0
+# 失効した時刻の区切り毎に、その区切りで最初に取った連番
+MARK_KEY = "logins:revocation:mark:%d"
+# 区切りに印を付け始めた時刻。それより前の失効には印が無い
+MARKED_SINCE_KEY = "logins:revocation:marked_since"
+# トークンの最長の有効期間をこの数の区切りに分ける
+MARK_BUCKETS = 64
+
+
+def max_lifetime():
+    """
+    トークンの最長の有効期間(秒)。失効したトークンの有効期限は、失効した時刻からこれ以内にある
+    """
+    return max(api_settings.ACCESS_TOKEN_LIFETIME, api_settings.REFRESH_TOKEN_LIFETIME).total_seconds()
+
+
+class BloomFilter:
+    """
+    capacity個の要素で偽陽性率がerror_rateになるBloomフィルター
+    """
+
+    def __init__(self, capacity, error_rate):
+        self.capacity = max(capacity, 1)
+        self.size = max(int(-self.capacity * math.log(error_rate) / math.log(2) ** 2), 8)
+        self.hashes = max(int(round(self.size / self.capacity * math.log(2))), 1)
+        self.bits = bytearray((self.size + 7) // 8)
+
+    def _positions(self, value):
+        # 2つのハッシュ値からhashes個の位置を作る (double hashing)
+        digest = hashlib.blake2b(value.encode(), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], "little")
+        h2 = int.from_bytes(digest[8:], "little") | 1
+        return [(h1 + i * h2) % self.size for i in range(self.hashes)]
+
+    def add(self, value):
+        for position in self._positions(value):
+            self.bits[position >> 3] |= 1 << (position & 7)
+
+    def __contains__(self, value):
+        return all(self.bits[position >> 3] & (1 << (position & 7))
+                   for position in self._positions(value))
+
+
+class RevocationList:
+    """
+    プロセス内の失効リスト
+    失効はすぐに共有ストアとこのプロセスに反映され、他のプロセスには
+    REVOCATION_SYNC_INTERVAL 秒以内に反映される
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            # jti -> 失効したトークンの有効期限(UNIX時間)
+            self._revoked = {}
+            self._bloom = self._new_bloom(0)
+            self._seq = 0
+            # 見つからなかった連番 -> 最初に見つからなかった時刻 (time.monotonic)
+            self._gaps = {}
+            self._synced_at = 0.0
+            # 最も早く期限が切れるjtiの有効期限と、Bloomフィルターに残っている期限切れのjtiの数
+            self._next_expiry = math.inf
+            self._stale = 0
+
+    def get_cache(self):
+        return caches[logins_settings.REVOCATION_CACHE]
+
+    def revoke(self, jti, exp):
+        """
+        jtiのトークンを有効期限expまで失効させる
+        """
+        ttl = int(exp - time.time()) + 1
+        if ttl <= 0:
+            return
+        cache = self.get_cache()
+        cache.add(SEQ_KEY, 0, timeout=None)
+        try:
+            seq = cache.incr(SEQ_KEY)
+        except ValueError:
+            # addとincrの間にキーが消えた
+            cache.add(SEQ_KEY, 1, timeout=None)
+            seq = 1
+        cache.set(ENTRY_KEY % seq, (jti, exp), timeout=ttl)
+        lifetime = max_lifetime()
+        span = lifetime / MARK_BUCKETS
+        now = time.time()
+        if cache.add(MARK_KEY % (now // span), seq, timeout=int(lifetime + 2 * span) + 1):
+            cache.add(MARKED_SINCE_KEY, now, timeout=None)
+        with self._lock:
+            self._add(jti, exp)
+
+    def sync_due(self):
+        """
+        前回の同期から REVOCATION_SYNC_INTERVAL 秒が経っていればTrue
+        """
+        return time.monotonic() - self._synced_at >= logins_settings.REVOCATION_SYNC_INTERVAL
+
+    def is_revoked(self, jti):
+        if self.sync_due():
+            self.sync()
+        if jti not in self._bloom:
+            return False
+        exp = self._revoked.get(jti)
+        return exp is not None and exp > time.time()
+
+    def sync(self):
+        """
+        共有ストアから前回以降に失効したjtiと、前回見つからなかったjtiを読み込み、期限切れのjtiを捨てる
+        """
+        cache = self.get_cache()
+        with self._lock:
+            now = time.monotonic()
+            self._synced_at = now
+            seq = cache.get(SEQ_KEY) or 0
+            if seq < self._seq:
+                # 共有ストアが消えて連番が戻った。最初から読み直す
+                self._seq = 0
+                self._gaps = {}
+            if self._seq == 0 and seq:
+                self._seq = self._replay_from(cache, seq)
+            self._gaps = {n: since for n, since in self._gaps.items() if now - since < GAP_TIMEOUT}
+            numbers = [*self._gaps, *range(self._seq + 1, seq + 1)]
+            for start in range(0, len(numbers), SYNC_BATCH):
+                chunk = numbers[start:start + SYNC_BATCH]
+                entries = cache.get_many([ENTRY_KEY % n for n in chunk])
+                for n in chunk:
+                    entry = entries.get(ENTRY_KEY % n)
+                    if entry is not None:
+                        self._gaps.pop(n, None)
+                        self._add(*entry)
+                    elif n > seq - SYNC_BATCH:
+                        self._gaps.setdefault(n, now)
+            self._seq = seq
+            self._prune()
+
+    def _replay_from(self, cache, seq):
+        """
+        最初の sync で読み飛ばす連番の数
+        期限が切れていないトークンの失効は、最長の有効期間の間の区切りの印のうち最も小さい連番以降にある
+        """
+        lifetime = max_lifetime()
+        span = lifetime / MARK_BUCKETS
+        now = time.time()
+        since = cache.get(MARKED_SINCE_KEY)
+        if since is None or now - since < lifetime + 2 * span:
+            # 印の無い失効がまだ期限内かもしれない
+            return 0
+        # 同じ区切りの中では連番の順と印を付ける順が入れ替わることがあるので、1つ前の区切りから見る
+        first = int((now - lifetime) // span) - 1
+        marks = cache.get_many([MARK_KEY % n for n in range(first, int(now // span) + 1)])
+        return min(marks.values(), default=seq + 1) - 1
+
+    def __len__(self):
+        return len(self._revoked)
+
+    def _add(self, jti, exp):
+        self._revoked[jti] = exp
+        self._next_expiry = min(self._next_expiry, exp)
+        if len(self._revoked) > self._bloom.capacity:
+            self._rebuild()
+        else:
+            self._bloom.add(jti)
+
+    def _prune(self):
+        now = time.time()
+        if now < self._next_expiry:
+            return
+        expired = [jti for jti, exp in self._revoked.items() if exp <= now]
+        for jti in expired:
+            del self._revoked[jti]
+        self._next_expiry = min(self._revoked.values(), default=math.inf)
+        # Bloomフィルターからは消せないので、期限切れのjtiが溜まって偽陽性が増えたら作り直す
+        self._stale += len(expired)
+        if self._stale > self._bloom.capacity // 4:
+            self._rebuild()
+
+    def _rebuild(self):
+        self._stale = 0
+        self._bloom = self._new_bloom(len(self._revoked))
+        for jti in self._revoked:
+            self._bloom.add(jti)
+
+    def _new_bloom(self, size):
+        capacity = logins_settings.REVOCATION_BLOOM_CAPACITY
+        while capacity < size:
+            capacity *= 2
+        return BloomFilter(capacity, logins_settings.REVOCATION_BLOOM_ERROR_RATE)
+
+
+revocation_list = RevocationList()
@@ -0,0 +1,65 @@
+"""
+読み込みをレプリカ、書き込みをプライマリ(default)に振り分けるデータベースルーター
+書き込んだクライアントは REPLICA_STICKY_SECONDS 秒の間プライマリから読み込む (read-your-writes)
+状態はリクエスト毎にReplicaStickinessMiddlewareがContextVarに入れる
+"""
+import random
+from contextlib import contextmanager
+from contextvars import ContextVar
+from django.db import DEFAULT_DB_ALIAS, connections
+from .conf import logins_settings
+
+routing_state = ContextVar("logins_routing_state", default=None)
+
+
+class RoutingState:
+    """
+    1リクエスト(またはuse_primaryのブロック)のルーティングの状態
+    """
+
+    def __init__(self, pinned=False):
+        # Trueならレプリカを使わない
+        self.pinned = pinned
+        # このリクエストでプライマリに書き込んだか
+        self.written = False
+
+
+@contextmanager
+def use_primary():
+    """
+    ブロックの中の読み込みをプライマリに向ける
+    """
+    token = routing_state.set(RoutingState(pinned=True))
+    try:
+        yield
+    finally:
+        routing_state.reset(token)
+
+
+class PrimaryReplicaRouter:
+
+    def db_for_read(self, model, **hints):
+        replicas = logins_settings.READ_REPLICAS
+        if not replicas:
+            return None
+        state = routing_state.get()
+        if state is not None and (state.pinned or state.written):
+            return DEFAULT_DB_ALIAS
+        # トランザクションの中ではプライマリの未コミットの書き込みを読む必要がある
+        if connections[DEFAULT_DB_ALIAS].in_atomic_block:
+            return DEFAULT_DB_ALIAS
+        return random.choice(replicas)
+
+    def db_for_write(self, model, **hints):
+        state = routing_state.get()
+        if state is not None:
+            state.written = True
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # レプリカはプライマリと同じデータなので、どのエイリアスのオブジェクトも関連付けられる
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        # レプリカへはレプリケーションで反映される
+        return db not in logins_settings.READ_REPLICAS
@@ -1,5 +1,12 @@
+import jwt
 from rest_framework import serializers
-from .models import User
+from rest_framework.exceptions import AuthenticationFailed
+from rest_framework_simplejwt import serializers as jwt_serializers
+from rest_framework_simplejwt.settings import api_settings
+from .activity import activity_buffer
+from .audit import audit_log
+from .models import AuthEvent, User
+from .tokens import RefreshToken, UntypedToken
 
 class UserSerializer(serializers.ModelSerializer):
     
@@ -17,10 +24,50 @@ class UserSerializer(serializers.ModelSerializer):
                                         email=email, 
                                         password=password)
     
-    def update(self, user, fields):
-        return User.objects.update_user(user, fields)
+    def update(self, user, fields, if_match=None):
+        return User.objects.update_user(user, fields, if_match)
 
     def is_valid(self, valid_fields=(), raise_exception=False, *args):
         if valid_fields:
             self.initial_data = {k:v for k,v in self.initial_data.items() if(k in valid_fields)}
-        return super().is_valid(*args,raise_exception=False)
\ No newline at end of file
+        return super().is_valid(*args,raise_exception=False)
+
+class TokenObtainPairSerializer(jwt_serializers.TokenObtainPairSerializer):
+    """
+    api/token/ でもユーザーのクレームを埋め込んだトークンを発行する
+    """
+    token_class = RefreshToken
+
+    def validate(self, attrs):
+        request = self.context.get("request")
+        try:
+            data = super().validate(attrs)
+        except AuthenticationFailed:
+            audit_log.record(AuthEvent.Kind.LOGIN_FAILED, None, request)
+            raise
+        activity_buffer.touch(self.user.pk, login=True)
+        audit_log.record(AuthEvent.Kind.LOGIN, self.user.pk, request)
+        return data
+
+class TokenRefreshSerializer(jwt_serializers.TokenRefreshSerializer):
+    """
+    失効したリフレッシュトークンを受け付けず、ローテーション前のトークンを失効させる
+    リフレッシュもユーザーのアクセスとして記録する
+    """
+    token_class = RefreshToken
+
+    def validate(self, attrs):
+        data = super().validate(attrs)
+        # 発行したばかりのアクセストークンなので署名は検証しない
+        payload = jwt.decode(data["access"], options={"verify_signature": False})
+        activity_buffer.touch(payload.get(api_settings.USER_ID_CLAIM))
+        return data
+
+
+class TokenVerifySerializer(jwt_serializers.TokenVerifySerializer):
+    """
+    失効したトークンを無効とする
+    """
+    def validate(self, attrs):
+        UntypedToken(attrs["token"])
+        return {}
\ No newline at end of file
@@ -0,0 +1,32 @@
+"""
+Userモデルのシグナルを受け取る関数達
+"""
+from django.db.backends.signals import connection_created
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+from . import listcache
+from .metrics import install_query_wrapper
+from .models import User
+from .usercache import user_cache
+
+
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+def invalidate_user_cache(sender, instance, **kwargs):
+    """
+    ユーザーが保存(更新・パスワード変更)、削除されたらキャッシュから消す
+    """
+    user_cache.invalidate(instance.pk)
+
+
+@receiver(post_delete, sender=User)
+def invalidate_user_list_cache(sender, instance, using, **kwargs):
+    """
+    ユーザーが削除されたらユーザー一覧のキャッシュを無効化する
+    (作成・更新はUserManagerで無効化している)
+    """
+    listcache.invalidate_on_commit(using)
+
+
+# リクエスト毎のクエリの回数と時間を数える (logins/metrics.py)
+connection_created.connect(install_query_wrapper)
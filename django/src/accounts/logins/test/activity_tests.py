@@ -0,0 +1,153 @@
+from django.conf import settings
+from django.core.cache import cache
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from ..activity import activity_buffer
+from ..models import User
+from ..throttling import buckets
+from ..utils import get_jwt
+
+def create_default_user(user_name="Test User",
+                       email="example@example.com",
+                       password="password"):
+  """
+  パラメータのユーザーを作成する
+  """
+  user= User.objects.create_user(user_name=user_name,
+                                       email=email,
+                                       password=password)
+  return user
+
+@override_settings(LOGINS={**settings.LOGINS, "PBKDF2_ITERATIONS": 1000})
+class UserActivityTests(TestCase):
+
+  def setUp(self):
+    cache.clear()
+    buckets.reset()
+    activity_buffer.reset()
+    self.user = create_default_user()
+
+  def login(self):
+    self.client.cookies.clear()
+    return self.client.post(reverse("logins:login"),
+                            { "email": "example@example.com",
+                              "password": "password"},
+                            content_type="application/json")
+
+  def test_login_is_buffered(self):
+    """
+    ログインはすぐには書き込まれず、flushでlast_login、last_seen、login_countが書き込まれる
+    """
+    self.assertEqual(self.login().status_code, 201)
+    user = User.objects.get(pk=self.user.pk)
+    self.assertIsNone(user.last_login)
+    self.assertEqual(user.login_count, 0)
+    self.assertEqual(activity_buffer.flush(), 1)
+    user = User.objects.get(pk=self.user.pk)
+    self.assertIsNotNone(user.last_login)
+    self.assertEqual(user.last_seen, user.last_login)
+    self.assertEqual(user.login_count, 1)
+
+  def test_same_user_is_coalesced(self):
+    """
+    同じユーザーの記録は1つにまとまり、1回のUPDATEで書き込まれる
+    """
+    for _ in range(3):
+      self.assertEqual(self.login().status_code, 201)
+    self.assertEqual(len(activity_buffer), 1)
+    with self.assertNumQueries(1):
+      activity_buffer.flush()
+    self.assertEqual(User.objects.get(pk=self.user.pk).login_count, 3)
+
+  def test_login_count_is_added(self):
+    """
+    ログイン回数は他のワーカーが書き込んだ値に足される
+    """
+    User.objects.filter(pk=self.user.pk).update(login_count=5)
+    activity_buffer.touch(self.user.pk, login=True)
+    activity_buffer.touch(self.user.pk, login=True)
+    activity_buffer.flush()
+    self.assertEqual(User.objects.get(pk=self.user.pk).login_count, 7)
+
+  def test_authenticated_request_is_seen(self):
+    """
+    jwtで認証したリクエストはlast_seenだけを更新する
+    """
+    headers = {"Authorization": "JWT "+get_jwt(self.user)["access"]}
+    response = self.client.get(reverse("logins:index"), headers=headers)
+    self.assertEqual(response.status_code, 200)
+    activity_buffer.flush()
+    user = User.objects.get(pk=self.user.pk)
+    self.assertIsNotNone(user.last_seen)
+    self.assertIsNone(user.last_login)
+    self.assertEqual(user.login_count, 0)
+
+  def test_token_endpoints_are_recorded(self):
+    """
+    api/token/ はログインとして、api/token/refresh/ はアクセスとして記録される
+    """
+    response = self.client.post(reverse("logins:token_obtain_pair"),
+                                { "email": "example@example.com",
+                                  "password": "password"},
+                                content_type="application/json")
+    self.assertEqual(response.status_code, 200)
+    activity_buffer.flush()
+    self.assertEqual(User.objects.get(pk=self.user.pk).login_count, 1)
+    response = self.client.post(reverse("logins:token_refresh"), {"refresh": response.data["refresh"]},
+                                content_type="application/json")
+    self.assertEqual(response.status_code, 200)
+    self.assertEqual(len(activity_buffer), 1)
+
+  def test_no_flush_in_transaction(self):
+    """
+    トランザクションの中では間隔が過ぎても書き込まない
+    """
+    with override_settings(LOGINS={**settings.LOGINS, "ACTIVITY_FLUSH_INTERVAL": 0}):
+      self.login()
+      self.login()
+    self.assertEqual(len(activity_buffer), 1)
+    self.assertEqual(User.objects.get(pk=self.user.pk).login_count, 0)
+
+  @override_settings(LOGINS={**settings.LOGINS, "ACTIVITY_BUFFER_SIZE": 2, "ACTIVITY_BATCH_SIZE": 1})
+  def test_buffer_is_bounded(self):
+    """
+    書き込めないまま上限に達したら新しいユーザーの記録は捨て、書き込みはバッチ毎にUPDATEする
+    """
+    others = [create_default_user(user_name="user%d" % n, email="user%d@example.com" % n) for n in range(2)]
+    activity_buffer.touch(self.user.pk)
+    activity_buffer.touch(others[0].pk)
+    activity_buffer.touch(others[1].pk)
+    activity_buffer.touch(self.user.pk, login=True)
+    self.assertEqual(len(activity_buffer), 2)
+    self.assertEqual(activity_buffer.dropped, 1)
+    with self.assertNumQueries(2):
+      self.assertEqual(activity_buffer.flush(), 2)
+    self.assertIsNone(User.objects.get(pk=others[1].pk).last_seen)
+
+  @override_settings(LOGINS={**settings.LOGINS, "ACTIVITY_TRACKING": False})
+  def test_tracking_disabled(self):
+    """
+    ACTIVITY_TRACKINGが無効なら記録しない
+    """
+    self.login()
+    self.assertEqual(len(activity_buffer), 0)
+
+  def test_other_database_is_not_written(self):
+    """
+    記録した時と違うデータベース(テストの後など)には書き込まない
+    """
+    activity_buffer.touch(self.user.pk)
+    activity_buffer._database = "other"
+    with self.assertNumQueries(0):
+      self.assertEqual(activity_buffer.flush(), 0)
+
+  async def test_async_login_is_recorded(self):
+    """
+    非同期のログインも記録される
+    """
+    response = await self.async_client.post(reverse("logins:async_login"),
+                                            { "email": "example@example.com",
+                                              "password": "password"},
+                                            content_type="application/json")
+    self.assertEqual(response.status_code, 201)
+    self.assertEqual(len(activity_buffer), 1)
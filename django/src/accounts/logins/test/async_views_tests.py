@@ -0,0 +1,173 @@
+import asyncio
+from unittest import mock
+from asgiref.sync import async_to_sync, sync_to_async
+from django.conf import settings
+from django.core.cache import cache
+from django.http import HttpRequest
+from django.db import transaction
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from .. import listcache, utils
+from ..models import User
+from ..revocation import revocation_list
+from ..serializer import UserSerializer
+from ..utils import get_jwt, averify_jwt
+from ..throttling import buckets
+
+def create_default_user(user_name="Test User",
+                       email="example@example.com",
+                       password="password"):
+  """
+  パラメータのユーザーを作成する
+  """
+  user= User.objects.create_user(user_name=user_name,
+                                       email=email,
+                                       password=password)
+  return user
+
+def on_event_loop(calls, function):
+  """
+  functionを呼び、呼ばれたスレッドでイベントループが動いていたかをcallsに追加する
+  """
+  def wrapper(*args, **kwargs):
+    calls.append(asyncio._get_running_loop() is not None)
+    return function(*args, **kwargs)
+  return wrapper
+
+def create_jwt_headers(user):
+  jwt_dict = get_jwt(user)
+  return {"Authorization": "JWT "+jwt_dict["access"]}
+
+@override_settings(LOGINS={**settings.LOGINS, "PBKDF2_ITERATIONS": 1000})
+class UserAsyncViewTests(TestCase):
+
+  def setUp(self):
+    cache.clear()
+    buckets.reset()
+
+  async def test_averify_jwt_with_valid_jwt(self):
+    """
+    jwtがセットされたリクエストを引数にしてaverify_jwt(request)を実行すると
+    ユーザーとjwtが返ってくる
+    """
+    test_user = await sync_to_async(create_default_user)()
+    request = HttpRequest()
+    request.META["HTTP_AUTHORIZATION"] = "JWT "+get_jwt(test_user)["access"]
+    user, _ = await averify_jwt(request)
+    self.assertEqual(user.pk, test_user.pk)
+
+  async def test_averify_jwt_with_invalid_jwt(self):
+    """
+    jwtがセットされていないリクエストを引数にしてaverify_jwt(request)を実行するとNoneが返ってくる
+    """
+    self.assertIsNone(await averify_jwt(HttpRequest()))
+
+  async def test_async_signup_view_post(self):
+    """
+    async_signup_viewにPOSTメソッドを送ったときにユーザーが追加されてログインされている
+    """
+    response = await self.async_client.post(reverse("logins:async_signup"),
+                                            { "user_name": "Test User",
+                                              "email": "example@example.com",
+                                              "password": "password"},
+                                            content_type="application/json")
+    self.assertEqual(response.status_code, 201)
+    self.assertTrue(response.cookies.get("Authorization"))
+    self.assertTrue(response.cookies.get("refresh"))
+    self.assertTrue(await User.objects.filter(email="example@example.com").aexists())
+
+  async def test_async_signup_view_post_with_invalid_params(self):
+    """
+    async_signup_viewに無効なパラメータでPOSTメソッドを送ったときにユーザーが追加されない
+    """
+    response = await self.async_client.post(reverse("logins:async_signup"),
+                                            { "user_name": "a"*16,
+                                              "email": "example@example.com",
+                                              "password": "password"},
+                                            content_type="application/json")
+    self.assertEqual(response.status_code, 400)
+    self.assertFalse(response.cookies)
+
+  async def test_async_login_view_post(self):
+    """
+    async_login_viewにPOSTメソッドを送ったときにログインされている
+    誤ったパスワードの時は401が返ってくる
+    """
+    await sync_to_async(create_default_user)()
+    response = await self.async_client.post(reverse("logins:async_login"),
+                                            { "email": "example@example.com",
+                                              "password": "password"},
+                                            content_type="application/json")
+    self.assertEqual(response.status_code, 201)
+    self.assertTrue(response.cookies.get("Authorization"))
+    # クッキーで認証されるのでログアウトした状態に戻す
+    self.async_client.cookies.clear()
+    response = await self.async_client.post(reverse("logins:async_login"),
+                                            { "email": "example@example.com",
+                                              "password": "invalid_password"},
+                                            content_type="application/json")
+    self.assertEqual(response.status_code, 401)
+    self.assertFalse(response.cookies)
+
+  async def test_async_login_view_post_with_login(self):
+    """
+    ログイン中にasync_login_viewにPOSTメソッドを送ったときに403が返ってくる
+    """
+    test_user = await sync_to_async(create_default_user)()
+    response = await self.async_client.post(reverse("logins:async_login"),
+                                            { "email": "example@example.com",
+                                              "password": "password"},
+                                            headers=create_jwt_headers(test_user),
+                                            content_type="application/json")
+    self.assertEqual(response.status_code, 403)
+
+  async def test_async_logout_view(self):
+    """
+    async_logout_viewにDELETEメソッドを送ったときにログアウト状態になる
+    ログインしていないときは401が返ってくる
+    """
+    test_user = await sync_to_async(create_default_user)()
+    response = await self.async_client.delete(reverse("logins:async_logout"),
+                                              headers=create_jwt_headers(test_user))
+    self.assertEqual(response.status_code, 200)
+    self.assertFalse(response.cookies["Authorization"]["max-age"])
+    response = await self.async_client.delete(reverse("logins:async_logout"))
+    self.assertEqual(response.status_code, 401)
+
+  async def test_blocking_calls_run_off_event_loop(self):
+    """
+    バリデーション、jwtの発行、失効、失効リストの同期はイベントループのスレッドで実行しない
+    """
+    calls = []
+    await sync_to_async(create_default_user)()
+    with mock.patch.object(UserSerializer, "is_valid", on_event_loop(calls, UserSerializer.is_valid)), \
+         mock.patch.object(utils, "get_jwt_and_set_cookie", on_event_loop(calls, utils.get_jwt_and_set_cookie)), \
+         mock.patch.object(utils, "revoke_jwt", on_event_loop(calls, utils.revoke_jwt)), \
+         mock.patch.object(revocation_list, "sync", on_event_loop(calls, revocation_list.sync)):
+      response = await self.async_client.post(reverse("logins:async_login"),
+                                              { "email": "example@example.com",
+                                                "password": "password"},
+                                              content_type="application/json")
+      self.assertEqual(response.status_code, 201)
+      revocation_list.reset()
+      response = await self.async_client.delete(reverse("logins:async_logout"))
+      self.assertEqual(response.status_code, 200)
+    self.assertEqual(calls, [False] * 4)
+
+  async def test_acreate_user_invalidates_list_after_commit(self):
+    """
+    非同期の作成も、トランザクションの中ではコミットされるまで一覧のバージョンを上げない
+    """
+    version = await sync_to_async(listcache.get_version)()
+
+    async def create():
+      await User.objects.acreate_user(user_name="Test User", email="example@example.com", password="password")
+      self.assertEqual(await sync_to_async(listcache.get_version)(), version)
+
+    def create_in_transaction():
+      with self.captureOnCommitCallbacks(execute=True):
+        with transaction.atomic():
+          async_to_sync(create)()
+
+    await sync_to_async(create_in_transaction)()
+    self.assertNotEqual(await sync_to_async(listcache.get_version)(), version)
@@ -0,0 +1,241 @@
+import datetime
+import io
+import os
+import tempfile
+import time
+from unittest import mock
+from django.conf import settings
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import DatabaseError, transaction
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+from ..audit import audit_log
+from ..models import AuthEvent, User
+from ..throttling import buckets
+from ..utils import get_jwt
+
+Kind = AuthEvent.Kind
+
+def create_default_user(user_name="Test User",
+                       email="example@example.com",
+                       password="password"):
+  """
+  パラメータのユーザーを作成する
+  """
+  user= User.objects.create_user(user_name=user_name,
+                                       email=email,
+                                       password=password)
+  return user
+
+def create_event(days_ago=0, kind=Kind.LOGIN):
+  return AuthEvent.objects.create(created_at=timezone.now() - datetime.timedelta(days=days_ago),
+                                  kind=kind, user_id=1, ip="127.0.0.1")
+
+def event(kind=Kind.LOGIN):
+  return (timezone.now(), int(kind), 1, "127.0.0.1")
+
+@override_settings(LOGINS={**settings.LOGINS, "PBKDF2_ITERATIONS": 1000, "AUDIT_FLUSH_INTERVAL": None})
+class UserAuditTests(TestCase):
+
+  def setUp(self):
+    cache.clear()
+    buckets.reset()
+    audit_log.reset()
+    self.user = create_default_user()
+
+  def login(self, password="password"):
+    self.client.cookies.clear()
+    with self.captureOnCommitCallbacks(execute=True):
+      return self.client.post(reverse("logins:login"),
+                              { "email": "example@example.com",
+                                "password": password},
+                              content_type="application/json")
+
+  def flushed_kinds(self):
+    audit_log.flush()
+    return list(AuthEvent.objects.order_by("id").values_list("kind", "user_id"))
+
+  def test_view_events(self):
+    """
+    サインアップ、ログインの失敗、ログイン、パスワードの変更、ログアウトが記録される
+    """
+    with self.captureOnCommitCallbacks(execute=True):
+      response = self.client.post(reverse("logins:signup"),
+                                  { "user_name": "New User",
+                                    "email": "new@example.com",
+                                    "password": "password"},
+                                  content_type="application/json")
+    self.assertEqual(response.status_code, 201)
+    new_user = User.objects.get(email="new@example.com")
+    self.assertEqual(self.login("wrong").status_code, 401)
+    self.assertEqual(self.login().status_code, 201)
+    headers = {"Authorization": "JWT "+get_jwt(self.user)["access"]}
+    with self.captureOnCommitCallbacks(execute=True):
+      response = self.client.patch(reverse("logins:update_password", kwargs={"pk": self.user.pk}),
+                                   {"password": "new_password"}, headers=headers,
+                                   content_type="application/json")
+      self.assertEqual(response.status_code, 200)
+      response = self.client.delete(reverse("logins:logout"), headers=headers)
+      self.assertEqual(response.status_code, 200)
+    self.assertEqual(self.flushed_kinds(), [(Kind.SIGNUP, new_user.pk),
+                                            (Kind.LOGIN_FAILED, None),
+                                            (Kind.LOGIN, self.user.pk),
+                                            (Kind.PASSWORD_CHANGE, self.user.pk),
+                                            (Kind.LOGOUT, self.user.pk)])
+    self.assertEqual(AuthEvent.objects.first().ip, "127.0.0.1")
+
+  def test_token_obtain_events(self):
+    """
+    api/token/ のログインと失敗も記録される
+    """
+    with self.captureOnCommitCallbacks(execute=True):
+      for password in ("wrong", "password"):
+        self.client.post(reverse("logins:token_obtain_pair"),
+                         { "email": "example@example.com",
+                           "password": password},
+                         content_type="application/json")
+    self.assertEqual(self.flushed_kinds(), [(Kind.LOGIN_FAILED, None), (Kind.LOGIN, self.user.pk)])
+
+  def test_events_are_buffered(self):
+    """
+    イベントはすぐには書き込まれず、flushでまとめて1回のINSERTになる
+    """
+    for _ in range(3):
+      self.login()
+    self.assertEqual(len(audit_log), 3)
+    self.assertEqual(AuthEvent.objects.count(), 0)
+    with self.assertNumQueries(1):
+      self.assertEqual(audit_log.flush(), 3)
+    self.assertEqual(AuthEvent.objects.count(), 3)
+
+  def test_rolled_back_event_is_not_recorded(self):
+    """
+    ロールバックしたトランザクションの中で記録したイベントはバッファに入らない
+    """
+    with self.captureOnCommitCallbacks(execute=True):
+      try:
+        with transaction.atomic():
+          audit_log.record(Kind.SIGNUP, self.user.pk)
+          raise DatabaseError
+      except DatabaseError:
+        pass
+    self.assertEqual(len(audit_log), 0)
+
+  @override_settings(LOGINS={**settings.LOGINS, "AUDIT_FLUSH_INTERVAL": None, "AUDIT_BUFFER_SIZE": 2})
+  def test_overflow_drops_oldest(self):
+    """
+    AUDIT_SPILL_DIR が無ければ溢れたイベントは古いものから捨てる
+    """
+    audit_log.append(event(Kind.SIGNUP))
+    audit_log.append(event(Kind.LOGIN))
+    audit_log.append(event(Kind.LOGOUT))
+    self.assertEqual(audit_log.dropped, 1)
+    self.assertEqual(self.flushed_kinds(), [(Kind.LOGIN, 1), (Kind.LOGOUT, 1)])
+
+  def test_overflow_spills_to_file(self):
+    """
+    AUDIT_SPILL_DIR があれば溢れたイベントをファイルに追記し、load_auth_events で読み込める
+    """
+    with tempfile.TemporaryDirectory() as directory:
+      with override_settings(LOGINS={**settings.LOGINS, "AUDIT_FLUSH_INTERVAL": None,
+                                     "AUDIT_BUFFER_SIZE": 1, "AUDIT_SPILL_DIR": directory}):
+        audit_log.append(event(Kind.SIGNUP))
+        audit_log.append(event(Kind.LOGIN))
+        audit_log.append(event(Kind.LOGOUT))
+        self.assertEqual(audit_log.spilled, 2)
+        self.assertEqual(audit_log.flush(), 1)
+        output = io.StringIO()
+        call_command("load_auth_events", stdout=output)
+        self.assertIn("loaded 2 events", output.getvalue())
+        self.assertEqual(os.listdir(directory), [])
+    self.assertEqual(sorted(AuthEvent.objects.values_list("kind", flat=True)),
+                     [Kind.LOGIN, Kind.SIGNUP, Kind.LOGOUT])
+
+  def test_failed_flush_spills_to_file(self):
+    """
+    書き込みに失敗したイベントはファイルに書き出し、後で読み込める
+    """
+    with tempfile.TemporaryDirectory() as directory:
+      with override_settings(LOGINS={**settings.LOGINS, "AUDIT_FLUSH_INTERVAL": None,
+                                     "AUDIT_SPILL_DIR": directory}):
+        audit_log.append(event())
+        with mock.patch.object(audit_log, "insert", side_effect=DatabaseError):
+          self.assertEqual(audit_log.flush(), 0)
+        self.assertEqual(audit_log.spilled, 1)
+        self.assertEqual(audit_log.load_spilled(), 1)
+    self.assertEqual(AuthEvent.objects.count(), 1)
+
+  def test_leftover_loading_file_is_kept(self):
+    """
+    前回の読み込みに失敗して残ったファイルを上書きせず、新しく書き出したファイルと一緒に読み込む
+    """
+    with tempfile.TemporaryDirectory() as directory:
+      with override_settings(LOGINS={**settings.LOGINS, "AUDIT_FLUSH_INTERVAL": None,
+                                     "AUDIT_SPILL_DIR": directory}):
+        audit_log.spill([event(Kind.SIGNUP)])
+        with mock.patch.object(audit_log, "insert", side_effect=DatabaseError):
+          with self.assertRaises(DatabaseError):
+            audit_log.load_spilled()
+        audit_log.spill([event(Kind.LOGIN)])
+        self.assertEqual(audit_log.load_spilled(), 2)
+        self.assertEqual(os.listdir(directory), [])
+    self.assertEqual(sorted(AuthEvent.objects.values_list("kind", flat=True)), [Kind.LOGIN, Kind.SIGNUP])
+
+  def test_prune_deletes_in_chunks(self):
+    """
+    保持期間を過ぎたイベントだけを chunk_size 件ずつ消す
+    """
+    for _ in range(3):
+      create_event(days_ago=100)
+    recent = create_event(days_ago=1)
+    output = io.StringIO()
+    # 2件ずつ: (SELECT + DELETE) * 2 + 最後のSELECT
+    with self.assertNumQueries(5):
+      call_command("prune_auth_events", chunk_size=2, stdout=output)
+    self.assertIn("deleted 3 events", output.getvalue())
+    self.assertEqual(list(AuthEvent.objects.all()), [recent])
+    call_command("prune_auth_events", days=0, stdout=output)
+    self.assertEqual(AuthEvent.objects.count(), 0)
+
+  @override_settings(LOGINS={**settings.LOGINS, "AUDIT": False})
+  def test_audit_disabled(self):
+    """
+    AUDITが無効なら記録しない
+    """
+    self.login()
+    self.assertEqual(len(audit_log), 0)
+
+  async def test_async_login_is_recorded(self):
+    """
+    非同期のログインとその失敗も記録される
+    """
+    for password, status_code in (("wrong", 401), ("password", 201)):
+      response = await self.async_client.post(reverse("logins:async_login"),
+                                              { "email": "example@example.com",
+                                                "password": password},
+                                              content_type="application/json")
+      self.assertEqual(response.status_code, status_code)
+    self.assertEqual(len(audit_log), 2)
+
+@override_settings(LOGINS={**settings.LOGINS, "AUDIT_FLUSH_INTERVAL": 0.05, "AUDIT_BATCH_SIZE": 2})
+class UserAuditFlusherTests(TransactionTestCase):
+
+  def setUp(self):
+    audit_log.reset()
+
+  def tearDown(self):
+    audit_log.reset()
+
+  def test_background_flush(self):
+    """
+    バックグラウンドのスレッドがリクエストのスレッドの代わりに書き込む
+    """
+    audit_log.record(Kind.LOGIN, 42)
+    audit_log.record(Kind.LOGOUT, 42)
+    deadline = time.monotonic() + 5
+    events = AuthEvent.objects.using("default").filter(user_id=42)
+    while events.count() < 2 and time.monotonic() < deadline:
+      time.sleep(0.02)
+    self.assertEqual(events.count(), 2)
@@ -0,0 +1,156 @@
+from django.test import TestCase, override_settings
+from django.http import HttpRequest
+from rest_framework.request import Request
+from rest_framework.exceptions import AuthenticationFailed
+from ..models import User
+from ..utils import get_jwt, verify_jwt
+from ..authentication import JWTAuthentication, ClaimsUser
+from ..usercache import user_cache
+from rest_framework_simplejwt.tokens import RefreshToken
+from ..permissions import OnlyYouPerm, OnlyLogoutPerm
+
+def create_default_user(user_name="Test User",
+                       email="example@example.com",
+                       password="password"):
+  """
+  パラメータのユーザーを作成する
+  """
+  user= User.objects.create_user(user_name=user_name,
+                                       email=email,
+                                       password=password)
+  return user
+
+def create_jwt_request(user):
+  """
+  jwtをヘッダーにセットしたリクエストを作成する
+  """
+  request = Request(HttpRequest(), authenticators=[JWTAuthentication()])
+  request.META["HTTP_AUTHORIZATION"]="JWT "+get_jwt(user)["access"]
+  return request
+
+class UserAuthenticationTests(TestCase):
+
+  class viewMock():
+    def __init__(self, id):
+      self.kwargs = {"pk": id}
+
+  def setUp(self):
+    self.user = create_default_user()
+
+  def test_verify_jwt_is_memoized_per_request(self):
+    """
+    同じリクエストでverify_jwt(request)を何度呼んでもユーザーの取得は1回だけ
+    """
+    request = create_jwt_request(self.user)
+    with self.assertNumQueries(1):
+      first = verify_jwt(request)
+      second = verify_jwt(request)
+    self.assertIs(first[0], second[0])
+
+  def test_permissions_reuse_authentication_result(self):
+    """
+    認証クラスで検証済みのリクエストでは、パーミッションがクエリを発行しない
+    """
+    request = create_jwt_request(self.user)
+    with self.assertNumQueries(1):
+      self.assertEqual(request.user.pk, self.user.pk)
+      self.assertTrue(OnlyYouPerm().has_permission(request, self.viewMock(self.user.pk)))
+      self.assertFalse(OnlyLogoutPerm().has_permission(request, self.viewMock(self.user.pk)))
+
+  def test_memoized_result_is_not_shared_between_requests(self):
+    """
+    別のリクエストでは検証をやり直す
+    """
+    with self.assertNumQueries(2):
+      verify_jwt(create_jwt_request(self.user))
+      verify_jwt(create_jwt_request(self.user))
+
+  def test_invalid_jwt_raises_every_time(self):
+    """
+    無効なjwtの場合、何度呼んでもAuthenticationFailedが送出される
+    """
+    request = Request(HttpRequest())
+    request.META["HTTP_AUTHORIZATION"]="JWT invalid"
+    with self.assertRaises(AuthenticationFailed):
+      verify_jwt(request)
+    with self.assertRaises(AuthenticationFailed):
+      verify_jwt(request)
+
+  def test_update_view_authenticates_once(self):
+    """
+    api/update/<pk>へのPATCHでユーザーの取得は1回だけ (認証での取得 + 更新)
+    テストはトランザクションの中なので、更新の前後にセーブポイントの2回が加わる
+    """
+    headers = {"Authorization": "JWT "+get_jwt(self.user)["access"]}
+    with self.assertNumQueries(4):
+      response = self.client.patch("/api/update/%d" % self.user.pk,
+                                   {"user_name": "Changed User"},
+                                   headers=headers,
+                                   content_type="application/json")
+    self.assertEqual(response.status_code, 200)
+
+
+class UserAuthenticationModeTests(TestCase):
+
+  def setUp(self):
+    self.user = create_default_user()
+    user_cache.clear()
+
+  @override_settings(LOGINS={"AUTH_USER_MODE": "claims"})
+  def test_claims_mode_builds_user_without_query(self):
+    """
+    claimsモードではトークンのクレームからユーザーが作られ、クエリが発行されない
+    """
+    request = create_jwt_request(self.user)
+    with self.assertNumQueries(0):
+      user, _ = verify_jwt(request)
+    self.assertIsInstance(user, ClaimsUser)
+    self.assertEqual(user.pk, self.user.pk)
+    self.assertEqual(user.user_name, self.user.user_name)
+    self.assertFalse(user.is_staff)
+
+  @override_settings(LOGINS={"AUTH_USER_MODE": "claims"})
+  def test_claims_mode_falls_back_to_db_without_claims(self):
+    """
+    claimsモードでもクレームが無い古いトークンはDBからユーザーを取得する
+    """
+    request = Request(HttpRequest(), authenticators=[JWTAuthentication()])
+    request.META["HTTP_AUTHORIZATION"]="JWT "+str(RefreshToken.for_user(self.user).access_token)
+    with self.assertNumQueries(1):
+      user, _ = verify_jwt(request)
+    self.assertIsInstance(user, User)
+
+  @override_settings(LOGINS={"AUTH_USER_MODE": "cache"})
+  def test_cache_mode_fetches_user_once(self):
+    """
+    cacheモードでは2回目以降のリクエストでクエリが発行されない
+    """
+    with self.assertNumQueries(1):
+      verify_jwt(create_jwt_request(self.user))
+    with self.assertNumQueries(0):
+      user, _ = verify_jwt(create_jwt_request(self.user))
+    self.assertEqual(user.pk, self.user.pk)
+
+  @override_settings(LOGINS={"AUTH_USER_MODE": "cache"})
+  def test_cache_mode_is_invalidated_on_update(self):
+    """
+    cacheモードでもupdate_userでユーザーが更新されたらキャッシュから消える
+    """
+    verify_jwt(create_jwt_request(self.user))
+    User.objects.update_user(self.user, {"user_name": "Changed User"})
+    self.assertEqual(len(user_cache), 0)
+    user, _ = verify_jwt(create_jwt_request(self.user))
+    self.assertEqual(user.user_name, "Changed User")
+
+  @override_settings(LOGINS={"AUTH_USER_MODE": "cache", "USER_CACHE_SIZE": 1})
+  def test_cache_mode_is_bounded(self):
+    """
+    cacheモードでは USER_CACHE_SIZE を超えたユーザーが古い順に追い出される
+    """
+    another_user = create_default_user(user_name="another_user",
+                                       email="anotheremail@example.com")
+    verify_jwt(create_jwt_request(self.user))
+    verify_jwt(create_jwt_request(another_user))
+    self.assertEqual(len(user_cache), 1)
+    with self.assertNumQueries(1):
+      verify_jwt(create_jwt_request(self.user))
@@ -0,0 +1,209 @@
+from django.conf import settings
+from django.core.cache import cache
+from unittest import mock
+from django.db import IntegrityError
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from ..audit import audit_log
+from ..models import AuthEvent, User
+from ..utils import get_jwt
+from ..throttling import buckets
+
+def create_default_user(user_name="Test User",
+                       email="example@example.com",
+                       password="password"):
+  """
+  パラメータのユーザーを作成する
+  """
+  user= User.objects.create_user(user_name=user_name,
+                                       email=email,
+                                       password=password)
+  return user
+
+def create_jwt_headers(user):
+  jwt_dict = get_jwt(user)
+  return {"Authorization": "JWT "+jwt_dict["access"]}
+
+@override_settings(LOGINS={**settings.LOGINS, "PBKDF2_ITERATIONS": 1000})
+class UserBatchViewTests(TestCase):
+
+  def setUp(self):
+    cache.clear()
+    buckets.reset()
+    self.admin = User.objects.create_superuser(user_name="admin",
+                                               email="admin@example.com",
+                                               password="password")
+    self.headers = create_jwt_headers(self.admin)
+
+  def test_signup_batch_view_post(self):
+    """
+    signup_batch_viewにPOSTメソッドを送ったときにユーザーがまとめて追加される
+    重複の検査はフィールド毎に1回のクエリで、登録は1つのトランザクションで行われる
+    """
+    users = [{"user_name": "user%d" % i, "email": "user%d@example.com" % i, "password": "password"}
+             for i in range(3)]
+    # 認証, user_nameの重複, emailの重複, SAVEPOINT, INSERT, RELEASE
+    with self.assertNumQueries(6):
+      response = self.client.post(reverse("logins:signup_batch"), users,
+                                  headers=self.headers, content_type="application/json")
+    self.assertEqual(response.status_code, 201)
+    self.assertEqual([result["status"] for result in response.data], [201, 201, 201])
+    for result in response.data:
+      user = User.objects.get(pk=result["user"]["id"])
+      self.assertTrue(user.check_password("password"))
+
+  def test_signup_batch_view_post_with_invalid_items(self):
+    """
+    signup_batch_viewに無効な要素を含む配列を送ったときに
+    要素毎にエラーが返ってきて、有効な要素だけ追加される
+    """
+    create_default_user()
+    users = [{"user_name": "Test User", "email": "new@example.com", "password": "password"},
+             {"user_name": "user1", "email": "user1@example.com", "password": "password"},
+             {"user_name": "user2", "email": "user1@example.com", "password": "password"},
+             {"user_name": "a"*16, "email": "user3@example.com", "password": "password"},
+             {"user_name": "user4", "email": "user4@example.com"}]
+    response = self.client.post(reverse("logins:signup_batch"), users,
+                                headers=self.headers, content_type="application/json")
+    self.assertEqual(response.status_code, 207)
+    self.assertEqual([result["status"] for result in response.data], [400, 201, 400, 400, 400])
+    self.assertIn("user_name", response.data[0]["errors"])
+    self.assertIn("email", response.data[2]["errors"])
+    self.assertIn("user_name", response.data[3]["errors"])
+    self.assertIn("password", response.data[4]["errors"])
+    self.assertEqual(User.objects.count(), 3)
+
+  def test_signup_batch_view_post_with_not_admin(self):
+    """
+    管理者でないユーザーがsignup_batch_viewにPOSTメソッドを送ったときに403が返ってくる
+    """
+    headers = create_jwt_headers(create_default_user())
+    response = self.client.post(reverse("logins:signup_batch"),
+                                [{"user_name": "user1", "email": "user1@example.com", "password": "password"}],
+                                headers=headers, content_type="application/json")
+    self.assertEqual(response.status_code, 403)
+    self.assertFalse(User.objects.filter(user_name="user1"))
+
+  def test_signup_batch_view_post_with_too_many_users(self):
+    """
+    BATCH_MAX_SIZEを超える配列を送ったときに400が返ってくる
+    """
+    with self.settings(LOGINS={**settings.LOGINS, "BATCH_MAX_SIZE": 1}):
+      response = self.client.post(reverse("logins:signup_batch"), [{}, {}],
+                                  headers=self.headers, content_type="application/json")
+    self.assertEqual(response.status_code, 400)
+
+  def test_update_batch_view_patch(self):
+    """
+    update_batch_viewにPATCHメソッドを送ったときにユーザーがまとめて更新される
+    存在しないユーザーや重複は要素毎にエラーになる
+    """
+    user1 = create_default_user(user_name="user1", email="user1@example.com")
+    user2 = create_default_user(user_name="user2", email="user2@example.com")
+    old_password = user2.password
+    patches = [{"id": user1.pk, "user_name": "changed1", "email": "user1@example.com"},
+               {"id": user2.pk, "password": "change_password"},
+               {"id": 0, "user_name": "changed3"},
+               {"id": user2.pk, "user_name": "changed1"}]
+    response = self.client.patch(reverse("logins:update_batch"), patches,
+                                 headers=self.headers, content_type="application/json")
+    self.assertEqual(response.status_code, 207)
+    self.assertEqual([result["status"] for result in response.data], [200, 200, 404, 400])
+    user1.refresh_from_db()
+    user2.refresh_from_db()
+    self.assertEqual(user1.user_name, "changed1")
+    self.assertEqual(user2.user_name, "user2")
+    self.assertNotEqual(user2.password, old_password)
+
+  def test_update_batch_view_patch_partial_fields(self):
+    """
+    emailを含まない要素が複数あっても、emailの重複にならない
+    """
+    users = [create_default_user(user_name="user%d" % n, email="user%d@example.com" % n) for n in range(3)]
+    patches = [{"id": user.pk, "user_name": "changed%d" % n} for n, user in enumerate(users)]
+    response = self.client.patch(reverse("logins:update_batch"), patches,
+                                 headers=self.headers, content_type="application/json")
+    self.assertEqual(response.status_code, 200)
+    self.assertEqual([result["status"] for result in response.data], [200, 200, 200])
+
+  def test_update_batch_view_patch_with_other_members_value(self):
+    """
+    バッチの他の要素のユーザーが使っているemailに変えると、その要素だけ400になる
+    """
+    user1 = create_default_user(user_name="user1", email="user1@example.com")
+    user2 = create_default_user(user_name="user2", email="user2@example.com")
+    patches = [{"id": user1.pk, "email": "USER2@example.com"},
+               {"id": user2.pk, "user_name": "changed2"},
+               {"id": user2.pk, "email": "user2@example.com"}]
+    response = self.client.patch(reverse("logins:update_batch"), patches,
+                                 headers=self.headers, content_type="application/json")
+    self.assertEqual(response.status_code, 207)
+    self.assertEqual([result["status"] for result in response.data], [400, 200, 200])
+    self.assertIn("email", response.data[0]["errors"])
+    self.assertEqual(User.objects.get(pk=user1.pk).email, "user1@example.com")
+    self.assertEqual(User.objects.get(pk=user2.pk).user_name, "changed2")
+
+  def test_signup_batch_view_post_with_racing_insert(self):
+    """
+    重複の検査の後に他のリクエストが同じemailで登録していたら、500ではなくその要素だけ400になる
+    """
+    users = [{"user_name": "user%d" % i, "email": "user%d@example.com" % i, "password": "password"}
+             for i in range(2)]
+    find_conflicts = User.objects.find_conflicts
+
+    def racing_find_conflicts(*args, **kwargs):
+      taken = find_conflicts(*args, **kwargs)
+      create_default_user(user_name="racer", email="USER1@example.com")
+      return taken
+
+    with mock.patch.object(User.objects, "find_conflicts", racing_find_conflicts):
+      response = self.client.post(reverse("logins:signup_batch"), users,
+                                  headers=self.headers, content_type="application/json")
+    self.assertEqual(response.status_code, 207)
+    self.assertEqual([result["status"] for result in response.data], [201, 400])
+    self.assertEqual(response.data[1]["errors"], {"email": ["user with this email already exists."]})
+    self.assertTrue(User.objects.filter(pk=response.data[0]["user"]["id"], email="user0@example.com").exists())
+
+  def test_update_batch_view_patch_with_racing_update(self):
+    """
+    重複の検査の後に他のリクエストが同じuser_nameに変えていたら、その要素だけ400になる
+    """
+    users = [create_default_user(user_name="user%d" % n, email="user%d@example.com" % n) for n in range(2)]
+    find_conflicts = User.objects.find_conflicts
+
+    def racing_find_conflicts(*args, **kwargs):
+      taken = find_conflicts(*args, **kwargs)
+      User.objects.filter(pk=self.admin.pk).update(user_name="Taken")
+      return taken
+
+    patches = [{"id": users[0].pk, "user_name": "taken"}, {"id": users[1].pk, "user_name": "free"}]
+    with mock.patch.object(User.objects, "find_conflicts", racing_find_conflicts):
+      response = self.client.patch(reverse("logins:update_batch"), patches,
+                                   headers=self.headers, content_type="application/json")
+    self.assertEqual(response.status_code, 207)
+    self.assertEqual([result["status"] for result in response.data], [400, 200])
+    self.assertEqual([user.user_name for user in User.objects.filter(pk__in=[u.pk for u in users]).order_by("id")],
+                     ["user0", "free"])
+
+  def test_other_integrity_errors_are_raised(self):
+    """
+    一意制約以外のIntegrityErrorはそのまま送出する
+    """
+    with mock.patch.object(User.objects, "bulk_create", side_effect=IntegrityError("NOT NULL constraint failed")):
+      with self.assertRaises(IntegrityError):
+        User.objects.bulk_create_users([User(user_name="x", email="x@example.com", password="!")])
+
+  @override_settings(LOGINS={**settings.LOGINS, "PBKDF2_ITERATIONS": 1000, "AUDIT_FLUSH_INTERVAL": None})
+  def test_update_batch_view_patch_password_is_audited(self):
+    """
+    バッチでのパスワードの変更も監査ログに記録される
+    """
+    user = create_default_user(user_name="user1", email="user1@example.com")
+    audit_log.reset()
+    with self.captureOnCommitCallbacks(execute=True):
+      response = self.client.patch(reverse("logins:update_batch"),
+                                   [{"id": user.pk, "password": "new_password"}],
+                                   headers=self.headers, content_type="application/json")
+    self.assertEqual(response.status_code, 200)
+    audit_log.flush()
+    self.assertEqual(list(AuthEvent.objects.values_list("kind", "user_id")), [(AuthEvent.Kind.PASSWORD_CHANGE, user.pk)])
@@ -0,0 +1,126 @@
+import json
+import os
+import tempfile
+from django.conf import settings
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.test import TestCase, TransactionTestCase, override_settings
+from io import StringIO
+from unittest import mock
+from ..benchmarks import BENCHMARKS, measure, percentile, unthrottled
+from ..benchmarks.baseline import compare
+from ..benchmarks.concurrency import async_views
+from ..benchmarks.data import generate_users
+from ..benchmarks.endpoints import REQUESTS, url_names
+from ..models import User
+
+@override_settings(LOGINS={**settings.LOGINS, "PBKDF2_ITERATIONS": 1000})
+class UserBenchmarkTests(TestCase):
+
+  def test_percentile(self):
+    """
+    最近傍順位法で分位点を返す
+    """
+    values = list(range(1, 101))
+    self.assertEqual(percentile(values, 0.5), 50)
+    self.assertEqual(percentile(values, 0.99), 99)
+    self.assertEqual(percentile([], 0.5), 0.0)
+
+  def test_measure(self):
+    """
+    setupの戻り値がfuncに渡され、setupのクエリは数えない
+    """
+    received = []
+    row = measure("case", lambda user: received.append(User.objects.filter(pk=user.pk).exists()), 3,
+                  setup=lambda: User.objects.create_user(user_name="u%d" % len(received),
+                                                         email="u%d@example.com" % len(received),
+                                                         password="password"))
+    self.assertEqual(received, [True, True, True])
+    self.assertEqual(row["queries"], 1)
+    self.assertLessEqual(row["p50_us"], row["p99_us"])
+
+  def test_generate_users(self):
+    """
+    指定した数のユーザーがバッチに分けて作られる
+    """
+    self.assertEqual(generate_users(25, batch_size=10), 25)
+    self.assertEqual(User.objects.filter(email__startswith="bench").count(), 25)
+
+  def test_every_url_has_a_request(self):
+    """
+    logins/urls.py のすべてのURL名にベンチマークのリクエストがある
+    """
+    self.assertEqual(set(url_names()) - set(REQUESTS), set())
+
+  def test_compare(self):
+    """
+    許容範囲を超えて遅くなるか、クエリが増えたら悪化として報告する
+    """
+    baseline = {"endpoints": [{"case": "index", "p50_us": 100.0, "p99_us": 200.0, "queries": 1.0}]}
+    self.assertEqual(compare(baseline, {"endpoints": [{"case": "index", "p50_us": 110.0, "p99_us": 200.0,
+                                                        "queries": 1.0}]}, 0.2), [])
+    regressions = compare(baseline, {"endpoints": [{"case": "index", "p50_us": 130.0, "p99_us": 200.0,
+                                                     "queries": 2.0}]}, 0.2)
+    self.assertEqual(len(regressions), 2)
+    self.assertEqual(compare(baseline, {"endpoints": [{"case": "new", "p50_us": 1e9}]}, 0.2), [])
+
+  def test_command_baseline_and_compare(self):
+    """
+    endpointsのベンチマークを実行してベースラインを書き出し、
+    悪化したベースラインと比較すると失敗する
+    """
+    with tempfile.TemporaryDirectory() as directory:
+      path = os.path.join(directory, "baseline.json")
+      output = StringIO()
+      call_command("benchmark", "endpoints", iterations=1, users=5, output=path, stdout=output)
+      self.assertIn("status=200", output.getvalue())
+      with open(path) as f:
+        data = json.load(f)
+      rows = data["results"]["endpoints"]
+      self.assertEqual({row["case"] for row in rows}, set(url_names()))
+      self.assertFalse([row for row in rows if row.get("status", "").startswith(("4", "5"))])
+      for row in rows:
+        row["queries"] = -1
+      with open(path, "w") as f:
+        json.dump(data, f)
+      with self.assertRaises(CommandError):
+        call_command("benchmark", "endpoints", iterations=1, users=5, urls=["jwks", "index"],
+                     compare=path, stdout=StringIO())
+
+  @override_settings(LOGINS={**settings.LOGINS, "PBKDF2_ITERATIONS": 1000,
+                             "THROTTLE_RATES": {"ip": "1/min", "account": "1/min"}})
+  def test_command_runs_without_throttling(self):
+    """
+    スロットルの設定があっても、ハッシュが必要なエンドポイントは429にならない
+    """
+    output = StringIO()
+    call_command("benchmark", "endpoints", iterations=3, users=5, urls=["login", "signup", "token_obtain_pair"],
+                 stdout=output)
+    self.assertNotIn("429", output.getvalue())
+    self.assertEqual(output.getvalue().count("errors=0"), 3)
+
+  def test_command_fails_on_error_responses(self):
+    """
+    エラーの応答を返したケースがあれば、ベースラインを書き出さずに失敗する
+    """
+    with tempfile.TemporaryDirectory() as directory:
+      path = os.path.join(directory, "baseline.json")
+      with mock.patch.dict(BENCHMARKS, {"broken": lambda **options: [{"case": "login", "errors": 2}]}):
+        with self.assertRaisesMessage(CommandError, "broken/login"):
+          call_command("benchmark", "broken", output=path, stdout=StringIO())
+      self.assertFalse(os.path.exists(path))
+
+
+class UserBenchmarkTransactionTests(TransactionTestCase):
+
+  def test_async_views_responses_succeed(self):
+    """
+    async_viewsのログインとログアウトは、続けて送っても全てのリクエストが成功する
+    (ログインのクッキーを持ち越さず、ログアウトは毎回新しいトークンを使う)
+    """
+    with unthrottled():
+      rows = async_views(iterations=32)
+    self.assertEqual([row["case"] for row in rows], ["login", "logout"])
+    for row in rows:
+      self.assertEqual(row["errors"], 0, row)
+      self.assertEqual(row["status"], "201" if row["case"] == "login" else "200")
@@ -0,0 +1,133 @@
+import io
+import json
+import os
+import tempfile
+from unittest import mock
+from django.conf import settings
+from django.core.management import call_command
+from django.db import connections
+from django.test import TestCase, override_settings
+from ..models import User
+from ..routers import PrimaryReplicaRouter
+
+def create_default_user(user_name="Test User",
+                       email="example@example.com",
+                       password="password"):
+  """
+  パラメータのユーザーを作成する
+  """
+  user= User.objects.create_user(user_name=user_name,
+                                       email=email,
+                                       password=password)
+  return user
+
+@override_settings(LOGINS={**settings.LOGINS, "PBKDF2_ITERATIONS": 1000})
+class UserBulkTests(TestCase):
+
+  def write_file(self, content, suffix):
+    """
+    一時ファイルにcontentを書き込んでパスを返す
+    """
+    fd, path = tempfile.mkstemp(suffix=suffix)
+    with os.fdopen(fd, "w") as f:
+      f.write(content)
+    self.addCleanup(os.remove, path)
+    return path
+
+  def import_users(self, path, **options):
+    stdout, stderr = io.StringIO(), io.StringIO()
+    call_command("import_users", path, processes=1, stdout=stdout, stderr=stderr, **options)
+    return stdout.getvalue(), stderr.getvalue()
+
+  def test_import_users_from_csv(self):
+    """
+    CSVからユーザーが登録され、平文のパスワードはハッシュされる
+    """
+    path = self.write_file("user_name,email,password\n"
+                           "user1,user1@EXAMPLE.com,password1\n"
+                           "user2,user2@example.com,password2\n", ".csv")
+    stdout, _ = self.import_users(path, batch_size=1)
+    self.assertIn("created 2 users", stdout)
+    user = User.objects.get(user_name="user1")
+    self.assertEqual(user.email, "user1@example.com")
+    self.assertTrue(user.check_password("password1"))
+
+  def test_import_users_keeps_hashed_passwords(self):
+    """
+    Djangoのハッシュ形式のパスワードはそのまま登録される
+    """
+    hashed = create_default_user().password
+    path = self.write_file(json.dumps({"user_name": "user1",
+                                       "email": "user1@example.com",
+                                       "password": hashed}) + "\n", ".jsonl")
+    self.import_users(path)
+    self.assertEqual(User.objects.get(user_name="user1").password, hashed)
+
+  def test_import_users_skips_conflicts(self):
+    """
+    DBやファイル内でuser_name、emailが重複したユーザーは登録されない
+    重複の検査はフィールド毎に1回のクエリで行われる
+    """
+    create_default_user()
+    path = self.write_file("user_name,email,password\n"
+                           "Test User,new@example.com,password\n"
+                           "new_user,example@example.com,password\n"
+                           "user1,user1@example.com,password\n"
+                           "user1,user1_2@example.com,password\n"
+                           "a_very_long_user_name,user2@example.com,password\n", ".csv")
+    with self.assertNumQueries(5): # user_name, email, SAVEPOINT, INSERT, RELEASE
+      stdout, stderr = self.import_users(path)
+    self.assertIn("created 1 users, skipped 4", stdout)
+    self.assertIn("line 1: conflict: user_name", stderr)
+    self.assertIn("line 2: conflict: email", stderr)
+    self.assertIn("line 5: invalid: user_name", stderr)
+    self.assertEqual(User.objects.count(), 2)
+
+  def test_import_users_skips_racing_inserts(self):
+    """
+    重複の検査の後に他のプロセスが登録した行は、インポートを止めずにその行だけ飛ばす
+    """
+    path = self.write_file("user_name,email,password\n"
+                           "user1,user1@example.com,password\n"
+                           "user2,user2@example.com,password\n"
+                           "user3,user3@example.com,password\n", ".csv")
+    find_conflicts = User.objects.find_conflicts
+
+    def racing_find_conflicts(*args, **kwargs):
+      taken = find_conflicts(*args, **kwargs)
+      if not User.objects.filter(user_name="racer").exists():
+        create_default_user(user_name="racer", email="user2@example.com")
+      return taken
+
+    with mock.patch.object(User.objects, "find_conflicts", racing_find_conflicts):
+      stdout, stderr = self.import_users(path, batch_size=2)
+    self.assertIn("created 2 users, skipped 1", stdout)
+    self.assertIn("line 2: conflict: email user2@example.com", stderr)
+    self.assertEqual(sorted(User.objects.values_list("user_name", flat=True)), ["racer", "user1", "user3"])
+
+  def test_bulk_create_users_fills_ids_from_primary(self):
+    """
+    主キーが返らないDBでも、主キーは書き込んだDBから読んで埋める (レプリカは遅れていることがある)
+    """
+    users = [User(user_name="user%d" % n, email="user%d@example.com" % n) for n in range(3)]
+    # テストはトランザクションの中なので、リクエストとトランザクションの外と同じくルーターがレプリカを返すようにする
+    # このテストはreplicaへの接続を許していないので、レプリカから読むと失敗する
+    with mock.patch.object(PrimaryReplicaRouter, "db_for_read", return_value="replica"), \
+         mock.patch.object(type(connections["default"].features), "can_return_rows_from_bulk_insert", False):
+      users = User.objects.bulk_create_users(users)
+    self.assertEqual([user.pk for user in users],
+                     [User.objects.get(email=user.email).pk for user in users])
+
+  def test_export_and_import_users(self):
+    """
+    export_usersで書き出したファイルをimport_usersで読み込むと同じユーザーが登録される
+    """
+    create_default_user()
+    create_default_user(user_name="another_user", email="anotheremail@example.com")
+    for suffix in (".csv", ".jsonl"):
+      path = self.write_file("", suffix)
+      call_command("export_users", path, chunk_size=1, stdout=io.StringIO())
+      exported = list(User.objects.order_by("id").values_list("user_name", "email", "password"))
+      User.objects.all().delete()
+      self.import_users(path)
+      self.assertEqual(list(User.objects.order_by("id").values_list("user_name", "email", "password")), exported)
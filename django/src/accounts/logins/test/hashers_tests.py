@@ -0,0 +1,91 @@
+from django.conf import settings
+from django.contrib.auth.hashers import identify_hasher
+from django.core.cache import cache
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from ..models import User
+from ..throttling import buckets
+
+def logins_settings(**kwargs):
+  """
+  settings.LOGINS の一部を上書きした辞書を返す
+  """
+  return {**settings.LOGINS, **kwargs}
+
+def create_default_user(user_name="Test User",
+                       email="example@example.com",
+                       password="password"):
+  """
+  パラメータのユーザーを作成する
+  """
+  user= User.objects.create_user(user_name=user_name,
+                                       email=email,
+                                       password=password)
+  return user
+
+class UserHashersTests(TestCase):
+
+  def setUp(self):
+    cache.clear()
+    buckets.reset()
+
+  def login(self, password="password"):
+    # ログイン済みのクッキーがあるとログインできないので、毎回ログアウトした状態にする
+    self.client.cookies.clear()
+    return self.client.post(reverse("logins:login"),
+                            { "email": "example@example.com",
+                              "password": password},
+                            content_type="application/json")
+
+  @override_settings(LOGINS=logins_settings(PBKDF2_ITERATIONS=1000))
+  def test_password_is_hashed_with_configured_cost(self):
+    """
+    パスワードはsettings.LOGINSで設定したコストでハッシュされる
+    """
+    test_user = create_default_user()
+    self.assertTrue(test_user.password.startswith("pbkdf2_sha256$1000$"))
+
+  def test_password_is_rehashed_on_login_when_cost_is_raised(self):
+    """
+    コストを上げた後にログインすると、新しいコストで再ハッシュされる
+    """
+    with override_settings(LOGINS=logins_settings(PBKDF2_ITERATIONS=1000)):
+      create_default_user()
+    with override_settings(LOGINS=logins_settings(PBKDF2_ITERATIONS=2000)):
+      self.assertEqual(self.login().status_code, 201)
+    test_user = User.objects.get(email="example@example.com")
+    self.assertTrue(test_user.password.startswith("pbkdf2_sha256$2000$"))
+
+  def test_password_is_rehashed_on_login_when_cost_is_lowered(self):
+    """
+    コストを下げた後にログインすると、新しいコストで再ハッシュされる
+    """
+    with override_settings(LOGINS=logins_settings(PBKDF2_ITERATIONS=2000)):
+      create_default_user()
+    with override_settings(LOGINS=logins_settings(PBKDF2_ITERATIONS=1000)):
+      self.assertEqual(self.login().status_code, 201)
+    test_user = User.objects.get(email="example@example.com")
+    self.assertTrue(test_user.password.startswith("pbkdf2_sha256$1000$"))
+
+  def test_password_is_rehashed_on_login_when_algorithm_is_changed(self):
+    """
+    アルゴリズムを変えた後にログインすると、新しいアルゴリズムで再ハッシュされる
+    """
+    with override_settings(LOGINS=logins_settings(PBKDF2_ITERATIONS=1000)):
+      create_default_user()
+    with override_settings(LOGINS=logins_settings(PASSWORD_ALGORITHM="scrypt", SCRYPT_WORK_FACTOR=2**10),
+                           PASSWORD_HASHERS=["logins.hashers.ScryptPasswordHasher",
+                                             "logins.hashers.PBKDF2PasswordHasher"]):
+      self.assertEqual(self.login().status_code, 201)
+      test_user = User.objects.get(email="example@example.com")
+      self.assertEqual(identify_hasher(test_user.password).algorithm, "scrypt")
+
+  @override_settings(LOGINS=logins_settings(PBKDF2_ITERATIONS=1000))
+  def test_password_is_not_rehashed_on_failed_login(self):
+    """
+    ログインに失敗した時は再ハッシュされない
+    """
+    with override_settings(LOGINS=logins_settings(PBKDF2_ITERATIONS=2000)):
+      old_password = create_default_user().password
+    self.assertEqual(self.login("invalid_password").status_code, 401)
+    self.assertEqual(User.objects.get(email="example@example.com").password, old_password)
@@ -0,0 +1,102 @@
+import threading
+import time
+from django.conf import settings
+from django.core.cache import cache
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from ..models import User
+from ..hashpool import HashPoolSaturated, hash_pool
+from ..throttling import buckets
+
+def logins_settings(**kwargs):
+  """
+  settings.LOGINS の一部を上書きした辞書を返す
+  """
+  return {**settings.LOGINS, "PBKDF2_ITERATIONS": 1000, **kwargs}
+
+def create_default_user(user_name="Test User",
+                       email="example@example.com",
+                       password="password"):
+  """
+  パラメータのユーザーを作成する
+  """
+  user= User.objects.create_user(user_name=user_name,
+                                       email=email,
+                                       password=password)
+  return user
+
+@override_settings(LOGINS=logins_settings(HASH_POOL=True, HASH_POOL_WORKERS=2, HASH_POOL_MAX_QUEUE=0))
+class UserHashPoolTests(TestCase):
+
+  def setUp(self):
+    cache.clear()
+    buckets.reset()
+
+  def login(self, password="password"):
+    # ログイン済みのクッキーがあるとログインできないので、毎回ログアウトした状態にする
+    self.client.cookies.clear()
+    return self.client.post(reverse("logins:login"),
+                            { "email": "example@example.com",
+                              "password": password},
+                            content_type="application/json")
+
+  def test_login_with_hash_pool(self):
+    """
+    プールが有効な時もログインでき、ハッシュの時間がServer-Timingで返ってくる
+    """
+    create_default_user()
+    response = self.login()
+    self.assertEqual(response.status_code, 201)
+    self.assertIn("hash;dur=", response["Server-Timing"])
+    self.assertEqual(self.login("invalid_password").status_code, 401)
+
+  def test_signup_with_hash_pool(self):
+    """
+    プールが有効な時もユーザー登録でき、パスワードがハッシュされている
+    """
+    response = self.client.post(reverse("logins:signup"),
+                                { "user_name": "Test User",
+                                  "email": "example@example.com",
+                                  "password": "password"},
+                                content_type="application/json")
+    self.assertEqual(response.status_code, 201)
+    self.assertTrue(User.objects.get(email="example@example.com").check_password("password"))
+
+  def test_login_when_hash_pool_is_saturated(self):
+    """
+    プールが詰まっている時は503とRetry-Afterが返ってくる
+    """
+    create_default_user()
+    release = threading.Event()
+    threads = [threading.Thread(target=hash_pool.run, args=(release.wait,)) for _ in range(2)]
+    for thread in threads:
+      thread.start()
+    try:
+      while hash_pool.pending < 2:
+        time.sleep(0.01)
+      response = self.login()
+    finally:
+      release.set()
+      for thread in threads:
+        thread.join()
+    self.assertEqual(response.status_code, 503)
+    self.assertEqual(response["Retry-After"], "1")
+    self.assertEqual(hash_pool.pending, 0)
+
+  @override_settings(LOGINS=logins_settings(HASH_POOL=True, HASH_POOL_WORKERS=1, HASH_POOL_MAX_QUEUE=0,
+                                            HASH_POOL_TIMEOUT=0.05))
+  def test_timed_out_hash_is_pending_until_finished(self):
+    """
+    タイムアウトしても実行中のハッシュは止まらないので、終わるまでプールの枠を空けない
+    """
+    release = threading.Event()
+    with self.assertRaises(HashPoolSaturated):
+      hash_pool.run(release.wait)
+    self.assertEqual(hash_pool.pending, 1)
+    with self.assertRaises(HashPoolSaturated):
+      hash_pool.make_password("password")
+    release.set()
+    # 実行中のハッシュが終わるのを待つ
+    hash_pool.shutdown()
+    self.assertEqual(hash_pool.pending, 0)
+    self.assertTrue(hash_pool.make_password("password"))
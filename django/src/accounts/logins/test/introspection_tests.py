@@ -0,0 +1,91 @@
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from ..models import User
+from ..revocation import revocation_list
+from ..tokens import AccessToken
+from ..utils import get_jwt
+
+def create_default_user(user_name="Test User",
+                       email="example@example.com",
+                       password="password"):
+  """
+  パラメータのユーザーを作成する
+  """
+  user= User.objects.create_user(user_name=user_name,
+                                       email=email,
+                                       password=password)
+  return user
+
+@override_settings(LOGINS={**settings.LOGINS, "PBKDF2_ITERATIONS": 1000})
+class UserIntrospectionTests(TestCase):
+
+  def setUp(self):
+    cache.clear()
+    revocation_list.reset()
+
+  def introspect(self, tokens):
+    return self.client.post(reverse("logins:token_introspect"), {"tokens": tokens},
+                            content_type="application/json")
+
+  def test_introspect_tokens(self):
+    """
+    トークン毎に有効か、失効しているか、クレームが同じ順番で返ってくる
+    """
+    test_user = create_default_user()
+    jwt_dict = get_jwt(test_user)
+    revoked = get_jwt(test_user)["access"]
+    AccessToken(revoked).revoke()
+    response = self.introspect([jwt_dict["access"], "invalid", revoked, jwt_dict["refresh"]])
+    self.assertEqual(response.status_code, 200)
+    results = response.json()["results"]
+    self.assertEqual([result["active"] for result in results], [True, False, False, True])
+    self.assertEqual(results[0]["claims"]["user_id"], str(test_user.pk))
+    self.assertEqual(results[0]["claims"]["token_type"], "access")
+    self.assertIsNone(results[1]["claims"])
+    self.assertTrue(results[2]["revoked"])
+    self.assertEqual(results[2]["error"], "Token is revoked")
+    self.assertEqual(results[3]["claims"]["token_type"], "refresh")
+
+  def test_introspect_users_in_one_query(self):
+    """
+    ユーザーは1回のクエリで取得され、同じトークンは同じ結果になる
+    存在しないユーザーと無効なユーザーのトークンはactiveがFalse
+    """
+    users = [create_default_user(user_name="user%d" % n, email="user%d@example.com" % n) for n in range(3)]
+    tokens = [get_jwt(user)["access"] for user in users]
+    inactive_user = create_default_user(user_name="inactive", email="inactive@example.com")
+    inactive_token = get_jwt(inactive_user)["access"]
+    User.objects.filter(pk=inactive_user.pk).update(is_active=False)
+    deleted_user = create_default_user(user_name="deleted", email="deleted@example.com")
+    deleted_token = get_jwt(deleted_user)["access"]
+    deleted_user.delete()
+    with CaptureQueriesContext(connection) as queries:
+      response = self.introspect(tokens + tokens + [inactive_token, deleted_token])
+    self.assertEqual(len(queries), 1)
+    results = response.json()["results"]
+    self.assertTrue(all(result["active"] for result in results[:6]))
+    self.assertEqual(results[0], results[3])
+    self.assertEqual(results[6]["error"], "User is inactive")
+    self.assertEqual(results[7]["error"], "User not found")
+
+  def test_introspect_invalid_request(self):
+    """
+    tokensが文字列の配列でないか、多すぎる場合は400が返ってくる
+    """
+    self.assertEqual(self.introspect("token").status_code, 400)
+    self.assertEqual(self.introspect([{"token": "a"}]).status_code, 400)
+    with override_settings(LOGINS={**settings.LOGINS, "BATCH_MAX_SIZE": 2}):
+      self.assertEqual(self.introspect(["a", "b", "c"]).status_code, 400)
+
+  def test_introspect_empty(self):
+    """
+    空の配列には空の結果が返ってくる
+    """
+    with CaptureQueriesContext(connection) as queries:
+      response = self.introspect([])
+    self.assertEqual(response.json(), {"results": []})
+    self.assertEqual(len(queries), 0)
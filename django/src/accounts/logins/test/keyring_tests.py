@@ -0,0 +1,192 @@
+import base64
+import json
+from unittest import mock
+import jwt
+from cryptography.hazmat.primitives import serialization
+from cryptography.hazmat.primitives.asymmetric import ed25519, rsa
+from django.conf import settings
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from rest_framework_simplejwt.exceptions import TokenError
+from rest_framework_simplejwt.tokens import AccessToken as SimpleAccessToken
+from ..models import User
+from ..tokens import AccessToken
+from ..utils import get_jwt
+from ..verifier import JWKSVerifier
+
+def create_default_user(user_name="Test User",
+                       email="example@example.com",
+                       password="password"):
+  """
+  パラメータのユーザーを作成する
+  """
+  user= User.objects.create_user(user_name=user_name,
+                                       email=email,
+                                       password=password)
+  return user
+
+def pem(private_key):
+  return private_key.private_bytes(serialization.Encoding.PEM, serialization.PrivateFormat.PKCS8,
+                                   serialization.NoEncryption()).decode()
+
+def logins_settings(**kwargs):
+  return override_settings(LOGINS={**settings.LOGINS, "PBKDF2_ITERATIONS": 1000, **kwargs})
+
+def oct_jwk(kid, secret):
+  """
+  対称鍵のJWK (cryptographyが無くても検証できる)
+  """
+  k = base64.urlsafe_b64encode(secret.encode()).rstrip(b"=").decode()
+  return {"kty": "oct", "kid": kid, "alg": "HS256", "k": k}
+
+OLD_KEY = {"kid": "old", "algorithm": "HS256", "private_key": "old-secret-key-for-tests-0123456789"}
+NEW_KEY = {"kid": "new", "algorithm": "HS256", "private_key": "new-secret-key-for-tests-0123456789"}
+SECRET_A = "verifier-secret-a-for-tests-0123456789"
+SECRET_B = "verifier-secret-b-for-tests-0123456789"
+WRONG_SECRET = "verifier-wrong-secret-for-tests-012345"
+
+@logins_settings()
+class UserKeyringTests(TestCase):
+
+  def test_token_has_kid(self):
+    """
+    SIGNING_KEYSを設定すると、先頭の鍵のkidがヘッダーに入る
+    """
+    test_user = create_default_user()
+    with logins_settings(SIGNING_KEYS=[NEW_KEY, OLD_KEY]):
+      access = get_jwt(test_user)["access"]
+      self.assertEqual(jwt.get_unverified_header(access)["kid"], "new")
+      self.assertEqual(AccessToken(access)["user_id"], str(test_user.pk))
+
+  def test_rotation(self):
+    """
+    新しい鍵を先頭に追加しても、古い鍵で署名したトークンは検証できる
+    古い鍵を取り除くと検証できなくなる
+    """
+    test_user = create_default_user()
+    with logins_settings(SIGNING_KEYS=[OLD_KEY]):
+      access = get_jwt(test_user)["access"]
+    with logins_settings(SIGNING_KEYS=[NEW_KEY, OLD_KEY]):
+      AccessToken(access)
+    with logins_settings(SIGNING_KEYS=[NEW_KEY]):
+      with self.assertRaises(TokenError):
+        AccessToken(access)
+
+  def test_legacy_token(self):
+    """
+    kidの無いトークンはSIGNING_ACCEPT_LEGACYの時だけSIMPLE_JWTの鍵で検証する
+    """
+    test_user = create_default_user()
+    access = str(SimpleAccessToken.for_user(test_user))
+    with logins_settings(SIGNING_KEYS=[NEW_KEY]):
+      AccessToken(access)
+    with logins_settings(SIGNING_KEYS=[NEW_KEY], SIGNING_ACCEPT_LEGACY=False):
+      with self.assertRaises(TokenError):
+        AccessToken(access)
+
+  def test_authenticated_request_with_keyring(self):
+    """
+    キーリングで署名したトークンで認証できる
+    """
+    test_user = create_default_user()
+    with logins_settings(SIGNING_KEYS=[NEW_KEY]):
+      response = self.client.patch(reverse("logins:update", kwargs={"pk": test_user.pk}),
+                                   {"user_name": "Test User2"},
+                                   content_type="application/json",
+                                   headers={"Authorization": "JWT "+get_jwt(test_user)["access"]})
+    self.assertEqual(response.status_code, 200)
+
+  def test_jwks_view(self):
+    """
+    jwksはキャッシュできるヘッダーを返し、ETagが一致すれば304を返す
+    対称鍵は公開しない
+    """
+    with logins_settings(SIGNING_KEYS=[NEW_KEY]):
+      response = self.client.get(reverse("logins:jwks"))
+      self.assertEqual(response.status_code, 200)
+      self.assertEqual(response.json(), {"keys": []})
+      self.assertIn("max-age=", response["Cache-Control"])
+      response = self.client.get(reverse("logins:jwks"), headers={"If-None-Match": response["ETag"]})
+      self.assertEqual(response.status_code, 304)
+
+  def assert_verified_with_jwks(self, kid, algorithm, private_key):
+    """
+    algorithmで署名したトークンを、jwksの公開鍵を使ってverifierで検証できる
+    """
+    test_user = create_default_user()
+    with logins_settings(SIGNING_KEYS=[{"kid": kid, "algorithm": algorithm, "private_key": private_key}]):
+      access = get_jwt(test_user)["access"]
+      response = self.client.get(reverse("logins:jwks"))
+    jwk = response.json()["keys"][0]
+    self.assertEqual((jwk["kid"], jwk["alg"]), (kid, algorithm))
+    self.assertNotIn("d", jwk)
+    verifier = JWKSVerifier("http://testserver/.well-known/jwks.json")
+    with mock.patch.object(verifier, "_request", return_value=(200, response.headers, response.content)):
+      self.assertEqual(verifier.verify(access)["user_id"], str(test_user.pk))
+
+  def test_rs256_and_verifier(self):
+    """
+    RS256の鍵で署名し、公開鍵で検証できる
+    """
+    private_key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+    self.assert_verified_with_jwks("rsa", "RS256", pem(private_key))
+
+  def test_eddsa_and_verifier(self):
+    """
+    EdDSA(Ed25519)の鍵で署名し、公開鍵で検証できる
+    """
+    self.assert_verified_with_jwks("ed", "EdDSA", pem(ed25519.Ed25519PrivateKey.generate()))
+
+class UserVerifierTests(TestCase):
+
+  def make_token(self, kid, secret, **claims):
+    return jwt.encode({"user_id": "1", "token_type": "access", **claims}, secret,
+                      algorithm="HS256", headers={"kid": kid})
+
+  def jwks_response(self, *keys, etag='"v1"'):
+    return 200, {"ETag": etag, "Cache-Control": "public, max-age=3600"}, json.dumps({"keys": list(keys)}).encode()
+
+  def test_verify_with_cached_keys(self):
+    """
+    鍵は1度だけ取得され、2回目以降の検証でリクエストしない
+    """
+    verifier = JWKSVerifier("http://example.com/jwks", algorithms=("HS256",))
+    with mock.patch.object(verifier, "_request", return_value=self.jwks_response(oct_jwk("a", SECRET_A))) as request:
+      for _ in range(3):
+        self.assertEqual(verifier.verify(self.make_token("a", SECRET_A))["user_id"], "1")
+    self.assertEqual(request.call_count, 1)
+
+  def test_unknown_kid_refetches(self):
+    """
+    知らないkidのトークンが来たら鍵を取得し直す
+    """
+    verifier = JWKSVerifier("http://example.com/jwks", algorithms=("HS256",), min_refresh_interval=0)
+    responses = [self.jwks_response(oct_jwk("a", SECRET_A)),
+                 self.jwks_response(oct_jwk("b", SECRET_B), oct_jwk("a", SECRET_A), etag='"v2"')]
+    with mock.patch.object(verifier, "_request", side_effect=responses):
+      verifier.verify(self.make_token("a", SECRET_A))
+      self.assertEqual(verifier.verify(self.make_token("b", SECRET_B))["user_id"], "1")
+
+  def test_not_modified_keeps_keys(self):
+    """
+    304の時はETagを送り、キャッシュしている鍵を使い続ける
+    """
+    verifier = JWKSVerifier("http://example.com/jwks", algorithms=("HS256",))
+    with mock.patch.object(verifier, "_request", return_value=self.jwks_response(oct_jwk("a", SECRET_A))):
+      verifier.refresh()
+    with mock.patch.object(verifier, "_request", return_value=(304, {"Cache-Control": "max-age=60"}, b"")) as request:
+      verifier.refresh()
+      verifier.verify(self.make_token("a", SECRET_A))
+    self.assertEqual(request.call_args[0][0]["If-None-Match"], '"v1"')
+
+  def test_invalid_tokens(self):
+    """
+    署名が違うトークン、知らないkid、アクセストークン以外は無効
+    """
+    verifier = JWKSVerifier("http://example.com/jwks", algorithms=("HS256",))
+    with mock.patch.object(verifier, "_request", return_value=self.jwks_response(oct_jwk("a", SECRET_A))):
+      for token in (self.make_token("a", WRONG_SECRET),
+                    self.make_token("unknown", SECRET_A),
+                    self.make_token("a", SECRET_A, token_type="refresh")):
+        with self.assertRaises(jwt.InvalidTokenError):
+          verifier.verify(token)
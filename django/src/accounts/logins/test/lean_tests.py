@@ -0,0 +1,93 @@
+from django.apps import apps
+from django.core.management import call_command
+from django.http import HttpResponse
+from django.test import RequestFactory, SimpleTestCase
+from django.urls import reverse
+from io import StringIO
+from .. import browser
+from ..benchmarks.middleware import DJANGO_MIDDLEWARE, handler
+
+def get_response(request):
+  return HttpResponse("ok")
+
+async def aget_response(request):
+  return HttpResponse("ok")
+
+class UserLeanMiddlewareTests(SimpleTestCase):
+
+  def setUp(self):
+    self.factory = RequestFactory()
+
+  def test_is_api_request(self):
+    """
+    LOGINS["API_PATH_PREFIXES"] のパスだけがAPIのリクエストになる
+    """
+    self.assertTrue(browser.is_api_request(self.factory.get("/api/token/")))
+    self.assertTrue(browser.is_api_request(self.factory.get("/.well-known/jwks.json")))
+    self.assertFalse(browser.is_api_request(self.factory.get("/admin/login/")))
+
+  def test_api_request_skips_session(self):
+    """
+    APIのリクエストにはセッションもユーザーも付けず、それ以外には付ける
+    """
+    for path, attached in (("/api/", False), ("/admin/", True)):
+      request = self.factory.get(path)
+      browser.SessionMiddleware(browser.AuthenticationMiddleware(get_response))(request)
+      self.assertEqual(hasattr(request, "session"), attached)
+      self.assertEqual(hasattr(request, "user"), attached)
+
+  def test_api_request_skips_csrf(self):
+    """
+    APIへのPOSTはCSRFトークンが無くても通し、それ以外は403にする
+    """
+    middleware = browser.CsrfViewMiddleware(get_response)
+    request = self.factory.post("/api/signup/")
+    self.assertIsNone(middleware.process_view(request, get_response, (), {}))
+    request = self.factory.post("/admin/login/")
+    self.assertEqual(middleware.process_view(request, get_response, (), {}).status_code, 403)
+
+  def test_api_response_has_no_frame_options(self):
+    """
+    APIのレスポンスにはX-Frame-Optionsを付けず、それ以外には付ける
+    """
+    middleware = browser.XFrameOptionsMiddleware(get_response)
+    self.assertNotIn("X-Frame-Options", middleware(self.factory.get("/.well-known/jwks.json")))
+    self.assertEqual(middleware(self.factory.get("/admin/login/"))["X-Frame-Options"], "DENY")
+
+  async def test_async_api_request(self):
+    """
+    非同期でもAPIのリクエストはそのまま次に渡す
+    """
+    middleware = browser.SessionMiddleware(browser.MessageMiddleware(aget_response))
+    request = self.factory.get("/api/")
+    response = await middleware(request)
+    self.assertEqual(response.status_code, 200)
+    self.assertFalse(hasattr(request, "session"))
+    request = self.factory.get("/admin/")
+    await middleware(request)
+    self.assertTrue(hasattr(request, "session"))
+
+  def test_admin_keeps_full_stack(self):
+    """
+    管理サイトはこれまで通り使え、システムチェックも通る
+    """
+    if not apps.is_installed("django.contrib.admin"):
+      self.skipTest("LOGINS_API_ONLY")
+    response = self.client.get(reverse("admin:login"))
+    self.assertEqual(response.status_code, 200)
+    self.assertEqual(response["X-Frame-Options"], "DENY")
+    self.assertIn("csrfmiddlewaretoken", response.content.decode())
+    call_command("check", stdout=StringIO())
+
+  def test_full_stack_handler(self):
+    """
+    ベンチマークの比較に使う元のDjangoのミドルウェアでもAPIに同じレスポンスが返る
+    """
+    full_stack = handler(list(DJANGO_MIDDLEWARE.values()))
+    lean = handler(list(DJANGO_MIDDLEWARE))
+    path = reverse("logins:jwks")
+    full_response = full_stack.get_response(self.factory.get(path))
+    lean_response = lean.get_response(self.factory.get(path))
+    self.assertEqual(full_response.content, lean_response.content)
+    self.assertIn("X-Frame-Options", full_response)
+    self.assertNotIn("X-Frame-Options", lean_response)
@@ -0,0 +1,125 @@
+import os
+import tempfile
+from django.conf import settings
+from django.core.cache import cache
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from .. import metrics
+from ..models import User
+from ..utils import get_jwt
+from ..throttling import buckets
+
+def create_default_user(user_name="Test User",
+                       email="example@example.com",
+                       password="password"):
+  """
+  パラメータのユーザーを作成する
+  """
+  user= User.objects.create_user(user_name=user_name,
+                                       email=email,
+                                       password=password)
+  return user
+
+def series(name, *labels):
+  """
+  このプロセスのヒストグラムの [境界毎の回数..., 合計, 回数]
+  """
+  return metrics.registry.metrics[name].series.get(labels)
+
+@override_settings(LOGINS={**settings.LOGINS, "PBKDF2_ITERATIONS": 1000})
+class UserMetricsTests(TestCase):
+
+  def setUp(self):
+    cache.clear()
+    buckets.reset()
+    metrics.registry.reset()
+
+  def test_request_metrics(self):
+    """
+    URL名毎にレイテンシとクエリの回数が記録される
+    """
+    create_default_user()
+    self.client.get(reverse("logins:index"))
+    duration = series("logins_http_request_duration_seconds", "logins:index", "GET", "200")
+    self.assertEqual(duration[-1], 1)
+    queries = series("logins_http_request_queries", "logins:index")
+    self.assertGreaterEqual(queries[-2], 1)
+    self.assertEqual(series("logins_http_request_db_seconds", "logins:index")[-1], 1)
+
+  def test_unmatched_request(self):
+    """
+    URLにマッチしないリクエストはunmatchedにまとめられる
+    """
+    self.client.get("/not-found/")
+    self.assertEqual(series("logins_http_request_duration_seconds", "unmatched", "GET", "404")[-1], 1)
+
+  def test_hash_and_token_metrics(self):
+    """
+    ログインでパスワードのハッシュ、トークンの署名の時間が記録され、
+    認証でトークンの検証の時間が記録される
+    """
+    test_user = create_default_user()
+    metrics.registry.reset()
+    self.client.post(reverse("logins:login"), {"email": "example@example.com", "password": "password"})
+    self.assertEqual(series("logins_password_hash_seconds")[-1], 1)
+    self.assertEqual(series("logins_token_sign_seconds")[-1], 1)
+    self.client.patch(reverse("logins:update", kwargs={"pk": test_user.pk}), {"user_name": "Test User2"},
+                      content_type="application/json",
+                      headers={"Authorization": "JWT "+get_jwt(test_user)["access"]})
+    self.assertEqual(series("logins_token_verify_seconds")[-1], 1)
+
+  def test_metrics_view(self):
+    """
+    metricsはPrometheusのテキスト形式で、累積のバケットを返す
+    """
+    self.client.get(reverse("logins:index"))
+    response = self.client.get(reverse("logins:metrics"))
+    self.assertEqual(response.status_code, 200)
+    self.assertTrue(response["Content-Type"].startswith("text/plain"))
+    body = response.content.decode()
+    self.assertIn("# TYPE logins_http_request_duration_seconds histogram", body)
+    self.assertIn('logins_http_request_duration_seconds_bucket{view="logins:index",method="GET",status="200",le="+Inf"} 1', body)
+    self.assertIn('logins_http_request_duration_seconds_count{view="logins:index",method="GET",status="200"} 1', body)
+
+  def test_metrics_view_is_restricted(self):
+    """
+    METRICS_ALLOWED_IPS 以外のアドレスには、METRICS_TOKEN を送らなければ403を返す
+    X-Forwarded-For でアドレスを偽っても通らない
+    """
+    url = reverse("logins:metrics")
+    self.assertEqual(self.client.get(url, REMOTE_ADDR="192.0.2.1").status_code, 403)
+    self.assertEqual(self.client.get(url, REMOTE_ADDR="192.0.2.1",
+                                     HTTP_X_FORWARDED_FOR="127.0.0.1").status_code, 403)
+    with override_settings(LOGINS={**settings.LOGINS, "METRICS_ALLOWED_IPS": ["192.0.2.0/24"]}):
+      self.assertEqual(self.client.get(url, REMOTE_ADDR="192.0.2.1").status_code, 200)
+      self.assertEqual(self.client.get(url).status_code, 403)
+    with override_settings(LOGINS={**settings.LOGINS, "METRICS_TOKEN": "secret"}):
+      self.assertEqual(self.client.get(url, REMOTE_ADDR="192.0.2.1",
+                                       headers={"Authorization": "Bearer secret"}).status_code, 200)
+      self.assertEqual(self.client.get(url, REMOTE_ADDR="192.0.2.1",
+                                       headers={"Authorization": "Bearer wrong"}).status_code, 403)
+
+  def test_metrics_disabled(self):
+    """
+    METRICSがFalseなら記録せず、metricsは404を返す
+    """
+    with override_settings(LOGINS={**settings.LOGINS, "METRICS": False}):
+      self.client.get(reverse("logins:index"))
+      self.assertEqual(self.client.get(reverse("logins:metrics")).status_code, 404)
+    self.assertIsNone(series("logins_http_request_duration_seconds", "logins:index", "GET", "200"))
+
+  def test_collect_across_processes(self):
+    """
+    他のプロセスのスナップショットと足し合わせる
+    """
+    with tempfile.TemporaryDirectory() as directory:
+      with override_settings(LOGINS={**settings.LOGINS, "METRICS_DIR": directory}):
+        metrics.hash_duration.observe(0.2)
+        metrics.registry.flush()
+        # 別のプロセスのファイルにする
+        os.rename(metrics.registry.path(), os.path.join(directory, "0.json"))
+        metrics.hash_duration.observe(0.3)
+        merged = metrics.registry.collect()
+    values = merged["logins_password_hash_seconds"]["series"][()]
+    self.assertEqual(values[-1], 3)
+    self.assertAlmostEqual(values[-2], 0.7)
@@ -0,0 +1,292 @@
+import datetime
+import threading
+import time
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import cache
+from django.test import Client, TestCase, override_settings
+from django.urls import reverse
+from rest_framework_simplejwt.exceptions import TokenError
+from .. import refresh
+from ..models import User
+from ..revocation import revocation_list
+from ..tokens import RefreshToken
+
+def create_default_user(user_name="Test User",
+                       email="example@example.com",
+                       password="password"):
+  """
+  パラメータのユーザーを作成する
+  """
+  user= User.objects.create_user(user_name=user_name,
+                                       email=email,
+                                       password=password)
+  return user
+
+def create_tokens(user, access_seconds=None):
+  """
+  リフレッシュトークンと、有効期限をaccess_seconds秒後にしたアクセストークンを作る
+  """
+  refresh_token = RefreshToken.for_user(user)
+  access_token = refresh_token.access_token
+  if access_seconds is not None:
+    access_token.set_exp(lifetime=datetime.timedelta(seconds=access_seconds))
+  return str(refresh_token), str(access_token)
+
+@override_settings(LOGINS={**settings.LOGINS, "PBKDF2_ITERATIONS": 1000})
+class UserCookieAuthenticationTests(TestCase):
+
+  def setUp(self):
+    cache.clear()
+    revocation_list.reset()
+
+  def test_login_cookie_authenticates(self):
+    """
+    ログインでセットされたクッキーだけで認証が必要なビューにアクセスできる
+    """
+    test_user = create_default_user()
+    response = self.client.post(reverse("logins:login"),
+                                { "email": "example@example.com",
+                                  "password": "password"},
+                                content_type="application/json")
+    self.assertEqual(response.status_code, 201)
+    response = self.client.patch(reverse("logins:update", kwargs={"pk": test_user.pk}),
+                                 { "user_name": "New Name"},
+                                 content_type="application/json")
+    self.assertEqual(response.status_code, 200)
+    response = self.client.delete(reverse("logins:logout"))
+    self.assertEqual(response.status_code, 200)
+    self.assertFalse(response.cookies["Authorization"]["max-age"])
+
+  @override_settings(LOGINS={**settings.LOGINS, "AUTH_COOKIE": False})
+  def test_cookie_is_ignored_when_disabled(self):
+    """
+    AUTH_COOKIEが無効ならクッキーでは認証されない
+    """
+    test_user = create_default_user()
+    _, access = create_tokens(test_user)
+    self.client.cookies["Authorization"] = "JWT "+access
+    response = self.client.delete(reverse("logins:logout"))
+    self.assertEqual(response.status_code, 401)
+
+  def test_cookie_authentication_enforces_csrf(self):
+    """
+    クッキーで認証したPOSTなどのリクエストはCSRFトークンが無ければ403
+    Authorizationヘッダーで認証した時はCSRFトークンは不要
+    """
+    test_user = create_default_user()
+    _, access = create_tokens(test_user)
+    client = Client(enforce_csrf_checks=True)
+    client.cookies["Authorization"] = "JWT "+access
+    url = reverse("logins:update", kwargs={"pk": test_user.pk})
+    response = client.patch(url, { "user_name": "New Name"}, content_type="application/json")
+    self.assertEqual(response.status_code, 403)
+    response = client.patch(url, { "user_name": "New Name"}, content_type="application/json",
+                            headers={"Authorization": "JWT "+access})
+    self.assertEqual(response.status_code, 200)
+
+  def test_browser_flow_with_csrf(self):
+    """
+    ブラウザと同じくCSRFを検査するクライアントで、ログインでセットされたCSRFトークンのクッキーを
+    X-CSRFTokenヘッダーに入れれば、クッキーだけで更新とログアウトができる
+    """
+    test_user = create_default_user()
+    client = Client(enforce_csrf_checks=True)
+    response = client.post(reverse("logins:login"),
+                           { "email": "example@example.com",
+                             "password": "password"},
+                           content_type="application/json")
+    self.assertEqual(response.status_code, 201)
+    self.assertIn("csrftoken", response.cookies)
+    csrf_token = client.cookies["csrftoken"].value
+    url = reverse("logins:update", kwargs={"pk": test_user.pk})
+    response = client.patch(url, { "user_name": "New Name"}, content_type="application/json")
+    self.assertEqual(response.status_code, 403)
+    response = client.patch(url, { "user_name": "New Name"}, content_type="application/json",
+                            headers={"X-CSRFToken": csrf_token})
+    self.assertEqual(response.status_code, 200)
+    response = client.delete(reverse("logins:logout"), headers={"X-CSRFToken": csrf_token})
+    self.assertEqual(response.status_code, 200)
+
+  def test_signup_sets_new_csrf_cookie(self):
+    """
+    サインアップでもCSRFトークンのクッキーがセットされ、ログインの度に新しくなる
+    """
+    client = Client(enforce_csrf_checks=True)
+    response = client.post(reverse("logins:signup"),
+                           { "user_name": "Test User",
+                             "email": "example@example.com",
+                             "password": "password"},
+                           content_type="application/json")
+    self.assertEqual(response.status_code, 201)
+    first = response.cookies["csrftoken"].value
+    client.cookies.clear()
+    response = client.post(reverse("logins:async_login"),
+                           { "email": "example@example.com",
+                             "password": "password"},
+                           content_type="application/json")
+    self.assertEqual(response.status_code, 201)
+    self.assertNotEqual(response.cookies["csrftoken"].value, first)
+
+@override_settings(LOGINS={**settings.LOGINS, "PBKDF2_ITERATIONS": 1000, "SILENT_REFRESH_THRESHOLD": 300})
+class UserSilentRefreshTests(TestCase):
+
+  def setUp(self):
+    cache.clear()
+    revocation_list.reset()
+
+  def patch(self, user):
+    return self.client.patch(reverse("logins:update", kwargs={"pk": user.pk}),
+                             { "user_name": "New Name"},
+                             content_type="application/json")
+
+  def test_expiring_cookie_is_refreshed(self):
+    """
+    有効期限が近いアクセストークンのクッキーは同じレスポンスで新しいものになり、
+    ローテーション前のリフレッシュトークンは失効する
+    """
+    test_user = create_default_user()
+    old_refresh, access = create_tokens(test_user, access_seconds=60)
+    self.client.cookies["Authorization"] = "JWT "+access
+    self.client.cookies["refresh"] = old_refresh
+    response = self.patch(test_user)
+    self.assertEqual(response.status_code, 200)
+    self.assertNotEqual(response.cookies["Authorization"].value, "JWT "+access)
+    self.assertNotEqual(response.cookies["refresh"].value, old_refresh)
+    with self.assertRaises(TokenError):
+      RefreshToken(old_refresh)
+    # 新しいクッキーで続けてアクセスでき、もうローテーションされない
+    new_refresh = response.cookies["refresh"].value
+    self.client.cookies["Authorization"] = response.cookies["Authorization"].value
+    self.client.cookies["refresh"] = new_refresh
+    response = self.patch(test_user)
+    self.assertEqual(response.status_code, 200)
+    RefreshToken(new_refresh)
+
+  def test_refreshed_cookie_is_set_by_middleware(self):
+    """
+    ビューがクッキーをセットしなくても、ローテーションした新しいトークンがクッキーで返る
+    """
+    test_user = create_default_user()
+    old_refresh, access = create_tokens(test_user, access_seconds=60)
+    self.client.cookies["Authorization"] = "JWT "+access
+    self.client.cookies["refresh"] = old_refresh
+    response = self.client.get(reverse("logins:index"))
+    self.assertEqual(response.status_code, 200)
+    new_access = response.cookies["Authorization"].value
+    self.assertNotEqual(new_access, "JWT "+access)
+    RefreshToken(response.cookies["refresh"].value)
+    response = self.client.delete(reverse("logins:logout"), headers={"Authorization": new_access})
+    self.assertEqual(response.status_code, 200)
+
+  def test_fresh_cookie_is_not_refreshed(self):
+    """
+    有効期限まで十分あるアクセストークンはローテーションしない
+    """
+    test_user = create_default_user()
+    old_refresh, access = create_tokens(test_user)
+    self.client.cookies["Authorization"] = "JWT "+access
+    self.client.cookies["refresh"] = old_refresh
+    response = self.patch(test_user)
+    self.assertEqual(response.status_code, 200)
+    # ローテーションしていなければ失効していない
+    RefreshToken(old_refresh)
+
+  def test_expired_cookie_is_refreshed(self):
+    """
+    アクセストークンのクッキーが期限切れで消えていても、リフレッシュトークンがあれば
+    そのリクエストは認証される
+    """
+    test_user = create_default_user()
+    old_refresh, _ = create_tokens(test_user)
+    self.client.cookies["refresh"] = old_refresh
+    response = self.patch(test_user)
+    self.assertEqual(response.status_code, 200)
+    self.assertTrue(response.cookies["Authorization"].value.startswith("JWT "))
+
+  def test_header_clients_are_not_refreshed(self):
+    """
+    Authorizationヘッダーで認証するクライアントのクッキーは使わない
+    """
+    test_user = create_default_user()
+    old_refresh, access = create_tokens(test_user)
+    self.client.cookies["refresh"] = old_refresh
+    response = self.client.patch(reverse("logins:update", kwargs={"pk": test_user.pk}),
+                                 { "user_name": "New Name"},
+                                 content_type="application/json",
+                                 headers={"Authorization": "JWT "+access})
+    self.assertEqual(response.status_code, 200)
+    RefreshToken(old_refresh)
+
+  def test_invalid_refresh_cookie_is_deleted(self):
+    """
+    失効したリフレッシュトークンのクッキーは削除され、リクエストは認証されない
+    """
+    test_user = create_default_user()
+    old_refresh, _ = create_tokens(test_user)
+    RefreshToken(old_refresh).revoke()
+    self.client.cookies["refresh"] = old_refresh
+    response = self.patch(test_user)
+    self.assertEqual(response.status_code, 401)
+    self.assertFalse(response.cookies["refresh"]["max-age"])
+
+  def test_logout_revokes_rotated_tokens(self):
+    """
+    ローテーションしたリクエストでログアウトすると、新しいトークンが失効してクッキーは削除される
+    """
+    test_user = create_default_user()
+    old_refresh, _ = create_tokens(test_user)
+    self.client.cookies["refresh"] = old_refresh
+    response = self.client.delete(reverse("logins:logout"))
+    self.assertEqual(response.status_code, 200)
+    self.assertFalse(response.cookies["Authorization"]["max-age"])
+    self.assertFalse(response.cookies["refresh"]["max-age"])
+
+  def test_rotation_is_shared(self):
+    """
+    同じリフレッシュトークンで続けてローテーションしても、2回目は1回目の結果を使う
+    """
+    test_user = create_default_user()
+    old_refresh, _ = create_tokens(test_user)
+    first = refresh.rotate(old_refresh)
+    second = refresh.rotate(old_refresh)
+    self.assertTrue(first)
+    self.assertEqual(first, second)
+
+  @override_settings(LOGINS={**settings.LOGINS, "SILENT_REFRESH_WAIT": 2.0})
+  def test_parallel_request_waits_for_rotation(self):
+    """
+    他のリクエストがローテーション中なら、その結果を待って使う
+    """
+    test_user = create_default_user()
+    old_refresh, _ = create_tokens(test_user)
+    jti = RefreshToken(old_refresh)["jti"]
+    cache.add(refresh.LOCK_KEY % jti, 1)
+    result = {"access": "new access", "refresh": "new refresh"}
+    timer = threading.Timer(0.1, cache.set, (refresh.RESULT_KEY % jti, result))
+    timer.start()
+    started = time.monotonic()
+    self.assertEqual(refresh.rotate(old_refresh), result)
+    self.assertLess(time.monotonic() - started, 2.0)
+    timer.join()
+
+  @override_settings(LOGINS={**settings.LOGINS, "SILENT_REFRESH_WAIT": 0.1})
+  def test_parallel_request_gives_up(self):
+    """
+    ローテーションの結果が待っても得られなければクッキーを変えない
+    """
+    test_user = create_default_user()
+    old_refresh, _ = create_tokens(test_user)
+    cache.add(refresh.LOCK_KEY % RefreshToken(old_refresh)["jti"], 1)
+    self.assertIsNone(refresh.rotate(old_refresh))
+
+  async def test_async_view_is_refreshed(self):
+    """
+    非同期ビューでもローテーションしたトークンで認証される
+    """
+    test_user = await sync_to_async(create_default_user)()
+    old_refresh, _ = await sync_to_async(create_tokens)(test_user)
+    self.async_client.cookies["refresh"] = old_refresh
+    response = await self.async_client.delete(reverse("logins:async_logout"))
+    self.assertEqual(response.status_code, 200)
+    self.assertFalse(response.cookies["refresh"]["max-age"])
@@ -0,0 +1,143 @@
+import datetime
+import decimal
+import json
+import uuid
+import msgpack
+from django.conf import settings
+from django.core.cache import cache
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+from django.utils.translation import gettext_lazy
+from rest_framework import renderers as drf_renderers
+from ..models import User
+from ..renderers import JSONRenderer
+
+def create_default_user(user_name="Test User",
+                       email="example@example.com",
+                       password="password"):
+  """
+  パラメータのユーザーを作成する
+  """
+  user= User.objects.create_user(user_name=user_name,
+                                       email=email,
+                                       password=password)
+  return user
+
+def drf_render(data):
+  return drf_renderers.JSONRenderer().render(data)
+
+@override_settings(LOGINS={**settings.LOGINS, "PBKDF2_ITERATIONS": 1000})
+class UserRendererTests(TestCase):
+
+  def setUp(self):
+    cache.clear()
+
+  def test_json_is_identical_to_drf(self):
+    """
+    orjsonでエンコードしたJSONはDRFのJSONRendererと同じバイト列になる
+    """
+    data = {
+      "id": 1,
+      "name": "テスト\u2028ユーザー\u2029",
+      "float": 0.5,
+      "none": None,
+      "bool": [True, False],
+      "datetime": timezone.now().replace(microsecond=123456),
+      "naive": datetime.datetime(2024, 1, 2, 3, 4, 5),
+      "date": datetime.date(2024, 1, 2),
+      "time": datetime.time(3, 4, 5, 678901),
+      "timedelta": datetime.timedelta(minutes=30),
+      "decimal": decimal.Decimal("1.25"),
+      "uuid": uuid.UUID("12345678-1234-5678-1234-567812345678"),
+      "lazy": gettext_lazy("Not found."),
+      "tuple": (1, "a"),
+      1: "int key",
+      "nested": [{"a": [{}]}],
+    }
+    self.assertEqual(JSONRenderer().render(data), drf_render(data))
+
+  def test_unsupported_data_falls_back_to_drf(self):
+    """
+    orjsonで扱えないデータやインデントの指定はDRFでエンコードする
+    """
+    data = {"big": 2 ** 70}
+    self.assertEqual(JSONRenderer().render(data), drf_render(data))
+    indented = JSONRenderer().render({"a": 1}, "application/json; indent=2")
+    self.assertEqual(indented, b'{\n  "a": 1\n}')
+
+  def test_floats_are_identical_to_drf(self):
+    """
+    指数表記になるfloatもDRFと同じバイト列になる (orjsonだけでは 1e16、0.00001 になる)
+    """
+    data = {"values": [1e16, 1e-05, 1e21, -2.5e-7, 5e-324, 0.0001, 9999999999999998.0, 0.1, -0.0],
+            "none": None}
+    self.assertEqual(JSONRenderer().render(data), drf_render(data))
+    self.assertIn(b"1e+16", JSONRenderer().render(data))
+
+  def test_non_finite_floats_raise_like_drf(self):
+    """
+    NaNと無限大はnullにせず、DRFと同じくエラーにする
+    """
+    for value in (float("nan"), float("inf"), float("-inf")):
+      with self.assertRaisesMessage(ValueError, "Out of range float values are not JSON compliant"):
+        JSONRenderer().render({"nested": [{"value": value}]})
+
+  def test_index_view_is_identical_to_drf(self):
+    """
+    ユーザー一覧のレスポンスはDRFのJSONRendererで作ったものと同じ
+    """
+    for n in range(3):
+      create_default_user(user_name="user%d" % n, email="user%d@example.com" % n)
+    response = self.client.get(reverse("logins:index"))
+    self.assertEqual(response.status_code, 200)
+    self.assertEqual(response.content, drf_render(response.data))
+
+  def test_stream_is_valid_json(self):
+    """
+    ストリーミングの一覧もorjsonでエンコードした正しいJSONになる
+    """
+    for n in range(5):
+      create_default_user(user_name="user%d" % n, email="user%d@example.com" % n)
+    with override_settings(LOGINS={**settings.LOGINS, "INDEX_STREAM_CHUNK_SIZE": 2}):
+      response = self.client.get(reverse("logins:index"), {"stream": "1"})
+      body = b"".join(response.streaming_content)
+    users = list(User.objects.order_by("id").values("id", "user_name", "email"))
+    self.assertEqual(json.loads(body), users)
+    self.assertEqual(body, json.dumps(users, ensure_ascii=False, separators=(",", ":")).encode())
+
+  def test_msgpack_response(self):
+    """
+    Accept: application/msgpack ならMessagePackで返り、内容はJSONと同じ
+    """
+    create_default_user()
+    response = self.client.get(reverse("logins:index"), headers={"Accept": "application/msgpack"})
+    self.assertEqual(response.status_code, 200)
+    self.assertEqual(response["Content-Type"], "application/msgpack")
+    self.assertIn("Accept", response["Vary"])
+    json_response = self.client.get(reverse("logins:index"))
+    self.assertEqual(msgpack.unpackb(response.content), json.loads(json_response.content))
+
+  def test_msgpack_request(self):
+    """
+    Content-Type: application/msgpack のリクエストを受け付ける
+    """
+    create_default_user()
+    response = self.client.post(reverse("logins:login"),
+                                msgpack.packb({ "email": "example@example.com",
+                                                "password": "password"}),
+                                content_type="application/msgpack",
+                                headers={"Accept": "application/msgpack"})
+    self.assertEqual(response.status_code, 201)
+    self.assertEqual(msgpack.unpackb(response.content)["email"], "example@example.com")
+
+  def test_parse_errors(self):
+    """
+    壊れたJSONとMessagePackは400を返す
+    """
+    response = self.client.post(reverse("logins:login"), b"{", content_type="application/json")
+    self.assertEqual(response.status_code, 400)
+    self.assertIn("JSON parse error", response.data["detail"])
+    response = self.client.post(reverse("logins:login"), b"\xc1", content_type="application/msgpack")
+    self.assertEqual(response.status_code, 400)
+    self.assertIn("MessagePack parse error", response.data["detail"])
@@ -0,0 +1,260 @@
+import time
+from unittest import mock
+from django.conf import settings
+from django.core.cache import cache
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from rest_framework_simplejwt.exceptions import TokenError
+from ..checks import check_revocation_cache, check_shared_caches
+from ..models import User
+from ..revocation import (ENTRY_KEY, GAP_TIMEOUT, MARKED_SINCE_KEY, SEQ_KEY, BloomFilter, RevocationList,
+                          max_lifetime, revocation_list)
+from ..tokens import AccessToken, RefreshToken
+from ..utils import get_jwt
+
+def create_default_user(user_name="Test User",
+                       email="example@example.com",
+                       password="password"):
+  """
+  パラメータのユーザーを作成する
+  """
+  user= User.objects.create_user(user_name=user_name,
+                                       email=email,
+                                       password=password)
+  return user
+
+@override_settings(LOGINS={**settings.LOGINS, "PBKDF2_ITERATIONS": 1000})
+class UserRevocationTests(TestCase):
+
+  def setUp(self):
+    cache.clear()
+    revocation_list.reset()
+
+  def test_logout_revokes_access_token(self):
+    """
+    ログアウトしたアクセストークンを使うと401が返ってくる
+    """
+    test_user = create_default_user()
+    jwt_dict = get_jwt(test_user)
+    headers = {"Authorization": "JWT "+jwt_dict["access"]}
+    self.client.cookies["refresh"] = jwt_dict["refresh"]
+    response = self.client.delete(reverse("logins:logout"), headers=headers)
+    self.assertEqual(response.status_code, 200)
+    response = self.client.patch(reverse("logins:update", kwargs={"pk": test_user.pk}),
+                                 {"user_name": "Test User2"},
+                                 content_type="application/json",
+                                 headers=headers)
+    self.assertEqual(response.status_code, 401)
+
+  def test_logout_revokes_refresh_token(self):
+    """
+    ログアウトした時のクッキーのリフレッシュトークンは、トークンのリフレッシュに使えない
+    """
+    test_user = create_default_user()
+    jwt_dict = get_jwt(test_user)
+    self.client.cookies["refresh"] = jwt_dict["refresh"]
+    self.client.delete(reverse("logins:logout"),
+                       headers={"Authorization": "JWT "+jwt_dict["access"]})
+    response = self.client.post(reverse("logins:token_refresh"), {"refresh": jwt_dict["refresh"]})
+    self.assertEqual(response.status_code, 401)
+
+  def test_async_logout_revokes_access_token(self):
+    """
+    非同期のログアウトでもアクセストークンが失効する
+    """
+    test_user = create_default_user()
+    access = get_jwt(test_user)["access"]
+    response = self.client.delete(reverse("logins:async_logout"),
+                                  headers={"Authorization": "JWT "+access})
+    self.assertEqual(response.status_code, 200)
+    with self.assertRaises(TokenError):
+      AccessToken(access)
+
+  def test_refresh_rotation_revokes_old_token(self):
+    """
+    リフレッシュした後の古いリフレッシュトークンは使えない
+    """
+    test_user = create_default_user()
+    refresh = get_jwt(test_user)["refresh"]
+    response = self.client.post(reverse("logins:token_refresh"), {"refresh": refresh})
+    self.assertEqual(response.status_code, 200)
+    response = self.client.post(reverse("logins:token_refresh"), {"refresh": refresh})
+    self.assertEqual(response.status_code, 401)
+
+  def test_verify_view_rejects_revoked_token(self):
+    """
+    失効したトークンはtoken_verifyで無効になる
+    """
+    test_user = create_default_user()
+    access = get_jwt(test_user)["access"]
+    response = self.client.post(reverse("logins:token_verify"), {"token": access})
+    self.assertEqual(response.status_code, 200)
+    AccessToken(access).revoke()
+    response = self.client.post(reverse("logins:token_verify"), {"token": access})
+    self.assertEqual(response.status_code, 401)
+
+  def test_revocation_disabled(self):
+    """
+    LOGINS["REVOCATION"]がFalseなら失効リストを確認しない
+    """
+    test_user = create_default_user()
+    access = get_jwt(test_user)["access"]
+    AccessToken(access).revoke()
+    with override_settings(LOGINS={**settings.LOGINS, "REVOCATION": False}):
+      AccessToken(access)
+    with self.assertRaises(TokenError):
+      AccessToken(access)
+
+  def test_bloom_filter(self):
+    """
+    追加した値は必ず含まれ、追加していない値の偽陽性は少ない
+    """
+    bloom = BloomFilter(1000, 0.01)
+    for n in range(1000):
+      bloom.add("jti-%d" % n)
+    self.assertTrue(all("jti-%d" % n in bloom for n in range(1000)))
+    false_positives = sum("other-%d" % n in bloom for n in range(10000))
+    self.assertLess(false_positives, 300)
+
+  def test_sync_between_processes(self):
+    """
+    別のプロセス(RevocationList)で失効したjtiが、同期した後に反映される
+    """
+    other = RevocationList()
+    exp = time.time() + 60
+    other.revoke("revoked-jti", exp)
+    self.assertTrue(other.is_revoked("revoked-jti"))
+    revocation_list.sync()
+    self.assertTrue(revocation_list.is_revoked("revoked-jti"))
+    self.assertFalse(revocation_list.is_revoked("other-jti"))
+
+  def test_sync_after_store_cleared(self):
+    """
+    共有ストアが消えて連番が戻っても、新しい失効を読み込める
+    """
+    other = RevocationList()
+    for n in range(3):
+      other.revoke("jti-%d" % n, time.time() + 60)
+    revocation_list.sync()
+    cache.clear()
+    other.revoke("new-jti", time.time() + 60)
+    revocation_list.sync()
+    self.assertTrue(revocation_list.is_revoked("new-jti"))
+
+  def test_expired_entries_are_pruned(self):
+    """
+    有効期限が切れたjtiは同期の時に捨てられる
+    """
+    revocation_list._add("expired-jti", time.time() - 1)
+    revocation_list.revoke("valid-jti", time.time() + 60)
+    self.assertFalse(revocation_list.is_revoked("expired-jti"))
+    revocation_list.sync()
+    self.assertEqual(len(revocation_list), 1)
+    self.assertTrue(revocation_list.is_revoked("valid-jti"))
+
+  def test_rebuild_when_capacity_exceeded(self):
+    """
+    容量を超えて失効してもすべてのjtiを検出できる
+    """
+    with override_settings(LOGINS={**settings.LOGINS, "REVOCATION_BLOOM_CAPACITY": 8}):
+      revocation_list.reset()
+      for n in range(50):
+        revocation_list.revoke("jti-%d" % n, time.time() + 60)
+      self.assertTrue(all(revocation_list.is_revoked("jti-%d" % n) for n in range(50)))
+
+  def test_sync_rereads_unwritten_entry(self):
+    """
+    連番を取ってからエントリを書き込むまでの間に同期しても、次の同期でそのjtiを読み込む
+    """
+    cache.add(SEQ_KEY, 0, timeout=None)
+    seq = cache.incr(SEQ_KEY)
+    revocation_list.sync()
+    cache.set(ENTRY_KEY % seq, ("late-jti", time.time() + 60))
+    other = RevocationList()
+    other.revoke("next-jti", time.time() + 60)
+    revocation_list.sync()
+    self.assertTrue(revocation_list.is_revoked("late-jti"))
+    self.assertTrue(revocation_list.is_revoked("next-jti"))
+    self.assertEqual(revocation_list._gaps, {})
+
+  def test_missing_entry_is_given_up(self):
+    """
+    見つからない連番は GAP_TIMEOUT 秒で読み直すのをやめる
+    """
+    cache.add(SEQ_KEY, 0, timeout=None)
+    cache.incr(SEQ_KEY)
+    revocation_list.sync()
+    self.assertEqual(len(revocation_list._gaps), 1)
+    with mock.patch("time.monotonic", return_value=time.monotonic() + GAP_TIMEOUT):
+      revocation_list.sync()
+    self.assertEqual(revocation_list._gaps, {})
+
+  def revoke_at(self, now, jti, exp):
+    """
+    時刻nowに別のプロセスでjtiを失効させる
+    """
+    with mock.patch("time.time", return_value=now):
+      RevocationList().revoke(jti, exp)
+
+  def test_new_process_skips_old_revocations(self):
+    """
+    新しいプロセスは最長の有効期間より前の失効を読まない
+    (期限が切れていないエントリを残して、読んだかどうかを確かめる)
+    """
+    lifetime = max_lifetime()
+    start = time.time()
+    now = start + 3 * lifetime
+    self.revoke_at(start, "old-jti", now + 60)
+    self.revoke_at(now - lifetime / 2, "new-jti", now + 60)
+    new_process = RevocationList()
+    with mock.patch("time.time", return_value=now), \
+         mock.patch.object(cache, "get_many", wraps=cache.get_many) as get_many:
+      self.assertTrue(new_process.is_revoked("new-jti"))
+      self.assertFalse(new_process.is_revoked("old-jti"))
+    entries = [key for call in get_many.call_args_list for key in call.args[0] if key.startswith(ENTRY_KEY[:-2])]
+    self.assertEqual(entries, [ENTRY_KEY % 2])
+
+  def test_new_process_replays_unmarked_revocations(self):
+    """
+    印を付け始めてから最長の有効期間が経つまでは、印の無い失効があり得るので最初から読む
+    """
+    lifetime = max_lifetime()
+    start = time.time()
+    now = start + 3 * lifetime
+    self.revoke_at(start, "old-jti", now + 60)
+    self.revoke_at(now - lifetime / 2, "new-jti", now + 60)
+    cache.set(MARKED_SINCE_KEY, now - lifetime / 2, timeout=None)
+    new_process = RevocationList()
+    with mock.patch("time.time", return_value=now):
+      self.assertTrue(new_process.is_revoked("old-jti"))
+      self.assertTrue(new_process.is_revoked("new-jti"))
+
+  def test_local_cache_check(self):
+    """
+    失効リストのキャッシュがプロセス毎のLocMemCacheならシステムチェックのエラーになる
+    """
+    local = {"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}}
+    shared = {"default": {"BACKEND": "django.core.cache.backends.redis.RedisCache",
+                          "LOCATION": "redis://localhost:6379"}}
+    with override_settings(CACHES=local):
+      self.assertEqual([error.id for error in check_revocation_cache(None)], ["logins.E001"])
+    with override_settings(CACHES=shared):
+      self.assertEqual(check_revocation_cache(None), [])
+    with override_settings(CACHES=local, LOGINS={**settings.LOGINS, "REVOCATION": False}):
+      self.assertEqual(check_revocation_cache(None), [])
+
+  def test_shared_caches_check(self):
+    """
+    ユーザー一覧のキャッシュ、スロットル、サイレントリフレッシュのキャッシュがLocMemCacheなら警告する
+    """
+    caches = {"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"},
+              "shared": {"BACKEND": "django.core.cache.backends.redis.RedisCache",
+                         "LOCATION": "redis://localhost:6379"}}
+    with override_settings(CACHES=caches, LOGINS={**settings.LOGINS, "THROTTLE_CACHE": "shared",
+                                                  "SILENT_REFRESH_CACHE": "shared"}):
+      warnings = check_shared_caches(None)
+    self.assertEqual([warning.id for warning in warnings], ["logins.W001"])
+    self.assertIn("USER_LIST_CACHE", warnings[0].msg)
+    self.assertNotIn("THROTTLE_CACHE", warnings[0].msg)
+    with override_settings(CACHES={"default": caches["shared"]}):
+      self.assertEqual(check_shared_caches(None), [])
@@ -0,0 +1,108 @@
+import time
+from django.conf import settings
+from django.http import HttpResponse
+from django.core.cache import cache
+from django.test import SimpleTestCase, TestCase, RequestFactory, override_settings
+from django.urls import reverse
+from ..middleware import ReplicaStickinessMiddleware, STICKY_COOKIE
+from ..models import User
+from ..routers import PrimaryReplicaRouter, use_primary
+from ..throttling import buckets
+
+replicas = override_settings(LOGINS={**settings.LOGINS, "READ_REPLICAS": ["replica"],
+                                     "PBKDF2_ITERATIONS": 1000})
+
+@replicas
+class UserRouterTests(SimpleTestCase):
+
+  def setUp(self):
+    self.router = PrimaryReplicaRouter()
+
+  def test_read_from_replica(self):
+    """
+    リクエストの外の読み込みはレプリカ、書き込みはプライマリに振り分けられる
+    """
+    self.assertEqual(self.router.db_for_read(User), "replica")
+    self.assertEqual(self.router.db_for_write(User), "default")
+
+  def test_no_replicas(self):
+    """
+    レプリカが無ければルーターは振り分けない
+    """
+    with override_settings(LOGINS={**settings.LOGINS, "READ_REPLICAS": []}):
+      self.assertIsNone(self.router.db_for_read(User))
+
+  def test_use_primary(self):
+    """
+    use_primaryの中の読み込みはプライマリに振り分けられる
+    """
+    with use_primary():
+      self.assertEqual(self.router.db_for_read(User), "default")
+    self.assertEqual(self.router.db_for_read(User), "replica")
+
+  def test_allow_migrate(self):
+    """
+    レプリカにはマイグレーションしない
+    """
+    self.assertFalse(self.router.allow_migrate("replica", "logins"))
+    self.assertTrue(self.router.allow_migrate("default", "logins"))
+
+  def run_middleware(self, request, write=False):
+    """
+    ミドルウェアを通して、ビューの中での読み込み先とレスポンスを返す
+    """
+    result = {}
+    def view(request):
+      if write:
+        self.router.db_for_write(User)
+      result["db"] = self.router.db_for_read(User)
+      return HttpResponse()
+    response = ReplicaStickinessMiddleware(view)(request)
+    return result["db"], response
+
+  def test_middleware_get_reads_replica(self):
+    """
+    書き込んでいないクライアントのGETはレプリカから読み込み、クッキーはセットされない
+    """
+    db, response = self.run_middleware(RequestFactory().get("/"))
+    self.assertEqual(db, "replica")
+    self.assertNotIn(STICKY_COOKIE, response.cookies)
+
+  def test_middleware_write_pins_primary(self):
+    """
+    書き込むリクエストはプライマリから読み込み、クッキーがセットされる
+    """
+    db, response = self.run_middleware(RequestFactory().post("/"), write=True)
+    self.assertEqual(db, "default")
+    self.assertEqual(response.cookies[STICKY_COOKIE]["max-age"], 5)
+
+  def test_middleware_sticky_cookie(self):
+    """
+    クッキーの期限内ならGETもプライマリから読み込み、期限切れならレプリカから読み込む
+    """
+    request = RequestFactory().get("/")
+    request.COOKIES[STICKY_COOKIE] = str(time.time() + 5)
+    self.assertEqual(self.run_middleware(request)[0], "default")
+    request = RequestFactory().get("/")
+    request.COOKIES[STICKY_COOKIE] = str(time.time() - 1)
+    self.assertEqual(self.run_middleware(request)[0], "replica")
+
+@replicas
+class UserReplicaViewTests(TestCase):
+
+  def setUp(self):
+    cache.clear()
+    buckets.reset()
+
+  def test_signup_sets_sticky_cookie(self):
+    """
+    サインアップの後はプライマリに固定するクッキーがセットされる
+    """
+    response = self.client.post(reverse("logins:signup"),
+                                {"user_name": "Test User",
+                                 "email": "example@example.com",
+                                 "password": "password"})
+    self.assertEqual(response.status_code, 201)
+    self.assertIn(STICKY_COOKIE, response.cookies)
+    response = self.client.get(reverse("logins:index"))
+    self.assertNotIn(STICKY_COOKIE, response.cookies)
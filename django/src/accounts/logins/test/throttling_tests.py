@@ -0,0 +1,210 @@
+import threading
+import time
+from unittest import mock
+from django.conf import settings
+from django.core.cache import cache
+from django.core.cache.backends.locmem import LocMemCache
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from ..hashpool import hash_pool
+from ..models import User
+from ..throttling import TokenBuckets, buckets, parse_rate
+
+def logins_settings(**kwargs):
+  """
+  settings.LOGINS の一部を上書きした辞書を返す
+  """
+  return {**settings.LOGINS, "PBKDF2_ITERATIONS": 1000, **kwargs}
+
+def create_default_user(user_name="Test User",
+                       email="example@example.com",
+                       password="password"):
+  """
+  パラメータのユーザーを作成する
+  """
+  user= User.objects.create_user(user_name=user_name,
+                                       email=email,
+                                       password=password)
+  return user
+
+@override_settings(LOGINS=logins_settings(THROTTLE_RATES={"ip": "3/min", "account": "2/min"},
+                                          SHED_MAX_PENDING_HASHES=16,
+                                          SHED_MAX_HASH_LATENCY=None,
+                                          SHED_MAX_LOAD=None))
+class UserThrottlingTests(TestCase):
+
+  def setUp(self):
+    cache.clear()
+    buckets.reset()
+
+  def login(self, email="example@example.com", ip="10.0.0.1", url="logins:login"):
+    # ログイン済みのクッキーがあるとログインできないので、毎回ログアウトした状態にする
+    self.client.cookies.clear()
+    return self.client.post(reverse(url),
+                            { "email": email,
+                              "password": "password"},
+                            content_type="application/json",
+                            REMOTE_ADDR=ip)
+
+  def test_parse_rate(self):
+    """
+    "回数/期間" はバケットの容量と毎秒の補充になる
+    """
+    self.assertEqual(parse_rate("60/min"), (60, 1.0))
+    self.assertEqual(parse_rate("10/s"), (10, 10.0))
+    self.assertIsNone(parse_rate(None))
+
+  def test_ip_burst_is_throttled(self):
+    """
+    同じIPからバケットの容量を超えてログインすると、Retry-Afterつきの429が返る
+    """
+    for n in range(3):
+      create_default_user(user_name="user%d" % n, email="user%d@example.com" % n)
+      self.assertEqual(self.login(email="user%d@example.com" % n).status_code, 201)
+    response = self.login(email="user0@example.com")
+    self.assertEqual(response.status_code, 429)
+    self.assertGreaterEqual(int(response["Retry-After"]), 1)
+    # 他のIPからは制限されない
+    self.assertEqual(self.login(email="user1@example.com", ip="10.0.0.2").status_code, 201)
+
+  def test_account_is_throttled_across_ips(self):
+    """
+    アカウント毎の制限はIPを変えても効く。大文字小文字も区別しない
+    """
+    create_default_user()
+    self.assertEqual(self.login(ip="10.0.0.1").status_code, 201)
+    self.assertEqual(self.login(email="EXAMPLE@example.com", ip="10.0.0.2").status_code, 201)
+    self.assertEqual(self.login(ip="10.0.0.3").status_code, 429)
+
+  def test_signup_and_token_obtain_are_throttled(self):
+    """
+    サインアップとトークンの発行もIP毎の制限を共有する
+    """
+    create_default_user()
+    response = self.client.post(reverse("logins:signup"),
+                                { "user_name": "New User",
+                                  "email": "new@example.com",
+                                  "password": "password"},
+                                content_type="application/json",
+                                REMOTE_ADDR="10.0.0.1")
+    self.assertEqual(response.status_code, 201)
+    self.assertEqual(self.login(url="logins:token_obtain_pair").status_code, 200)
+    self.assertEqual(self.login(email="new@example.com", url="logins:token_obtain_pair").status_code, 200)
+    self.assertEqual(self.login(email="other@example.com", url="logins:token_obtain_pair").status_code, 429)
+
+  @override_settings(LOGINS=logins_settings(THROTTLE_RATES={"ip": "3/min", "account": None}))
+  def test_local_fast_path_skips_shared_cache(self):
+    """
+    プロセス内のバケットが空なら共有のキャッシュを見ずに断る
+    """
+    for n in range(3):
+      self.login(email="user%d@example.com" % n)
+    with mock.patch.object(buckets, "get_cache") as get_cache:
+      self.assertEqual(self.login(email="user3@example.com").status_code, 429)
+    get_cache.assert_not_called()
+
+  def test_shared_cache_is_used_by_other_processes(self):
+    """
+    プロセス内のバケットが無くても、共有のキャッシュのバケットで制限される
+    """
+    for n in range(3):
+      self.login(email="user%d@example.com" % n)
+    buckets.reset()
+    self.assertEqual(self.login(email="user3@example.com").status_code, 429)
+
+  def test_concurrent_consumers_share_the_limit(self):
+    """
+    別々のプロセス(写しが別々)から同時に使っても、許可されるのは容量の分だけ
+    """
+    results = []
+    barrier = threading.Barrier(20)
+    get = LocMemCache.get
+    def slow_get(self, *args, **kwargs):
+      # 読んでから書くまでの間に他のスレッドが読めるように遅くする
+      value = get(self, *args, **kwargs)
+      time.sleep(0.05)
+      return value
+    def consume():
+      consumer = TokenBuckets()
+      barrier.wait()
+      results.append(consumer.consume("test:concurrent", 5, 5 / 60))
+    threads = [threading.Thread(target=consume) for _ in range(20)]
+    with mock.patch.object(LocMemCache, "get", slow_get):
+      for thread in threads:
+        thread.start()
+      for thread in threads:
+        thread.join()
+    self.assertEqual(results.count(0), 5)
+    self.assertTrue(all(wait > 0 for wait in results if wait))
+
+  def test_forwarded_for_does_not_reset_ip_limit(self):
+    """
+    プロキシが無い設定 (NUM_PROXIES=0) では X-Forwarded-For を変えても同じIPとして数える
+    """
+    for n in range(3):
+      create_default_user(user_name="user%d" % n, email="user%d@example.com" % n)
+      self.client.cookies.clear()
+      response = self.client.post(reverse("logins:login"),
+                                  { "email": "user%d@example.com" % n,
+                                    "password": "password"},
+                                  content_type="application/json",
+                                  REMOTE_ADDR="10.0.0.1",
+                                  HTTP_X_FORWARDED_FOR="192.0.2.%d" % n)
+      self.assertEqual(response.status_code, 201)
+    self.client.cookies.clear()
+    response = self.client.post(reverse("logins:login"),
+                                { "email": "user0@example.com",
+                                  "password": "password"},
+                                content_type="application/json",
+                                REMOTE_ADDR="10.0.0.1",
+                                HTTP_X_FORWARDED_FOR="192.0.2.99")
+    self.assertEqual(response.status_code, 429)
+
+  def test_hash_queue_saturation_sheds_load(self):
+    """
+    ハッシュの待ち行列が閾値を超えたら、ハッシュが必要なエンドポイントは503を返し、
+    他のエンドポイントは影響を受けない
+    """
+    create_default_user()
+    with mock.patch.object(hash_pool, "_pending", 16):
+      response = self.login()
+      self.assertEqual(response.status_code, 503)
+      self.assertEqual(response["Retry-After"], "1")
+      self.assertEqual(self.client.get(reverse("logins:index")).status_code, 200)
+    # 断ったリクエストはバケットのトークンを使わない
+    for n in range(2):
+      self.assertEqual(self.login().status_code, 201)
+
+  @override_settings(LOGINS=logins_settings(SHED_MAX_HASH_LATENCY=0.5, SHED_WINDOW=5.0))
+  def test_hash_latency_sheds_load(self):
+    """
+    直近のハッシュの時間が閾値を超えたら503を返す
+    """
+    create_default_user()
+    with mock.patch.object(hash_pool, "latency", return_value=1.0):
+      self.assertEqual(self.login().status_code, 503)
+    with mock.patch.object(hash_pool, "latency", return_value=0.1):
+      self.assertEqual(self.login().status_code, 201)
+
+  @override_settings(LOGINS=logins_settings(SHED_MAX_LOAD=1.0))
+  def test_cpu_load_sheds_load(self):
+    """
+    CPUあたりのロードアベレージが閾値を超えたら503を返す
+    """
+    create_default_user()
+    with mock.patch("logins.throttling.load_average.get", return_value=2.0):
+      self.assertEqual(self.login().status_code, 503)
+
+  def test_async_views_are_throttled(self):
+    """
+    非同期のログインも同じバケットで制限される
+    """
+    create_default_user()
+    for n in range(2):
+      self.assertEqual(self.login(url="logins:async_login").status_code, 201)
+    response = self.login(url="logins:async_login")
+    self.assertEqual(response.status_code, 429)
+    self.assertIn("Retry-After", response)
+    with mock.patch.object(hash_pool, "_pending", 16):
+      self.assertEqual(self.login(email="other@example.com", ip="10.0.0.2",
+                                  url="logins:async_login").status_code, 503)
@@ -0,0 +1,142 @@
+from django.conf import settings
+from django.core.cache import cache
+from django.db import IntegrityError
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.urls import reverse
+from ..models import User, unique_violations
+from ..throttling import buckets
+from ..utils import get_jwt
+
+def create_default_user(user_name="Test User",
+                       email="example@example.com",
+                       password="password"):
+  """
+  パラメータのユーザーを作成する
+  """
+  user= User.objects.create_user(user_name=user_name,
+                                       email=email,
+                                       password=password)
+  return user
+
+def create_jwt_headers(user):
+  jwt_dict = get_jwt(user)
+  return {"Authorization": "JWT "+jwt_dict["access"]}
+
+def signup_data(user_name="New User", email="new@example.com"):
+  return { "user_name": user_name,
+           "email": email,
+           "password": "password"}
+
+@override_settings(LOGINS={**settings.LOGINS, "PBKDF2_ITERATIONS": 1000})
+class UserUniqueTests(TestCase):
+
+  def setUp(self):
+    cache.clear()
+    buckets.reset()
+
+  def test_unique_violations(self):
+    """
+    各DBのIntegrityErrorのメッセージから違反したフィールドが分かる
+    """
+    messages = {
+      "UNIQUE constraint failed: index 'logins_user_email_ci_unique'": ["email"],
+      'duplicate key value violates unique constraint "logins_user_user_name_ci_unique"': ["user_name"],
+      "(1062, \"Duplicate entry 'a@example.com' for key 'logins_user.logins_user_email_ci_unique'\")": ["email"],
+      "UNIQUE constraint failed: logins_user.email": ["email"],
+      "NOT NULL constraint failed: logins_user.email": [],
+    }
+    for message, fields in messages.items():
+      self.assertEqual(unique_violations(IntegrityError(message)), fields)
+
+  def test_signup_with_duplicate_email(self):
+    """
+    登録済みのemailでsignup_viewにPOSTすると、大文字小文字が違ってもemailのエラーで400が返る
+    """
+    create_default_user()
+    response = self.client.post(reverse("logins:signup"), signup_data(email="Example@example.com"),
+                                content_type="application/json")
+    self.assertEqual(response.status_code, 400)
+    self.assertEqual(response.data, {"email": ["user with this email already exists."]})
+    self.assertEqual(User.objects.count(), 1)
+
+  def test_signup_with_duplicate_user_name(self):
+    """
+    登録済みのuser_nameでsignup_viewにPOSTすると、大文字小文字が違ってもuser_nameのエラーで400が返る
+    """
+    create_default_user()
+    response = self.client.post(reverse("logins:signup"), signup_data(user_name="TEST USER"),
+                                content_type="application/json")
+    self.assertEqual(response.status_code, 400)
+    self.assertEqual(response.data, {"user_name": ["user with this user_name already exists."]})
+
+  def test_update_with_duplicate_user_name(self):
+    """
+    他のユーザーのuser_nameに更新すると400が返り、その後も更新できる
+    """
+    create_default_user(user_name="Other", email="other@example.com")
+    test_user = create_default_user()
+    url = reverse("logins:update", kwargs={"pk": test_user.pk})
+    headers = create_jwt_headers(test_user)
+    response = self.client.patch(url, {"user_name": "other"}, headers=headers, content_type="application/json")
+    self.assertEqual(response.status_code, 400)
+    self.assertIn("user_name", response.data)
+    response = self.client.patch(url, {"user_name": "TEST USER"}, headers=headers, content_type="application/json")
+    self.assertEqual(response.status_code, 200)
+    self.assertEqual(User.objects.get(pk=test_user.pk).user_name, "TEST USER")
+
+  def test_async_signup_with_duplicate_email(self):
+    """
+    非同期のサインアップも重複したemailは400が返る
+    """
+    create_default_user()
+    response = self.client.post(reverse("logins:async_signup"), signup_data(email="EXAMPLE@example.com"),
+                                content_type="application/json")
+    self.assertEqual(response.status_code, 400)
+    self.assertEqual(response.json(), {"email": ["user with this email already exists."]})
+
+  def test_login_is_case_insensitive(self):
+    """
+    emailの大文字小文字が違ってもログインできる
+    """
+    create_default_user()
+    response = self.client.post(reverse("logins:login"),
+                                { "email": "EXAMPLE@example.com",
+                                  "password": "password"},
+                                content_type="application/json")
+    self.assertEqual(response.status_code, 201)
+
+  def test_signup_batch_with_case_variant(self):
+    """
+    バッチのサインアップでも大文字小文字だけが違うuser_nameは重複になる
+    """
+    admin = User.objects.create_superuser(user_name="admin", email="admin@example.com", password="password")
+    response = self.client.post(reverse("logins:signup_batch"),
+                                [signup_data(user_name="ADMIN", email="a@example.com"),
+                                 signup_data(user_name="Fresh", email="b@example.com")],
+                                headers=create_jwt_headers(admin), content_type="application/json")
+    self.assertEqual(response.status_code, 207)
+    self.assertEqual(response.data[0]["status"], 400)
+    self.assertIn("user_name", response.data[0]["errors"])
+
+# 監査ログのスレッドがテストの後にコミット済みのテーブルへ書き込まないように無効にする
+@override_settings(LOGINS={**settings.LOGINS, "PBKDF2_ITERATIONS": 1000, "AUDIT": False})
+class UserUniqueTransactionTests(TransactionTestCase):
+
+  def setUp(self):
+    cache.clear()
+    buckets.reset()
+
+  def test_signup_is_one_statement(self):
+    """
+    トランザクションの外ではサインアップは重複の確認を含めて1回のINSERTだけ
+    """
+    create_default_user()
+    with self.assertNumQueries(1):
+      response = self.client.post(reverse("logins:signup"), signup_data(),
+                                  content_type="application/json")
+    self.assertEqual(response.status_code, 201)
+    self.client.cookies.clear()
+    with self.assertNumQueries(1):
+      response = self.client.post(reverse("logins:signup"), signup_data(email="NEW@example.com"),
+                                  content_type="application/json")
+    self.assertEqual(response.status_code, 400)
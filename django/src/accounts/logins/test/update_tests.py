@@ -0,0 +1,145 @@
+import datetime
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from ..models import User, make_etag, parse_if_match
+from ..throttling import buckets
+from ..usercache import user_cache
+from ..utils import get_jwt
+
+def create_default_user(user_name="Test User",
+                       email="example@example.com",
+                       password="password"):
+  """
+  パラメータのユーザーを作成する
+  """
+  user= User.objects.create_user(user_name=user_name,
+                                       email=email,
+                                       password=password)
+  return user
+
+def create_jwt_headers(user, **headers):
+  jwt_dict = get_jwt(user)
+  return {"Authorization": "JWT "+jwt_dict["access"], **headers}
+
+@override_settings(LOGINS={**settings.LOGINS, "PBKDF2_ITERATIONS": 1000})
+class UserUpdateTests(TestCase):
+
+  def setUp(self):
+    cache.clear()
+    buckets.reset()
+    self.user = create_default_user()
+    self.url = reverse("logins:update", kwargs={"pk": self.user.pk})
+
+  def patch(self, data, url=None, **headers):
+    return self.client.patch(url or self.url, data, content_type="application/json",
+                             headers=create_jwt_headers(self.user, **headers))
+
+  def test_etag_round_trip(self):
+    """
+    ETagからupdated_atがマイクロ秒まで戻る。"*"は条件なし、弱いETagと読めないETagは捨てる
+    """
+    etag = make_etag(self.user.updated_at)
+    self.assertEqual(parse_if_match(etag), [self.user.updated_at])
+    self.assertIsNone(parse_if_match(None))
+    self.assertIsNone(parse_if_match("*"))
+    self.assertEqual(parse_if_match('W/%s, "abc"' % etag), [])
+
+  def test_only_changed_columns_are_written(self):
+    """
+    変わったカラムとupdated_atだけがUPDATEされる
+    """
+    with CaptureQueriesContext(connection) as queries:
+      response = self.patch({"user_name": "Changed User", "email": "example@example.com"})
+    self.assertEqual(response.status_code, 200)
+    updates = [query["sql"] for query in queries if query["sql"].startswith("UPDATE")]
+    self.assertEqual(len(updates), 1)
+    self.assertIn('"user_name"', updates[0])
+    self.assertIn('"updated_at"', updates[0])
+    self.assertNotIn('"email"', updates[0])
+    self.assertNotIn('"password"', updates[0])
+    user = User.objects.get(pk=self.user.pk)
+    self.assertEqual(user.user_name, "Changed User")
+    self.assertEqual(response["ETag"], make_etag(user.updated_at))
+
+  def test_unchanged_update_is_skipped(self):
+    """
+    値が変わらなければ書き込まず、クエリは認証での取得の1回だけ
+    """
+    with self.assertNumQueries(1):
+      response = self.patch({"user_name": "Test User"})
+    self.assertEqual(response.status_code, 200)
+    self.assertEqual(response["ETag"], make_etag(self.user.updated_at))
+    self.assertEqual(User.objects.get(pk=self.user.pk).updated_at, self.user.updated_at)
+
+  def test_if_match_prevents_lost_update(self):
+    """
+    If-Matchが現在のETagなら更新され、古いETagでは412が返って更新されない
+    """
+    etag = make_etag(self.user.updated_at)
+    response = self.patch({"user_name": "First"}, **{"If-Match": etag})
+    self.assertEqual(response.status_code, 200)
+    self.assertNotEqual(response["ETag"], etag)
+    response = self.patch({"user_name": "Second"}, **{"If-Match": etag})
+    self.assertEqual(response.status_code, 412)
+    self.assertEqual(User.objects.get(pk=self.user.pk).user_name, "First")
+    response = self.patch({"user_name": "First"}, **{"If-Match": etag})
+    self.assertEqual(response.status_code, 412)
+
+  def test_if_match_star_and_weak(self):
+    """
+    If-Match: * は常に更新され、弱いETagは一致しない
+    """
+    response = self.patch({"user_name": "Star"}, **{"If-Match": "*"})
+    self.assertEqual(response.status_code, 200)
+    response = self.patch({"user_name": "Weak"}, **{"If-Match": "W/" + response["ETag"]})
+    self.assertEqual(response.status_code, 412)
+
+  def test_if_match_duplicate_user_name(self):
+    """
+    If-Matchを付けた更新でも一意制約の違反は400になる
+    """
+    create_default_user(user_name="Other", email="other@example.com")
+    response = self.patch({"user_name": "other"}, **{"If-Match": make_etag(self.user.updated_at)})
+    self.assertEqual(response.status_code, 400)
+    self.assertIn("user_name", response.data)
+
+  def test_password_update_with_if_match(self):
+    """
+    If-Matchを付けたパスワードの更新でも新しいパスワードでログインできる
+    """
+    url = reverse("logins:update_password", kwargs={"pk": self.user.pk})
+    response = self.patch({"password": "new_password"}, url=url,
+                          **{"If-Match": make_etag(self.user.updated_at)})
+    self.assertEqual(response.status_code, 200)
+    self.assertTrue(User.objects.get(pk=self.user.pk).check_password("new_password"))
+
+  @override_settings(LOGINS={**settings.LOGINS, "AUTH_USER_MODE": "claims"})
+  def test_claims_user_is_fetched(self):
+    """
+    クレームだけのユーザーで認証した時はDBから取得して更新する
+    """
+    response = self.patch({"user_name": "Claims User"})
+    self.assertEqual(response.status_code, 200)
+    self.assertEqual(User.objects.get(pk=self.user.pk).user_name, "Claims User")
+
+  @override_settings(LOGINS={**settings.LOGINS, "AUTH_USER_MODE": "cache"})
+  def test_cached_user_is_fetched(self):
+    """
+    キャッシュのユーザーが他のプロセスの更新より古くても、DBの値と比べて更新し、If-Matchも正しく判定する
+    """
+    user_cache.clear()
+    self.assertEqual(self.patch({"user_name": "Cached User"}).status_code, 200)
+    self.assertEqual(self.patch({"user_name": "Cached User"}).status_code, 200)
+    # 他のプロセスの更新 (このプロセスのキャッシュは無効化されない)
+    User.objects.filter(pk=self.user.pk).update(user_name="Other Process", updated_at=timezone.now())
+    stale_etag = make_etag(User.objects.get(pk=self.user.pk).updated_at - datetime.timedelta(seconds=1))
+    response = self.patch({"user_name": "Cached User"}, **{"If-Match": stale_etag})
+    self.assertEqual(response.status_code, 412)
+    response = self.patch({"user_name": "Cached User"})
+    self.assertEqual(response.status_code, 200)
+    self.assertEqual(User.objects.get(pk=self.user.pk).user_name, "Cached User")
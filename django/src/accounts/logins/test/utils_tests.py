@@ -6,6 +6,7 @@ from rest_framework import status
 from rest_framework.response import Response
 from django.http import HttpRequest
 from rest_framework.request import Request
+from rest_framework_simplejwt.tokens import AccessToken
 
 def create_default_user(user_name="Test User",
                        email="example@example.com",
@@ -31,6 +32,15 @@ class UserUtilsTests(TestCase):
     self.assertTrue(jwt["access"])
     self.assertTrue(jwt["refresh"])
 
+  def test_get_jwt_contains_user_claims(self):
+    """
+    get_jwt(user)で発行したアクセストークンにユーザーのクレームが含まれる
+    """
+    access = AccessToken(get_jwt(self.user)["access"])
+    self.assertEqual(access["user_name"], self.user.user_name)
+    self.assertTrue(access["is_active"])
+    self.assertFalse(access["is_staff"])
+
   def test_get_jwt_with_invalid_user(self):
     """
     無効なユーザーを引数にしてget_jwt(user)関数を実行すると空のオブジェクトが返ってくる
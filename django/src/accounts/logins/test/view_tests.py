@@ -1,8 +1,13 @@
-from django.test import TestCase
+import json
+from django.core.cache import cache
+from django.db import transaction
+from django.test import TestCase, override_settings
 from django.urls import reverse
-from unittest import skip
+from unittest import skip, mock
+from .. import listcache
 from ..models import User
 from ..utils import get_jwt
+from ..throttling import buckets
 
 def create_default_user(user_name="Test User",
                        email="example@example.com",
@@ -21,6 +26,10 @@ def create_jwt_headers(user):
 
 class UserViewTests(TestCase):
 
+  def setUp(self):
+    cache.clear()
+    buckets.reset()
+
   def test_index_view(self):
     """
     index_viewにGETメソッドを送ったときに
@@ -30,8 +39,102 @@ class UserViewTests(TestCase):
     response = self.client.get(reverse("logins:index"),
                                content_type="application/json")
     self.assertEqual(response.status_code, 200)
-    user_num_by_json = len(response.data)
+    user_num_by_json = len(response.data["results"])
     self.assertEqual(User.objects.all().count(), user_num_by_json)
+
+  def test_index_view_paginates_by_cursor(self):
+    """
+    index_viewにpage_sizeを指定してGETメソッドを送ったときに
+    カーソルをたどると全ユーザーを1回ずつ取得できる
+    """
+    for i in range(5):
+      create_default_user(user_name="user%d" % i, email="example%d@example.com" % i)
+    ids = []
+    url = reverse("logins:index") + "?page_size=2"
+    while url:
+      response = self.client.get(url, content_type="application/json")
+      self.assertEqual(response.status_code, 200)
+      self.assertLessEqual(len(response.data["results"]), 2)
+      ids += [user["id"] for user in response.data["results"]]
+      url = response.data["next"]
+    self.assertEqual(ids, list(User.objects.order_by("id").values_list("id", flat=True)))
+
+  @override_settings(LOGINS={"INDEX_STREAM_CHUNK_SIZE": 2})
+  def test_index_view_stream(self):
+    """
+    index_viewに?stream=1でGETメソッドを送ったときに
+    全ユーザーがJSONの配列でストリーミングされ、パスワードは含まれない
+    """
+    for i in range(5):
+      create_default_user(user_name="user%d" % i, email="example%d@example.com" % i)
+    response = self.client.get(reverse("logins:index") + "?stream=1")
+    self.assertEqual(response.status_code, 200)
+    users = json.loads(b"".join(response.streaming_content))
+    self.assertEqual([user["id"] for user in users],
+                     list(User.objects.order_by("id").values_list("id", flat=True)))
+    self.assertNotIn("password", users[0])
+
+  def test_index_view_is_cached(self):
+    """
+    index_viewに2回GETメソッドを送ったときに、2回目はキャッシュから返される
+    """
+    create_default_user()
+    response = self.client.get(reverse("logins:index"))
+    self.assertEqual(response["X-Cache"], "MISS")
+    with self.assertNumQueries(0):
+      response = self.client.get(reverse("logins:index"))
+    self.assertEqual(response["X-Cache"], "HIT")
+    self.assertEqual(len(response.data["results"]), 1)
+
+  def test_index_view_cache_is_invalidated_on_signup_and_update(self):
+    """
+    ユーザーの作成・更新の後はindex_viewのキャッシュが使われない
+    """
+    test_user = create_default_user()
+    self.client.get(reverse("logins:index"))
+    with self.captureOnCommitCallbacks(execute=True):
+      User.objects.update_user(test_user, {"user_name": "Changed User"})
+    response = self.client.get(reverse("logins:index"))
+    self.assertEqual(response["X-Cache"], "MISS")
+    self.assertEqual(response.data["results"][0]["user_name"], "Changed User")
+    with self.captureOnCommitCallbacks(execute=True):
+      create_default_user(user_name="another_user", email="another_email@example.com")
+    response = self.client.get(reverse("logins:index"))
+    self.assertEqual(response["X-Cache"], "MISS")
+    self.assertEqual(len(response.data["results"]), 2)
+
+  def test_index_view_not_modified(self):
+    """
+    index_viewにETagをIf-None-Matchに入れてGETメソッドを送ったときに304が返ってくる
+    ユーザーが更新されたら200が返ってくる
+    """
+    test_user = create_default_user()
+    etag = self.client.get(reverse("logins:index"))["ETag"]
+    response = self.client.get(reverse("logins:index"), headers={"If-None-Match": etag})
+    self.assertEqual(response.status_code, 304)
+    with self.captureOnCommitCallbacks(execute=True):
+      User.objects.update_user(test_user, {"user_name": "Changed User"})
+    response = self.client.get(reverse("logins:index"), headers={"If-None-Match": etag})
+    self.assertEqual(response.status_code, 200)
+
+  def test_index_view_cache_is_invalidated_after_commit(self):
+    """
+    トランザクションの中の作成ではコミットされるまでバージョンを上げない
+    (コミット前のページが新しいバージョンでキャッシュされないように)
+    """
+    version = listcache.get_version()
+    with self.captureOnCommitCallbacks(execute=True):
+      with transaction.atomic():
+        create_default_user()
+        self.assertEqual(listcache.get_version(), version)
+    self.assertNotEqual(listcache.get_version(), version)
+
+  def test_index_view_stream_with_no_users(self):
+    """
+    ユーザーがいない時、ストリーミングは空の配列を返す
+    """
+    response = self.client.get(reverse("logins:index") + "?stream=1")
+    self.assertEqual(json.loads(b"".join(response.streaming_content)), [])
   
   def test_signup_view_post(self):
     """
@@ -253,6 +356,42 @@ class UserViewTests(TestCase):
     self.assertTrue(response.cookies.get("Authorization"))
     self.assertTrue(response.cookies.get("refresh"))
 
+  def test_login_view_post_with_one_query(self):
+    """
+    login_viewにPOSTメソッドを送ったときに発行されるSELECTは1回だけ
+    """
+    test_user = create_default_user()
+    with self.assertNumQueries(1):
+      response = self.client.post(reverse("logins:login"),
+                                  { "email": test_user.email,
+                                    "password": "password"},
+                                  content_type="application/json")
+    self.assertEqual(response.status_code, 201)
+
+  def test_login_view_post_with_not_normalized_email(self):
+    """
+    ドメインが大文字のメールアドレスでもUserManager.normalize_emailと同じく正規化してログインできる
+    """
+    create_default_user()
+    response = self.client.post(reverse("logins:login"),
+                                { "email": "example@EXAMPLE.COM",
+                                  "password": "password"},
+                                content_type="application/json")
+    self.assertEqual(response.status_code, 201)
+
+  def test_login_view_post_invalid_email_runs_dummy_hash(self):
+    """
+    存在しないメールアドレスでlogin_viewにPOSTメソッドを送ったときも
+    応答時間を揃えるためにパスワードのハッシュが計算される
+    """
+    with mock.patch.object(User, "set_password") as set_password:
+      response = self.client.post(reverse("logins:login"),
+                                  { "email": "invalidexample@example.com",
+                                    "password": "password"},
+                                  content_type="application/json")
+    self.assertEqual(response.status_code, 401)
+    set_password.assert_called_once_with("password")
+
   def test_login_view_post_invalid_password(self):
     """
     誤ったメールアドレスでlogin_viewにPOSTメソッドを送ったときにログインされない
@@ -0,0 +1,22 @@
+from django.test import TestCase
+from accounts.warmup import preload, warmup_worker
+
+class UserWarmupTests(TestCase):
+  # レプリカを含むすべてのデータベースに接続する
+  databases = "__all__"
+
+  def test_preload(self):
+    """
+    forkする前のウォームアップがエラー無しですべての手順を実行する
+    """
+    with self.assertNoLogs("accounts.warmup", level="ERROR"):
+      timings = preload()
+    self.assertEqual(set(timings), {"urls", "imports", "settings"})
+
+  def test_warmup_worker(self):
+    """
+    ワーカーのウォームアップがクエリを実行せずにすべての手順を実行する
+    """
+    with self.assertNoLogs("accounts.warmup", level="ERROR"), self.assertNumQueries(0):
+      timings = warmup_worker()
+    self.assertEqual(set(timings), {"databases", "tokens", "hash_pool"})
@@ -3,10 +3,59 @@ from .test.model_tests import UserModelTests
 from .test.view_tests import UserViewTests
 from .test.utils_tests import UserUtilsTests
 from .test.permissions_tests import UserPermissionsTests
+from .test.authentication_tests import UserAuthenticationTests, UserAuthenticationModeTests
+from .test.hashers_tests import UserHashersTests
+from .test.hashpool_tests import UserHashPoolTests
+from .test.async_views_tests import UserAsyncViewTests
+from .test.bulk_tests import UserBulkTests
+from .test.batch_tests import UserBatchViewTests
+from .test.revocation_tests import UserRevocationTests
+from .test.keyring_tests import UserKeyringTests, UserVerifierTests
+from .test.introspection_tests import UserIntrospectionTests
+from .test.routers_tests import UserRouterTests, UserReplicaViewTests
+from .test.warmup_tests import UserWarmupTests
+from .test.benchmarks_tests import UserBenchmarkTests, UserBenchmarkTransactionTests
+from .test.metrics_tests import UserMetricsTests
+from .test.throttling_tests import UserThrottlingTests
+from .test.refresh_tests import UserCookieAuthenticationTests, UserSilentRefreshTests
+from .test.renderers_tests import UserRendererTests
+from .test.unique_tests import UserUniqueTests, UserUniqueTransactionTests
+from .test.update_tests import UserUpdateTests
+from .test.activity_tests import UserActivityTests
+from .test.audit_tests import UserAuditTests, UserAuditFlusherTests
+from .test.lean_tests import UserLeanMiddlewareTests
 
 
 class Tests(TestCase):
   UserModelTests()
   UserViewTests()
   UserUtilsTests()
-  UserPermissionsTests()
\ No newline at end of file
+  UserPermissionsTests()
+  UserAuthenticationTests()
+  UserAuthenticationModeTests()
+  UserHashersTests()
+  UserHashPoolTests()
+  UserAsyncViewTests()
+  UserBulkTests()
+  UserBatchViewTests()
+  UserRevocationTests()
+  UserKeyringTests()
+  UserVerifierTests()
+  UserIntrospectionTests()
+  UserRouterTests()
+  UserReplicaViewTests()
+  UserWarmupTests()
+  UserBenchmarkTests()
+  UserBenchmarkTransactionTests()
+  UserMetricsTests()
+  UserThrottlingTests()
+  UserCookieAuthenticationTests()
+  UserSilentRefreshTests()
+  UserRendererTests()
+  UserUniqueTests()
+  UserUniqueTransactionTests()
+  UserUpdateTests()
+  UserActivityTests()
+  UserAuditTests()
+  UserAuditFlusherTests()
+  UserLeanMiddlewareTests()
\ No newline at end of file
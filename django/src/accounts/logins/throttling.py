@@ -0,0 +1,261 @@
+"""
+パスワードをハッシュするエンドポイント(ログイン、サインアップ、トークンの発行)を守るスロットルと負荷制限
+
+TokenBucketThrottle はIP毎、アカウント毎の制限で、トークンバケットをスライディングウィンドウのカウンターで近似する
+カウンターは共有のキャッシュに置き、cache.incr で数えるので、複数のプロセスやスレッドから同時に来ても数え漏れない
+プロセス内にも最後に見たカウンターの写しを持ち、写しで超えていれば共有のキャッシュを見ずに429を返す
+(共有のカウンターは増えるだけなので、写しで超えていれば共有でも超えている)
+
+check_overload はワーカーのハッシュの待ち行列とハッシュの時間、CPUの負荷から過負荷を判定し、
+ハッシュを始める前に503を返して、軽いエンドポイントのためにCPUを残す
+"""
+import hashlib
+import os
+import threading
+import time
+from collections import OrderedDict
+from types import SimpleNamespace
+from django.core.cache import caches
+from django.utils.translation import gettext_lazy as _
+from rest_framework import status
+from rest_framework.exceptions import APIException, Throttled
+from rest_framework.throttling import BaseThrottle
+from .conf import logins_settings
+from .hashpool import hash_pool
+
+KEY = "logins:throttle:%s:%s"
+# プロセス内の写しに持つバケットの最大数
+LOCAL_SIZE = 10000
+PERIODS = {"s": 1, "sec": 1, "m": 60, "min": 60, "h": 3600, "hour": 3600, "d": 86400, "day": 86400}
+
+
+class Overloaded(APIException):
+    """
+    過負荷なのでハッシュが必要なリクエストを断る。DRFが503とRetry-Afterヘッダーを返す
+    """
+    status_code = status.HTTP_503_SERVICE_UNAVAILABLE
+    default_detail = _("The server is overloaded. Try again later.")
+    default_code = "overloaded"
+
+    def __init__(self, wait):
+        super().__init__()
+        self.wait = wait
+
+
+def parse_rate(rate):
+    """
+    "10/min" を (バケットの容量, 毎秒補充する数) にする。Noneなら制限しない
+    """
+    if rate is None:
+        return None
+    count, period = rate.split("/")
+    count = int(count)
+    return count, count / PERIODS[period]
+
+
+class TokenBuckets:
+    """
+    容量 capacity、毎秒 refill 補充するトークンバケットを、期間 capacity / refill 秒の
+    スライディングウィンドウで近似する
+    共有のキャッシュには期間毎のカウンターを置き、直前の期間のカウンターは経過した割合だけ減らして足す
+    断ったリクエストも数えるので、制限を超えて送り続けるとその分長く断られる
+    プロセス内の写しは (期間の番号, 直前の期間のカウンター, この期間のカウンター) のタプル
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._local = OrderedDict()
+
+    def reset(self):
+        with self._lock:
+            self._local.clear()
+
+    def get_cache(self):
+        return caches[logins_settings.THROTTLE_CACHE]
+
+    def _incr(self, cache, key, timeout):
+        try:
+            return cache.incr(key)
+        except ValueError:
+            # この期間の最初のリクエスト。addが負けたら他のプロセスが作ったカウンターを増やす
+            if cache.add(key, 1, timeout=timeout):
+                return 1
+            return cache.incr(key)
+
+    def _wait(self, previous, current, elapsed, period, capacity):
+        """
+        次の1回が許可されるまでの秒数
+        """
+        room = capacity - 1 - current
+        if room >= 0 and previous > 0:
+            # この期間のうちに直前の期間のカウンターの重みが下がる
+            return max(period * (1 - room / previous) - elapsed, 0.0)
+        # 次の期間でこの期間のカウンターの重みが下がるのを待つ
+        return period - elapsed + period * max(0.0, 1 - (capacity - 1) / current)
+
+    def consume(self, key, capacity, refill):
+        """
+        トークンを1つ使う。使えたら0を、使えなければ次のトークンまでの秒数を返す
+        """
+        now = time.time()
+        period = capacity / refill
+        window = int(now // period)
+        elapsed = now - window * period
+        weight = 1 - elapsed / period
+        with self._lock:
+            local = self._local.get(key)
+        previous = None
+        if local is not None:
+            local_window, local_previous, local_current = local
+            if local_window == window:
+                previous = local_previous
+                if previous * weight + local_current + 1 > capacity:
+                    return self._wait(previous, local_current, elapsed, period, capacity)
+            elif local_window == window - 1 and local_current * weight + 1 > capacity:
+                return self._wait(local_current, 0, elapsed, period, capacity)
+
+        cache = self.get_cache()
+        # 直前の期間のカウンターを読むまで残す
+        current = self._incr(cache, "%s:%d" % (key, window), int(2 * period) + 1)
+        if previous is None:
+            # 終わった期間のカウンターは増えないので、1つの期間に1回だけ読む
+            previous = cache.get("%s:%d" % (key, window - 1), 0)
+        with self._lock:
+            self._local[key] = (window, previous, current)
+            self._local.move_to_end(key)
+            while len(self._local) > LOCAL_SIZE:
+                self._local.popitem(last=False)
+        if previous * weight + current <= capacity:
+            return 0
+        return self._wait(previous, current, elapsed, period, capacity)
+
+
+buckets = TokenBuckets()
+
+
+class TokenBucketThrottle(BaseThrottle):
+    """
+    LOGINS["THROTTLE_RATES"][scope] のトークンバケットで制限するスロットル
+    """
+    scope = None
+
+    def get_ident_key(self, request, view):
+        """
+        バケットを識別する文字列。Noneなら制限しない
+        """
+        raise NotImplementedError
+
+    def allow_request(self, request, view):
+        rate = parse_rate(logins_settings.THROTTLE_RATES.get(self.scope))
+        if rate is None:
+            return True
+        ident = self.get_ident_key(request, view)
+        if ident is None:
+            return True
+        self._wait = buckets.consume(KEY % (self.scope, ident), *rate)
+        return self._wait == 0
+
+    def wait(self):
+        return self._wait
+
+
+class IPThrottle(TokenBucketThrottle):
+    """
+    クライアントのIPアドレス毎の制限 (プロキシの扱いはDRFの NUM_PROXIES に従う)
+    NUM_PROXIES が無いとクライアントが送った X-Forwarded-For をそのまま使うので、
+    リクエスト毎に値を変えて制限を逃れられる。settings.py で必ず設定する
+    """
+    scope = "ip"
+
+    def get_ident_key(self, request, view):
+        return self.get_ident(request)
+
+
+class AccountThrottle(TokenBucketThrottle):
+    """
+    リクエストのemail毎の制限。多数のIPから1つのアカウントを狙う攻撃を防ぐ
+    キャッシュのキーにemailを残さないようにハッシュする
+    """
+    scope = "account"
+
+    def get_ident_key(self, request, view):
+        data = getattr(request, "data", None)
+        email = data.get("email") if hasattr(data, "get") else None
+        if not isinstance(email, str) or not email:
+            return None
+        return hashlib.sha1(email.strip().lower().encode()).hexdigest()
+
+
+class LoadAverage:
+    """
+    1秒毎に読み込むCPUあたりのロードアベレージ
+    """
+
+    def __init__(self):
+        self._value = 0.0
+        self._read_at = 0.0
+
+    def get(self):
+        now = time.monotonic()
+        if now - self._read_at >= 1.0:
+            self._read_at = now
+            try:
+                self._value = os.getloadavg()[0] / (os.cpu_count() or 1)
+            except OSError:
+                self._value = 0.0
+        return self._value
+
+
+load_average = LoadAverage()
+
+
+def overload_reason():
+    """
+    過負荷ならその理由を、そうでなければNoneを返す
+    """
+    if hash_pool.pending >= logins_settings.SHED_MAX_PENDING_HASHES:
+        return "hash_queue"
+    max_latency = logins_settings.SHED_MAX_HASH_LATENCY
+    # 断っている間はハッシュの時間が記録されないので、古い値は使わない
+    if max_latency is not None and hash_pool.latency(logins_settings.SHED_WINDOW) > max_latency:
+        return "hash_latency"
+    max_load = logins_settings.SHED_MAX_LOAD
+    if max_load is not None and load_average.get() > max_load:
+        return "cpu"
+    return None
+
+
+def check_overload():
+    """
+    過負荷なら Overloaded を送出する
+    """
+    if overload_reason() is not None:
+        raise Overloaded(logins_settings.SHED_RETRY_AFTER)
+
+
+class LoadShedThrottle(BaseThrottle):
+    """
+    過負荷の時に503を返すスロットル
+    スロットルの最初に置いて、バケットのトークンを使う前に断る
+    """
+
+    def allow_request(self, request, view):
+        check_overload()
+        return True
+
+
+# ハッシュが必要なビューのスロットル
+HASH_HEAVY_THROTTLES = (LoadShedThrottle, IPThrottle, AccountThrottle)
+
+
+def check_throttles(request, data):
+    """
+    DRFのビューではない非同期ビュー用に HASH_HEAVY_THROTTLES を適用する
+    制限されたら Throttled を、過負荷なら Overloaded を送出する
+    """
+    # スロットルが使うのはDRFのRequestの META と data だけ
+    wrapped = SimpleNamespace(META=request.META, data=data)
+    for throttle_class in HASH_HEAVY_THROTTLES:
+        throttle = throttle_class()
+        if not throttle.allow_request(wrapped, None):
+            raise Throttled(wait=throttle.wait())
@@ -0,0 +1,79 @@
+"""
+このアプリで発行するjwt
+"""
+from django.utils.translation import gettext_lazy as _
+from rest_framework_simplejwt import tokens
+from rest_framework_simplejwt.exceptions import TokenError
+from rest_framework_simplejwt.settings import api_settings
+from .conf import logins_settings
+from .keyring import get_token_backend
+from .revocation import revocation_list
+
+# トークンに埋め込むユーザーのクレーム
+USER_CLAIMS = ("user_name", "is_active", "is_staff")
+
+
+def is_revoked(token):
+    """
+    トークンのjtiが失効リストにあるか
+    """
+    jti = token.get(api_settings.JTI_CLAIM)
+    return bool(logins_settings.REVOCATION and jti and revocation_list.is_revoked(jti))
+
+
+class KeyringMixin:
+    """
+    キーリング(logins/keyring.py)で署名、検証するトークン
+    """
+
+    def get_token_backend(self):
+        return get_token_backend()
+
+
+class RevocableMixin(KeyringMixin):
+    """
+    検証時に失効リスト(logins/revocation.py)も確認するトークン
+    """
+
+    def verify(self, *args, **kwargs):
+        super().verify(*args, **kwargs)
+        if is_revoked(self):
+            raise TokenError(_("Token is revoked"))
+
+    def revoke(self):
+        """
+        このトークンを有効期限まで失効させる
+        """
+        revocation_list.revoke(self[api_settings.JTI_CLAIM], self["exp"])
+
+    # ローテーションの時に TokenRefreshSerializer から呼ばれる (BLACKLIST_AFTER_ROTATION)
+    blacklist = revoke
+
+
+class AccessToken(RevocableMixin, tokens.AccessToken):
+    pass
+
+
+class UntypedToken(RevocableMixin, tokens.UntypedToken):
+    pass
+
+
+class SignedToken(KeyringMixin, tokens.UntypedToken):
+    """
+    署名と有効期限だけを検証するトークン (失効はis_revokedで別に確認する)
+    """
+
+
+class RefreshToken(RevocableMixin, tokens.RefreshToken):
+    """
+    ユーザーのクレームを埋め込んだリフレッシュトークン
+    アクセストークンにもクレームがコピーされる
+    """
+    access_token_class = AccessToken
+
+    @classmethod
+    def for_user(cls, user):
+        token = super().for_user(user)
+        for claim in USER_CLAIMS:
+            token[claim] = getattr(user, claim)
+        return token
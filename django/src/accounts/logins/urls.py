@@ -1,21 +1,29 @@
 from django.urls import path
 from rest_framework_simplejwt.views import (
-    TokenObtainPairView,
     TokenRefreshView,
     TokenVerifyView,
 )
-from . import views
+from . import views, async_views
 
 app_name = "logins"
 
 urlpatterns = [
-    path('api/token/', TokenObtainPairView.as_view(), name='token_obtain_pair'),
+    path('api/token/', views.TokenObtainPairView.as_view(), name='token_obtain_pair'),
     path('api/token/refresh/', TokenRefreshView.as_view(), name='token_refresh'),
     path('api/token/verify/', TokenVerifyView.as_view(), name='token_verify'),
+    path('api/token/introspect/', views.TokenIntrospectView.as_view(), name='token_introspect'),
+    path('metrics', views.MetricsView.as_view(), name='metrics'),
+    path('.well-known/jwks.json', views.JWKSView.as_view(), name='jwks'),
     path('api/', views.IndexView.as_view(), name='index'),
     path('api/signup/', views.SignupView.as_view(), name='signup'),
+    path('api/signup/batch/', views.SignupBatchView.as_view(), name='signup_batch'),
+    path('api/update/batch/', views.UpdateBatchView.as_view(), name='update_batch'),
     path('api/update/<int:pk>', views.UpdateView.as_view(), name='update'),
     path('api/update_password/<int:pk>', views.UpdatePasswordView.as_view(), name='update_password'),
     path('api/login', views.LoginView.as_view(), name='login'),
     path('api/logout', views.LogoutView.as_view(), name='logout'),
+    # ASGI用の非同期版
+    path('api/async/signup/', async_views.AsyncSignupView.as_view(), name='async_signup'),
+    path('api/async/login', async_views.AsyncLoginView.as_view(), name='async_login'),
+    path('api/async/logout', async_views.AsyncLogoutView.as_view(), name='async_logout'),
 ]
\ No newline at end of file
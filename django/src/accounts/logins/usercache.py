@@ -0,0 +1,82 @@
+"""
+JWT認証で使うプロセス内のユーザーキャッシュ
+"""
+import threading
+import time
+from collections import OrderedDict
+from .conf import logins_settings
+
+
+class UserCache:
+    """
+    主キーでユーザーを保持するLRU/TTLキャッシュ
+    モデルのインスタンスは共有せず、取得の度に新しいインスタンスを作って返す
+    トークンのuser_idは文字列なので、キーは文字列にそろえる
+    """
+
+    def __init__(self):
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        # 無効化の度に増える。読み込み中に無効化された古い値を登録しないために使う
+        self._generation = 0
+
+    def get_or_load(self, pk, loader):
+        """
+        キャッシュにあればそのユーザーを、なければloader()で取得して登録する
+        """
+        user, generation = self._lookup(pk)
+        if user is None:
+            user = loader()
+            self._store(pk, user, generation)
+        return user
+
+    async def aget_or_load(self, pk, loader):
+        """
+        get_or_loadの非同期版。loader()はコルーチンを返す
+        """
+        user, generation = self._lookup(pk)
+        if user is None:
+            user = await loader()
+            self._store(pk, user, generation)
+        return user
+
+    def _lookup(self, pk):
+        with self._lock:
+            entry = self._entries.get(str(pk))
+            if entry is not None and entry[0] > time.monotonic():
+                self._entries.move_to_end(str(pk))
+                return self._build(entry), None
+            return None, self._generation
+
+    def _store(self, pk, user, generation):
+        entry = (time.monotonic() + logins_settings.USER_CACHE_TTL,
+                 user._state.db,
+                 [field.attname for field in user._meta.concrete_fields],
+                 [getattr(user, field.attname) for field in user._meta.concrete_fields],
+                 type(user))
+        with self._lock:
+            if generation == self._generation:
+                self._entries[str(pk)] = entry
+                self._entries.move_to_end(str(pk))
+                while len(self._entries) > logins_settings.USER_CACHE_SIZE:
+                    self._entries.popitem(last=False)
+
+    def invalidate(self, pk):
+        with self._lock:
+            self._generation += 1
+            self._entries.pop(str(pk), None)
+
+    def clear(self):
+        with self._lock:
+            self._generation += 1
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _build(self, entry):
+        _, db, field_names, values, model = entry
+        return model.from_db(db, field_names, values)
+
+
+user_cache = UserCache()
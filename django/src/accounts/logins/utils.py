@@ -1,38 +1,110 @@
 """
 このアプリで使うカスタムメソッド達
 """
-from rest_framework_simplejwt.tokens import RefreshToken
-from rest_framework_simplejwt.authentication import JWTAuthentication
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.middleware.csrf import rotate_token
 from rest_framework import status
 from rest_framework.response import Response
 import datetime
+from . import metrics
+from .conf import logins_settings
+from .authentication import ACCESS_COOKIE, REFRESH_COOKIE, JWTAuthentication
+from rest_framework_simplejwt.exceptions import TokenError
+from .tokens import RefreshToken
 
 def get_jwt(user):
     """
     jwtを発行する
     """
     try:
-      refresh = RefreshToken.for_user(user)
-      return {
-        'refresh': str(refresh),
-        'access': str(refresh.access_token),
-      }
+      with metrics.timer(metrics.token_sign_duration):
+        refresh = RefreshToken.for_user(user)
+        return {
+          'refresh': str(refresh),
+          'access': str(refresh.access_token),
+        }
     except:
       return {}
 
-def get_jwt_and_set_cookie(user, response):
+def get_jwt_and_set_cookie(user, response, request=None):
     """
     jwtを発行して、クッキーにセットする
+    requestを渡すと(ログイン、サインアップ)、CSRFトークンのクッキーも新しくする
     """
     token = get_jwt(user)
     if(token):
-      response.set_cookie("Authorization", "JWT "+token["access"], httponly=True, max_age=datetime.timedelta(minutes=30))
-      response.set_cookie("refresh", token["refresh"], httponly=True, max_age=datetime.timedelta(days=14))
+      set_jwt_cookie(token, response)
+      if request is not None:
+        set_csrf_cookie(request, response)
+    return response
+
+def set_csrf_cookie(request, response):
+    """
+    クッキーで認証するクライアントが X-CSRFToken ヘッダーで送り返すCSRFトークンのクッキーを、
+    django.contrib.auth.login と同じくログインの度に新しくしてセットする
+    APIのパスではCsrfViewMiddlewareがクッキーをセットしないので(logins/browser.py)、ここでセットする
+    """
+    if not (logins_settings.AUTH_COOKIE and logins_settings.AUTH_COOKIE_ENFORCE_CSRF):
+      return response
+    rotate_token(request)
+    response.set_cookie(settings.CSRF_COOKIE_NAME, request.META["CSRF_COOKIE"],
+                        max_age=settings.CSRF_COOKIE_AGE,
+                        domain=settings.CSRF_COOKIE_DOMAIN,
+                        path=settings.CSRF_COOKIE_PATH,
+                        secure=settings.CSRF_COOKIE_SECURE,
+                        httponly=settings.CSRF_COOKIE_HTTPONLY,
+                        samesite=settings.CSRF_COOKIE_SAMESITE)
+    return response
+
+def set_jwt_cookie(token, response):
+    """
+    get_jwtやローテーションで発行したjwtをクッキーにセットする
+    リフレッシュトークンが無ければ(ローテーションしない設定)アクセストークンだけをセットする
+    """
+    response.set_cookie(ACCESS_COOKIE, "JWT "+token["access"], httponly=True, max_age=datetime.timedelta(minutes=30))
+    if "refresh" in token:
+      response.set_cookie(REFRESH_COOKIE, token["refresh"], httponly=True, max_age=datetime.timedelta(days=14))
     return response
 
 def verify_jwt(request):
     """
-    リクエストのヘッダーにあるjwtを使ってユーザー認証する
+    リクエストのヘッダー(無ければクッキー)にあるjwtを使ってユーザー認証する
     [User,payload]か、Noneを返す
+    検証結果はリクエスト単位でメモ化され、認証クラスやパーミッションと共有される
+    """
+    return JWTAuthentication().authenticate(request)
+
+def revoke_jwt(request, access_token):
+    """
+    ログアウトしたアクセストークンと、クッキーにあるリフレッシュトークンを失効させる
+    """
+    access_token.revoke()
+    raw_refresh = request.COOKIES.get(REFRESH_COOKIE)
+    if raw_refresh:
+        try:
+            RefreshToken(raw_refresh).revoke()
+        except TokenError:
+            # 期限切れや失効済みのリフレッシュトークンはそのままでよい
+            pass
+
+async def averify_jwt(request):
+    """
+    verify_jwtの非同期版
+    [User,payload]か、Noneを返す
+    """
+    return await JWTAuthentication().aauthenticate(request)
+
+async def aget_jwt_and_set_cookie(user, response, request=None):
+    """
+    get_jwt_and_set_cookieの非同期版
+    署名 (RS256などはCPUを使う) でイベントループを塞がないようにスレッドで実行する
+    """
+    return await sync_to_async(get_jwt_and_set_cookie, thread_sensitive=False)(user, response, request)
+
+async def arevoke_jwt(request, access_token):
+    """
+    revoke_jwtの非同期版
+    共有のキャッシュへの書き込みでイベントループを塞がないようにスレッドで実行する
     """
-    return JWTAuthentication().authenticate(request)
\ No newline at end of file
+    await sync_to_async(revoke_jwt, thread_sensitive=False)(request, access_token)
@@ -0,0 +1,121 @@
+"""
+他のPythonサービスでこのアプリのjwtをローカルで検証するためのモジュール
+Djangoに依存せず、PyJWT(非対称鍵の場合はcryptographyも)だけで動く
+
+    verifier = JWKSVerifier("https://accounts.example.com/.well-known/jwks.json")
+    claims = verifier.verify(token)
+
+公開鍵はJWKSエンドポイントから取得してCache-Controlのmax-ageの間キャッシュし、
+期限が切れたらETagで条件付きリクエストを送る。知らないkidのトークンが来た時は
+鍵のローテーションとみなして取得し直す (min_refresh_interval 秒に1回まで)
+ローカルの検証では失効リストを確認できないので、アクセストークンの有効期限は短くしておく
+"""
+import json
+import re
+import threading
+import time
+import urllib.error
+import urllib.request
+import jwt
+
+MAX_AGE_PATTERN = re.compile(r"max-age=(\d+)")
+
+
+class JWKSVerifier:
+
+    def __init__(self, jwks_url, algorithms=("RS256", "EdDSA"), audience=None, issuer=None,
+                 leeway=0, token_type="access", default_max_age=300, min_refresh_interval=30, timeout=5):
+        self.jwks_url = jwks_url
+        self.algorithms = list(algorithms)
+        self.audience = audience
+        self.issuer = issuer
+        self.leeway = leeway
+        # Noneならtoken_typeクレームを確認しない
+        self.token_type = token_type
+        self.default_max_age = default_max_age
+        self.min_refresh_interval = min_refresh_interval
+        self.timeout = timeout
+        self._lock = threading.Lock()
+        self._keys = {}
+        self._etag = None
+        self._expires_at = 0.0
+        self._fetched_at = -float("inf")
+
+    def verify(self, token):
+        """
+        トークンを検証してクレームを返す
+        無効なトークンは jwt.InvalidTokenError を送出する
+        """
+        kid = jwt.get_unverified_header(token).get("kid")
+        key = self.get_key(kid)
+        if key is None:
+            raise jwt.InvalidTokenError("Unknown key id: %s" % kid)
+        claims = jwt.decode(token, key.key,
+                            algorithms=[key.algorithm_name],
+                            audience=self.audience,
+                            issuer=self.issuer,
+                            leeway=self.leeway,
+                            options={"verify_aud": self.audience is not None})
+        if self.token_type is not None and claims.get("token_type") != self.token_type:
+            raise jwt.InvalidTokenError("Token has wrong type")
+        return claims
+
+    def get_key(self, kid):
+        """
+        kidのPyJWKを返す。無ければNone
+        """
+        now = time.monotonic()
+        key = self._keys.get(kid)
+        if key is not None and now < self._expires_at:
+            return key
+        with self._lock:
+            now = time.monotonic()
+            expired = now >= self._expires_at
+            unknown = kid not in self._keys and now - self._fetched_at >= self.min_refresh_interval
+            if expired or unknown:
+                self.refresh()
+            return self._keys.get(kid)
+
+    def refresh(self):
+        """
+        JWKSを取得し直す。取得に失敗した時はキャッシュしている鍵を使い続ける
+        """
+        headers = {"Accept": "application/json"}
+        if self._etag:
+            headers["If-None-Match"] = self._etag
+        self._fetched_at = time.monotonic()
+        try:
+            status, response_headers, body = self._request(headers)
+        except (OSError, urllib.error.URLError):
+            # 次の取得まで min_refresh_interval 秒待つ
+            self._expires_at = self._fetched_at + self.min_refresh_interval
+            return
+        if status == 200:
+            self._keys = self._parse(body)
+            self._etag = response_headers.get("ETag")
+        match = MAX_AGE_PATTERN.search(response_headers.get("Cache-Control", ""))
+        max_age = int(match.group(1)) if match else self.default_max_age
+        self._expires_at = self._fetched_at + max_age
+
+    def _request(self, headers):
+        request = urllib.request.Request(self.jwks_url, headers=headers)
+        try:
+            with urllib.request.urlopen(request, timeout=self.timeout) as response:
+                return response.status, response.headers, response.read()
+        except urllib.error.HTTPError as e:
+            if e.code == 304:
+                return 304, e.headers, b""
+            raise
+
+    def _parse(self, body):
+        keys = {}
+        for data in json.loads(body).get("keys", []):
+            if data.get("alg") not in self.algorithms:
+                continue
+            try:
+                key = jwt.PyJWK(data)
+            except jwt.PyJWKError:
+                # cryptographyが無いなど、このプロセスで使えない鍵は無視する
+                continue
+            keys[data.get("kid")] = key
+        return keys
@@ -1,26 +1,86 @@
-from django.contrib.auth.hashers import check_password
+from django.core.exceptions import ValidationError
+from django.db import DEFAULT_DB_ALIAS
+from django.http import HttpResponse, StreamingHttpResponse
 from rest_framework import status
-from rest_framework.permissions import AllowAny,IsAuthenticated
+from rest_framework.permissions import AllowAny,IsAuthenticated,IsAdminUser
+from rest_framework.views import APIView
 from rest_framework.generics import ListAPIView, CreateAPIView, UpdateAPIView, DestroyAPIView
 from rest_framework.response import Response
+from rest_framework_simplejwt import views as jwt_views
+from . import listcache, metrics, renderers
+from .audit import audit_log
+from .conf import logins_settings
+from .hashpool import hash_pool
+from .introspection import introspect_tokens
+from .keyring import get_jwks
+from .pagination import UserCursorPagination
 from .serializer import UserSerializer
-from .models import User
-from .permissions import OnlyYouPerm, OnlyLogoutPerm
-from .utils import get_jwt_and_set_cookie, verify_jwt
+from .throttling import HASH_HEAVY_THROTTLES
+from .models import UNIQUE_MESSAGE, AuthEvent, BulkUniqueError, StaleUpdate, User, make_etag, parse_if_match
+from .permissions import MetricsPerm, OnlyYouPerm, OnlyLogoutPerm
+from .routers import use_primary
+from .utils import get_jwt_and_set_cookie, verify_jwt, revoke_jwt
     
 class IndexView(ListAPIView):
     """
     ユーザー一覧用ビュー 
+    idのカーソルでページネーションする
+    ?stream=1 の時は全ユーザーをJSONの配列としてストリーミングする
+    ページはキャッシュされ、ETagが一致すれば304を返す
     """
     permission_classes = (AllowAny,)
     queryset = User.objects.all()
     serializer_class = UserSerializer
+    pagination_class = UserCursorPagination
+    stream_fields = ("id", "user_name", "email")
+
+    def list(self, request, *args, **kwargs):
+        if request.query_params.get("stream") in ("1", "true"):
+            return StreamingHttpResponse(self.stream_users(), content_type="application/json")
+
+        version = listcache.get_version()
+        key = listcache.page_key(request)
+        etag = listcache.make_etag(version, key)
+        if listcache.etag_matches(etag, request.headers.get("If-None-Match", "")):
+            listcache.stats.incr("not_modified")
+            return Response(status=status.HTTP_304_NOT_MODIFIED, headers={"ETag": etag, "Vary": "Accept"})
+
+        data = listcache.get_page(version, key)
+        cache_status = "HIT"
+        if data is None:
+            data = super().list(request, *args, **kwargs).data
+            listcache.set_page(version, key, data)
+            cache_status = "MISS"
+        # 同じページをJSONとMessagePackで返すので、HTTPキャッシュはAcceptで区別させる
+        return Response(data, headers={"ETag": etag, "X-Cache": cache_status, "Vary": "Accept"})
+
+    def stream_users(self):
+        """
+        idのキーセットでチャンク毎に読み込み、モデルもリスト全体も作らずにJSONを返す
+        """
+        chunk_size = logins_settings.INDEX_STREAM_CHUNK_SIZE
+        queryset = self.get_queryset().order_by("id").values(*self.stream_fields)
+        last_id = None
+        yield b"["
+        while True:
+            chunk = queryset if last_id is None else queryset.filter(id__gt=last_id)
+            rows = list(chunk[:chunk_size].iterator(chunk_size=chunk_size))
+            if not rows:
+                break
+            separator = b"" if last_id is None else b","
+            # チャンクを1回でエンコードして、配列の括弧を外してつなぐ
+            yield separator + renderers.JSONRenderer().render(rows)[1:-1]
+            last_id = rows[-1]["id"]
+            if len(rows) < chunk_size:
+                break
+        yield b"]"
 
 class SignupView(CreateAPIView):
     """
     ユーザー登録用ビュー 
     """
     permission_classes = (AllowAny,)
+    throttle_classes = HASH_HEAVY_THROTTLES
     queryset = User.objects.all()
     serializer_class = UserSerializer
     valid_fields = ("user_name",
@@ -34,18 +94,25 @@ class SignupView(CreateAPIView):
         user_name = serializer.validated_data["user_name"]
         email = serializer.validated_data["email"]
         password = serializer.validated_data["password"]
-        user = serializer.create(user_name=user_name,
-                                 email=email,
-                                 password=password)
+        try:
+          # 重複は事前に調べず、INSERTの一意制約の違反をフィールド毎のエラーにする
+          user = serializer.create(user_name=user_name,
+                                   email=email,
+                                   password=password)
+        except ValidationError as e:
+          return Response(e.message_dict, status=status.HTTP_400_BAD_REQUEST)
+        audit_log.record(AuthEvent.Kind.SIGNUP, user.pk, request)
         # jwtを発行してクッキーにセットする。そのレスポンスを返す
         response = Response(serializer.validated_data, status=status.HTTP_201_CREATED)
-        responce = get_jwt_and_set_cookie(user, response)
+        responce = get_jwt_and_set_cookie(user, response, request)
         return responce
       return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
     
 class UpdateView(UpdateAPIView):
     """
     ユーザー更新用ビュー 
+    値が変わったカラムだけを更新し、レスポンスのETagでupdated_atを返す
+    If-Matchを付けると、そのETagから他のリクエストが更新していた時は412を返す
     """
     permission_classes = (IsAuthenticated, OnlyYouPerm,)
     queryset = User.objects.all()
@@ -53,43 +120,57 @@ class UpdateView(UpdateAPIView):
     valid_fields = ("user_name",
                     "email",
                     )
+    # 更新できた時に記録する監査ログのイベント
+    audit_kind = None
+
+    def get_user(self):
+        """
+        更新対象はパーミッションで認証したユーザー自身なので、このリクエストでプライマリから
+        取得したものならそのまま使う
+        ユーザーのキャッシュ(AUTH_USER_MODE="cache")やレプリカから取得したユーザーは他のプロセスの
+        更新より古いことがあり、変わっていない値の比較やIf-Matchを誤るので、プライマリから取得し直す
+        クレームだけのユーザー(AUTH_USER_MODE="claims")の時も同じく取得する
+        """
+        user = self.request.user
+        if (isinstance(user, User) and user.pk == self.kwargs['pk']
+                and logins_settings.AUTH_USER_MODE == "db" and user._state.db == DEFAULT_DB_ALIAS):
+            return user
+        with use_primary():
+            return User.objects.get(pk=self.kwargs['pk'])
 
     def patch(self, request, format=None, *args, **kwargs):
         serializer = self.serializer_class(data=request.data)
         if serializer.is_valid(valid_fields=self.valid_fields):
-            user = User.objects.get(pk=self.kwargs['pk'])
-            user = serializer.update(user ,serializer.validated_data)
+            if_match = parse_if_match(request.headers.get("If-Match"))
+            try:
+                user = serializer.update(self.get_user(), serializer.validated_data, if_match)
+            except ValidationError as e:
+                return Response(e.message_dict, status=status.HTTP_400_BAD_REQUEST)
+            except StaleUpdate:
+                return Response({"detail": "The user has been modified."},
+                                status=status.HTTP_412_PRECONDITION_FAILED)
+            if self.audit_kind is not None:
+                audit_log.record(self.audit_kind, user.pk, request)
             # jwtを発行してクッキーにセットする。そのレスポンスを返す
-            response = Response(serializer.validated_data, status=status.HTTP_200_OK)
+            response = Response(serializer.validated_data, status=status.HTTP_200_OK,
+                                headers={"ETag": make_etag(user.updated_at)})
             responce = get_jwt_and_set_cookie(user, response)
             return responce
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
     
-class UpdatePasswordView(UpdateAPIView):
+class UpdatePasswordView(UpdateView):
     """
     パスワード更新用ビュー 
     """
-    permission_classes = (IsAuthenticated, OnlyYouPerm,)
-    queryset = User.objects.all()
-    serializer_class = UserSerializer
     valid_fields = ("password",)
-
-    def patch(self, request, format=None, *args, **kwargs):
-        serializer = self.serializer_class(data=request.data)
-        if serializer.is_valid(valid_fields=self.valid_fields):
-            user = User.objects.get(pk=self.kwargs['pk'])
-            user = serializer.update(user ,serializer.validated_data)
-            # jwtを発行してクッキーにセットする。そのレスポンスを返す
-            response = Response(serializer.validated_data, status=status.HTTP_200_OK)
-            responce = get_jwt_and_set_cookie(user, response)
-            return responce
-        return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+    audit_kind = AuthEvent.Kind.PASSWORD_CHANGE
     
 class LoginView(CreateAPIView):
     """
     ログイン用ビュー 
     """
     permission_classes = (AllowAny, OnlyLogoutPerm,)
+    throttle_classes = HASH_HEAVY_THROTTLES
     queryset = User.objects.all()
     serializer_class = UserSerializer
     valid_fields = ("email",
@@ -101,14 +182,16 @@ class LoginView(CreateAPIView):
       if serializer.is_valid(valid_fields=self.valid_fields):
         email = serializer.validated_data["email"]
         password = serializer.validated_data["password"]
-        user_list = User.objects.filter(email=email)
-        if user_list and check_password(password, user_list[0].password):
-            user = user_list[0]
+        # ハッシュがポリシーと違えば、ログイン成功時に再ハッシュして保存される
+        user = User.objects.check_login(email, password)
+        if user is not None:
+            audit_log.record(AuthEvent.Kind.LOGIN, user.pk, request)
             # jwtを発行してクッキーにセットする。そのレスポンスを返す
             response = Response(serializer.validated_data, status=status.HTTP_201_CREATED)
-            responce = get_jwt_and_set_cookie(user, response)
+            responce = get_jwt_and_set_cookie(user, response, request)
             return responce
         else:
+            audit_log.record(AuthEvent.Kind.LOGIN_FAILED, None, request)
             return Response(serializer.errors, status=status.HTTP_401_UNAUTHORIZED)
       return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
     
@@ -119,9 +202,260 @@ class LogoutView(DestroyAPIView):
     permission_classes = (IsAuthenticated,)          
     
     def delete(self, request, *args, **kwargs):
-      if(verify_jwt(request)):
+      objects = verify_jwt(request)
+      if(objects):
+            # トークンを失効させて、クッキーを削除する
+            revoke_jwt(request, objects[1])
+            audit_log.record(AuthEvent.Kind.LOGOUT, objects[0].pk, request)
             response = Response(status=status.HTTP_200_OK)
             response.delete_cookie("Authorization")
             response.delete_cookie("refresh")
             return response
       return Response(status=status.HTTP_401_UNAUTHORIZED)
+
+class TokenObtainPairView(jwt_views.TokenObtainPairView):
+    """
+    トークン発行用ビュー。ログインと同じくパスワードを検証するのでスロットルをかける
+    """
+    throttle_classes = HASH_HEAVY_THROTTLES
+
+class JWKSView(APIView):
+    """
+    トークンの検証に使う公開鍵(JWKS)を返すビュー
+    他のサービスはこれをキャッシュしてローカルで検証する (logins/verifier.py)
+    本文とETagは鍵の設定から一度だけ作る
+    """
+    permission_classes = (AllowAny,)
+    authentication_classes = ()
+
+    def get(self, request, *args, **kwargs):
+        body, etag = get_jwks()
+        if listcache.etag_matches(etag, request.headers.get("If-None-Match", "")):
+            response = HttpResponse(status=status.HTTP_304_NOT_MODIFIED)
+        else:
+            response = HttpResponse(body, content_type="application/json")
+        response["ETag"] = etag
+        response["Cache-Control"] = "public, max-age=%d" % logins_settings.JWKS_MAX_AGE
+        return response
+
+class MetricsView(APIView):
+    """
+    メトリクスをPrometheusのテキスト形式で返すビュー
+    全プロセスの値を足し合わせる。METRICS_ALLOWED_IPS と METRICS_TOKEN で制限する
+    """
+    permission_classes = (MetricsPerm,)
+    authentication_classes = ()
+
+    def get(self, request, *args, **kwargs):
+        if not metrics.enabled():
+            return HttpResponse(status=status.HTTP_404_NOT_FOUND)
+        return HttpResponse(metrics.render(metrics.registry.collect()),
+                            content_type="text/plain; version=0.0.4; charset=utf-8")
+
+class TokenIntrospectView(APIView):
+    """
+    トークンをまとめて検証するビュー (api/token/verify/ のバッチ版)
+    {"tokens": [...]} を受け取り、同じ順番で {"results": [{active, revoked, claims, error}, ...]} を返す
+    """
+    permission_classes = (AllowAny,)
+    authentication_classes = ()
+
+    def post(self, request, *args, **kwargs):
+        tokens = request.data.get("tokens") if isinstance(request.data, dict) else None
+        if not isinstance(tokens, list) or not all(isinstance(token, str) for token in tokens):
+            return Response({"detail": "Expected a list of tokens."},
+                            status=status.HTTP_400_BAD_REQUEST)
+        if len(tokens) > logins_settings.BATCH_MAX_SIZE:
+            return Response({"detail": "A batch can contain at most %d tokens." % logins_settings.BATCH_MAX_SIZE},
+                            status=status.HTTP_400_BAD_REQUEST)
+        return Response({"results": introspect_tokens(tokens)})
+
+class BatchMixin:
+    """
+    ユーザーの配列を受け取るバッチ用ビューの共通処理
+    結果はリクエストと同じ順番の配列で、要素毎にstatusとuserかerrorsを持つ
+    """
+    permission_classes = (IsAdminUser,)
+    serializer_class = UserSerializer
+
+    def get_items(self, request):
+        """
+        リクエストボディの配列を返す。配列でないか多すぎる場合はエラーのレスポンスを返す
+        """
+        items = request.data
+        if not isinstance(items, list):
+            return None, Response({"detail": "Expected a list of users."},
+                                  status=status.HTTP_400_BAD_REQUEST)
+        if len(items) > logins_settings.BATCH_MAX_SIZE:
+            return None, Response({"detail": "A batch can contain at most %d users." % logins_settings.BATCH_MAX_SIZE},
+                                  status=status.HTTP_400_BAD_REQUEST)
+        return items, None
+
+    def validate_item(self, item, required_fields):
+        """
+        1要素をUserSerializerで検証して (validated_data, errors) を返す
+        """
+        if not isinstance(item, dict):
+            return None, {"detail": ["Expected an object."]}
+        serializer = self.serializer_class(data=item)
+        serializer.is_valid(valid_fields=self.valid_fields)
+        errors = dict(serializer.errors)
+        for field in required_fields:
+            if field not in errors and field not in serializer.validated_data:
+                errors[field] = ["This field is required."]
+        return (None, errors) if errors else (serializer.validated_data, None)
+
+    def check_conflicts(self, results, items):
+        """
+        user_nameとemailの重複をフィールド毎に1回のクエリで調べて、
+        重複したresultsの要素をエラーにする (バッチ内の重複も含む、大文字小文字は区別しない)
+        更新では要素のid (data["id"]) のユーザー自身が使っている値だけを重複から除く
+        """
+        taken_user_names, taken_emails = User.objects.find_conflicts(
+            [data["user_name"] for _, data in items if "user_name" in data],
+            [data["email"] for _, data in items if "email" in data])
+        kept = []
+        for index, data in items:
+            errors = {}
+            user_id = data.get("id")
+            for field, taken in (("user_name", taken_user_names), ("email", taken_emails)):
+                if field in data and taken.get(data[field].lower(), user_id) != user_id:
+                    errors[field] = [UNIQUE_MESSAGE % field]
+            if errors:
+                results[index] = {"status": status.HTTP_400_BAD_REQUEST, "errors": errors}
+                continue
+            # 更新しないフィールドは重複の対象にしない
+            if "user_name" in data:
+                taken_user_names[data["user_name"].lower()] = user_id
+            if "email" in data:
+                taken_emails[data["email"].lower()] = user_id
+            kept.append((index, data))
+        return kept
+
+    def save_users(self, results, items, users, save):
+        """
+        save(users) で保存し、他のリクエストとの競合で一意制約に違反したユーザーの要素を400にする
+        保存できたユーザーの (resultsの添字, user) のリストを返す
+        """
+        try:
+            save(users)
+        except BulkUniqueError as e:
+            for position, errors in e.errors.items():
+                results[items[position][0]] = {"status": status.HTTP_400_BAD_REQUEST, "errors": errors}
+            return [(index, user) for position, ((index, _), user) in enumerate(zip(items, users))
+                    if position not in e.errors]
+        return [(index, user) for (index, _), user in zip(items, users)]
+
+    def batch_response(self, results, success_status):
+        """
+        全て成功なら success_status、全て失敗なら400、一部成功なら207を返す
+        """
+        succeeded = sum(1 for result in results if result["status"] == success_status)
+        if succeeded == len(results):
+            response_status = success_status
+        elif succeeded == 0:
+            response_status = status.HTTP_400_BAD_REQUEST
+        else:
+            response_status = status.HTTP_207_MULTI_STATUS
+        return Response(results, status=response_status)
+
+    def user_data(self, user):
+        return {"id": user.pk, "user_name": user.user_name, "email": user.email}
+
+class SignupBatchView(BatchMixin, CreateAPIView):
+    """
+    ユーザー一括登録用ビュー
+    検証と重複検査をまとめて行い、有効なユーザーを1つのトランザクションで bulk_create する
+    """
+    queryset = User.objects.all()
+    valid_fields = ("user_name",
+                    "email",
+                    "password",
+                    )
+
+    def post(self, request, format=None, *args, **kwargs):
+        items, error_response = self.get_items(request)
+        if error_response:
+            return error_response
+        results = [None] * len(items)
+        valid = []
+        for index, item in enumerate(items):
+            data, errors = self.validate_item(item, self.valid_fields)
+            if errors:
+                results[index] = {"status": status.HTTP_400_BAD_REQUEST, "errors": errors}
+            else:
+                data["email"] = User.objects.normalize_email(data["email"])
+                valid.append((index, data))
+        valid = self.check_conflicts(results, valid)
+
+        users = []
+        for _, data in valid:
+            user = User(user_name=data["user_name"], email=data["email"])
+            user.set_password(data["password"])
+            users.append(user)
+        if users:
+            for index, user in self.save_users(results, valid, users, User.objects.bulk_create_users):
+                audit_log.record(AuthEvent.Kind.SIGNUP, user.pk, request)
+                results[index] = {"status": status.HTTP_201_CREATED, "user": self.user_data(user)}
+        return self.batch_response(results, status.HTTP_201_CREATED)
+
+class UpdateBatchView(BatchMixin, UpdateAPIView):
+    """
+    ユーザー一括更新用ビュー
+    要素毎にidと更新するフィールドを受け取り、対象のユーザーを1回のクエリで取得して
+    1つのトランザクションで bulk_update する
+    """
+    queryset = User.objects.all()
+    valid_fields = ("user_name",
+                    "email",
+                    "password",
+                    )
+
+    def patch(self, request, format=None, *args, **kwargs):
+        items, error_response = self.get_items(request)
+        if error_response:
+            return error_response
+        results = [None] * len(items)
+        valid = []
+        for index, item in enumerate(items):
+            data, errors = self.validate_item(item, ())
+            user_id = item.get("id") if isinstance(item, dict) else None
+            if not isinstance(user_id, int) or isinstance(user_id, bool):
+                errors = {**(errors or {}), "id": ["A valid integer is required."]}
+            if errors:
+                results[index] = {"status": status.HTTP_400_BAD_REQUEST, "errors": errors}
+                continue
+            if "email" in data:
+                data["email"] = User.objects.normalize_email(data["email"])
+            valid.append((index, {**data, "id": user_id}))
+
+        users = User.objects.in_bulk([data["id"] for _, data in valid])
+        found = []
+        for index, data in valid:
+            if data["id"] in users:
+                found.append((index, data))
+            else:
+                results[index] = {"status": status.HTTP_404_NOT_FOUND, "errors": {"id": ["User not found."]}}
+        found = self.check_conflicts(results, found)
+
+        fields = set()
+        updated = []
+        for index, data in found:
+            user = users[data["id"]]
+            for key, value in data.items():
+                if key == "password":
+                    user.set_password(value)
+                elif key != "id":
+                    setattr(user, key, value)
+                fields.add(key)
+            updated.append(user)
+            results[index] = {"status": status.HTTP_200_OK, "user": self.user_data(user)}
+        fields.discard("id")
+        if updated and fields:
+            saved = self.save_users(results, found, updated,
+                                    lambda users: User.objects.bulk_update_users(users, sorted(fields)))
+            passwords = {index for index, data in found if "password" in data}
+            for index, user in saved:
+                if index in passwords:
+                    audit_log.record(AuthEvent.Kind.PASSWORD_CHANGE, user.pk, request)
+        return self.batch_response(results, status.HTTP_200_OK)